@@ -0,0 +1,400 @@
+"""
+Offline benchmark for the message handling path.
+
+Runs CallbackHandler against local stand-ins for the DingTalk endpoints
+(gettoken, file download, image host, session webhook, batchSend) and a
+stubbed DashScope MultiModalConversation.call, so throughput and latency
+can be measured without network access or API keys.
+
+Simulated users send picture and '历史' messages in a closed loop; the
+run is repeated for each database mode and reports p50/p95/p99 latency,
+throughput and time spent in the database.
+
+    python benchmark.py --users 20 --messages 20 --vl-latency 800
+"""
+import argparse
+import asyncio
+import io
+import json
+import logging
+import os
+import random
+import shutil
+import tempfile
+import threading
+import time
+import uuid
+from http.server import BaseHTTPRequestHandler, ThreadingHTTPServer
+from types import SimpleNamespace
+from unittest.mock import patch
+
+import numpy as np
+from PIL import Image, ImageDraw
+
+from config import Config
+from services import resilience
+from services.stream_handler import CallbackHandler
+
+logger = logging.getLogger(__name__)
+
+MODES = {
+    # name -> DB_POOL_ENABLED
+    "unpooled": False,
+    "pooled": True,
+}
+
+
+def _make_image():
+    """A phone-camera sized JPEG so the preprocessing path does real work."""
+    img = Image.new("RGB", (3000, 4000), (200, 210, 200))
+    draw = ImageDraw.Draw(img)
+    for i in range(0, 4000, 40):
+        draw.line([(0, i), (3000, 4000 - i)], fill=(i % 255, 80, 120), width=3)
+    buf = io.BytesIO()
+    img.save(buf, format="JPEG", quality=90)
+    return buf.getvalue()
+
+
+class FakeDingTalkServer:
+    """
+    Local HTTP server standing in for the DingTalk APIs and the image host.
+    Every request sleeps `latency` seconds before answering.
+    """
+
+    def __init__(self, latency=0.0):
+        self.latency = latency
+        self.image = _make_image()
+        self.requests = {}
+        self._lock = threading.Lock()
+        self._server = ThreadingHTTPServer(("127.0.0.1", 0), self._handler_class())
+        self._server.daemon_threads = True
+        self._thread = threading.Thread(target=self._server.serve_forever, daemon=True)
+
+    @property
+    def base_url(self):
+        host, port = self._server.server_address
+        return f"http://{host}:{port}"
+
+    def start(self):
+        self._thread.start()
+        return self
+
+    def stop(self):
+        self._server.shutdown()
+        self._server.server_close()
+
+    def _count(self, path):
+        with self._lock:
+            self.requests[path] = self.requests.get(path, 0) + 1
+
+    def _handler_class(self):
+        fake = self
+
+        class Handler(BaseHTTPRequestHandler):
+            protocol_version = "HTTP/1.1"
+
+            def log_message(self, format, *args):
+                pass
+
+            def _send(self, body, content_type="application/json"):
+                if isinstance(body, dict):
+                    body = json.dumps(body).encode("utf-8")
+                self.send_response(200)
+                self.send_header("Content-Type", content_type)
+                self.send_header("Content-Length", str(len(body)))
+                self.end_headers()
+                self.wfile.write(body)
+
+            def _read_json(self):
+                length = int(self.headers.get("Content-Length") or 0)
+                return json.loads(self.rfile.read(length) or b"{}")
+
+            def do_GET(self):
+                path = self.path.split("?")[0]
+                fake._count("/images" if path.startswith("/images/") else path)
+                time.sleep(fake.latency)
+                if path == "/gettoken":
+                    self._send({"errcode": 0, "access_token": "bench-token", "expires_in": 7200})
+                elif path.startswith("/images/"):
+                    self._send(fake.image, "image/jpeg")
+                else:
+                    self.send_error(404)
+
+            def do_POST(self):
+                path = self.path.split("?")[0]
+                fake._count(path)
+                body = self._read_json()
+                time.sleep(fake.latency)
+                if path == "/v1.0/robot/messageFiles/download":
+                    self._send({"downloadUrl": f"{fake.base_url}/images/{body.get('downloadCode')}.jpg"})
+                elif path == "/v1.0/robot/oToMessages/batchSend":
+                    self._send({"processQueryKey": "bench"})
+                elif path == "/webhook":
+                    self._send({"errcode": 0, "errmsg": "ok"})
+                else:
+                    self.send_error(404)
+
+        return Handler
+
+
+class FakeVLModel:
+    """
+    Replacement for dashscope.MultiModalConversation.call with configurable
+    latency (seconds, +/- jitter fraction) and error rate (HTTP 500 replies).
+    """
+
+    def __init__(self, latency=0.8, jitter=0.25, error_rate=0.0):
+        self.latency = latency
+        self.jitter = jitter
+        self.error_rate = error_rate
+        self.calls = 0
+        self.errors = 0
+        self._lock = threading.Lock()
+
+    def call(self, model=None, messages=None, **kwargs):
+        with self._lock:
+            self.calls += 1
+            failed = random.random() < self.error_rate
+            if failed:
+                self.errors += 1
+        time.sleep(self.latency * random.uniform(1 - self.jitter, 1 + self.jitter))
+
+        if failed:
+            return SimpleNamespace(status_code=500, code="InternalError", message="injected failure", output=None)
+        images = sum(1 for part in messages[0]["content"] if "image" in part)
+        readings = [
+            {"systolic": random.randint(105, 175), "diastolic": random.randint(65, 105), "pulse": random.randint(55, 95)}
+            for _ in range(images)
+        ]
+        # Multi-image (batched) requests are answered with a JSON array
+        text = json.dumps(readings if images > 1 else readings[0])
+        usage = {"input_tokens": 50 + 1200 * images, "output_tokens": 20 * images, "image_tokens": 1200 * images}
+        if kwargs.get("stream"):
+            # Incremental output in two chunks
+            half = len(text) // 2
+            return iter([self._response(text[:half], usage), self._response(text[half:], usage)])
+        return self._response(text, usage)
+
+    @staticmethod
+    def _response(text, usage):
+        return SimpleNamespace(
+            status_code=200, code=None, message="",
+            output=SimpleNamespace(choices=[SimpleNamespace(message=SimpleNamespace(content=[{"text": text}]))]),
+            usage=usage,
+        )
+
+
+class BenchHandler(CallbackHandler):
+    """CallbackHandler that reports when each picture job finishes and times DB calls."""
+
+    def __init__(self):
+        super().__init__()
+        self.pending = {}
+        self.parked = 0
+        self.db_times = {}
+        for name in ("add_record", "get_user_history_page"):
+            setattr(self.db, name, self._timed(name, getattr(self.db, name)))
+
+    def _timed(self, name, func):
+        times = self.db_times.setdefault(name, [])
+
+        def wrapper(*args, **kwargs):
+            started = time.perf_counter()
+            try:
+                return func(*args, **kwargs)
+            finally:
+                times.append(time.perf_counter() - started)
+        return wrapper
+
+    async def _run_picture_job(self, job):
+        try:
+            await super()._run_picture_job(job)
+        finally:
+            # Replayed jobs were already counted when they were parked
+            future = self.pending.pop(job["download_code"], None)
+            if future is not None:
+                if job.get("parked"):
+                    self.parked += 1
+                future.set_result(None)
+
+
+def _event(user_id, msg_type, webhook, download_code=None):
+    data = {"msgId": uuid.uuid4().hex, "msgType": msg_type, "senderStaffId": user_id, "senderNick": f"压测{user_id}", "sessionWebhook": webhook}
+    if msg_type == "picture":
+        data["content"] = {"downloadCode": download_code}
+    else:
+        data["text"] = {"content": "历史"}
+    return SimpleNamespace(headers={}, data=data)
+
+
+def _percentiles(samples):
+    if not samples:
+        return None
+    p50, p95, p99 = np.percentile(np.asarray(samples) * 1000, [50, 95, 99])
+    return {"count": len(samples), "p50_ms": round(p50, 1), "p95_ms": round(p95, 1), "p99_ms": round(p99, 1)}
+
+
+async def run_mode(mode, args, server, vl):
+    """Run one closed-loop benchmark with a fresh database and handler."""
+    Config.DB_POOL_ENABLED = MODES[mode]
+    Config.DB_PATH = os.path.join(args.work_dir, f"bench_{mode}.db")
+    Config.JOB_JOURNAL_PATH = os.path.join(args.work_dir, f"journal_{mode}.db")
+    # Breakers are process-wide; start every mode with closed circuits
+    resilience._breakers.clear()
+
+    handler = BenchHandler()
+    webhook = f"{server.base_url}/webhook"
+    users = [f"bench{u:03d}" for u in range(args.users)]
+    for user_id in users:
+        for _ in range(args.seed_records):
+            handler.db.add_record(user_id, f"压测{user_id}", random.randint(105, 175), random.randint(65, 105), random.randint(55, 95))
+    for times in handler.db_times.values():
+        times.clear()
+
+    latencies = {"picture": [], "history": []}
+    rejected = 0
+    rng = random.Random(args.seed)
+
+    async def user_loop(user_id):
+        nonlocal rejected
+        for i in range(args.messages):
+            started = time.perf_counter()
+            if rng.random() < args.history_ratio:
+                await handler.process(_event(user_id, "text", webhook))
+                latencies["history"].append(time.perf_counter() - started)
+                continue
+
+            code = f"{mode}-{user_id}-{i}"
+            done = asyncio.get_running_loop().create_future()
+            handler.pending[code] = done
+            _, status = await handler.process(_event(user_id, "picture", webhook, code))
+            if status == "busy":
+                handler.pending.pop(code, None)
+                rejected += 1
+                continue
+            await done
+            latencies["picture"].append(time.perf_counter() - started)
+
+    vl_calls_before = vl.calls
+    started = time.perf_counter()
+    await asyncio.gather(*(user_loop(u) for u in users))
+    elapsed = time.perf_counter() - started
+
+    if handler._replay_task is not None:
+        handler._replay_task.cancel()
+    await handler.scheduler.stop()
+    handler.executor.shutdown(wait=True)
+    handler.db.close()
+    handler.dt_api.close()
+
+    completed = len(latencies["picture"]) + len(latencies["history"])
+    return {
+        "mode": mode,
+        "db_type": Config.DB_TYPE,
+        "elapsed_s": round(elapsed, 2),
+        "messages": completed,
+        "throughput_per_s": round(completed / elapsed, 1) if elapsed else 0.0,
+        "picture": _percentiles(latencies["picture"]),
+        "history": _percentiles(latencies["history"]),
+        "db": {
+            name: {
+                "calls": len(times),
+                "total_ms": round(sum(times) * 1000, 1),
+                "mean_ms": round(sum(times) * 1000 / len(times), 2) if times else None,
+                **({k: v for k, v in _percentiles(times).items() if k != "count"} if times else {}),
+            }
+            for name, times in handler.db_times.items()
+        },
+        "vl_calls": vl.calls - vl_calls_before,
+        "parked": handler.parked,
+        "rejected": rejected,
+    }
+
+
+def print_result(r):
+    print(f"\n=== {r['mode']} ({r['db_type']}) ===")
+    print(f"{r['messages']} messages in {r['elapsed_s']}s -> {r['throughput_per_s']} msg/s"
+          f" | VL calls: {r['vl_calls']} | parked: {r['parked']} | rejected: {r['rejected']}")
+    for kind in ("picture", "history"):
+        p = r[kind]
+        if p:
+            print(f"  {kind:<8} n={p['count']:<5} p50={p['p50_ms']:>8}ms  p95={p['p95_ms']:>8}ms  p99={p['p99_ms']:>8}ms")
+    for name, d in r["db"].items():
+        if d["calls"]:
+            print(f"  db.{name:<22} calls={d['calls']:<5} total={d['total_ms']}ms  mean={d['mean_ms']}ms"
+                  f"  p95={d['p95_ms']}ms  p99={d['p99_ms']}ms")
+
+
+async def main(args):
+    server = FakeDingTalkServer(latency=args.dingtalk_latency / 1000).start()
+    vl = FakeVLModel(latency=args.vl_latency / 1000, jitter=args.vl_jitter, error_rate=args.vl_error_rate)
+
+    # Point every client at the stand-ins before the handler is built
+    Config.DINGTALK_APP_KEY = "bench-app"
+    Config.DINGTALK_APP_SECRET = "bench-secret"
+    Config.DINGTALK_TOKEN_CACHE_FILE = ""
+    Config.DINGTALK_API_BASE = server.base_url
+    Config.DINGTALK_OAPI_BASE = server.base_url
+    Config.DB_TYPE = args.db_type
+    # Every fake image is identical, so the result cache would answer all but the first
+    Config.RESULT_CACHE_ENABLED = args.cache
+    Config.VL_BATCH_ENABLED = args.vl_batch
+    Config.VL_STREAM_ENABLED = args.vl_stream
+    Config.IMAGE_PREPROCESS_ENABLED = args.preprocess
+    Config.ANALYSIS_WORKERS = args.workers
+    Config.IO_WORKERS = args.io_workers
+    Config.ANALYSIS_QUEUE_SIZE = args.queue_size
+
+    results = []
+    try:
+        with patch("dashscope.MultiModalConversation.call", side_effect=vl.call):
+            for mode in args.modes:
+                logger.info(f"Running mode '{mode}'...")
+                result = await run_mode(mode, args, server, vl)
+                print_result(result)
+                results.append(result)
+    finally:
+        server.stop()
+
+    if args.json:
+        with open(args.json, "w", encoding="utf-8") as f:
+            json.dump({"settings": vars(args), "results": results}, f, ensure_ascii=False, indent=2)
+        print(f"\nResults written to {args.json}")
+    return results
+
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(description="Offline latency/throughput benchmark with local DingTalk and DashScope stand-ins.")
+    parser.add_argument("--users", type=int, default=20, help="concurrent simulated users")
+    parser.add_argument("--messages", type=int, default=10, help="messages sent by each user")
+    parser.add_argument("--history-ratio", type=float, default=0.3, help="share of messages that are '历史' queries")
+    parser.add_argument("--seed-records", type=int, default=30, help="records stored per user before the run")
+    parser.add_argument("--modes", nargs="+", choices=sorted(MODES), default=["unpooled", "pooled"])
+    parser.add_argument("--db-type", choices=["sqlite", "sqlserver"], default="sqlite",
+                        help="sqlserver writes to the server configured in .env")
+    parser.add_argument("--workers", type=int, default=Config.ANALYSIS_WORKERS, help="analysis workers")
+    parser.add_argument("--io-workers", type=int, default=Config.IO_WORKERS, help="I/O executor threads")
+    parser.add_argument("--queue-size", type=int, default=Config.ANALYSIS_QUEUE_SIZE)
+    parser.add_argument("--vl-latency", type=float, default=800, help="stub VL call latency (ms)")
+    parser.add_argument("--vl-jitter", type=float, default=0.25, help="VL latency jitter as a fraction")
+    parser.add_argument("--vl-error-rate", type=float, default=0.0, help="share of VL calls answered with HTTP 500")
+    parser.add_argument("--dingtalk-latency", type=float, default=20, help="fake DingTalk server latency (ms)")
+    parser.add_argument("--cache", action="store_true", help="keep the analysis result cache enabled")
+    parser.add_argument("--vl-batch", action="store_true", help="enable VL request micro-batching")
+    parser.add_argument("--vl-stream", action="store_true", help="stream VL replies")
+    parser.add_argument("--preprocess", action="store_true", help="downscale/re-encode photos before the VL call")
+    parser.add_argument("--seed", type=int, default=1)
+    parser.add_argument("--json", help="also write results to this JSON file")
+    parser.add_argument("--verbose", action="store_true")
+    args = parser.parse_args()
+
+    logging.basicConfig(level=logging.INFO if args.verbose else logging.WARNING,
+                        format='%(asctime)s - %(levelname)s - %(message)s')
+    logger.setLevel(logging.INFO)
+    random.seed(args.seed)
+
+    args.work_dir = tempfile.mkdtemp(prefix="bp_bench_")
+    try:
+        asyncio.run(main(args))
+    finally:
+        shutil.rmtree(args.work_dir, ignore_errors=True)
@@ -8,6 +8,40 @@ class Config:
     DINGTALK_APP_KEY = os.getenv("DINGTALK_APP_KEY")
     DINGTALK_APP_SECRET = os.getenv("DINGTALK_APP_SECRET")
     DINGTALK_AGENT_ID = os.getenv("DINGTALK_AGENT_ID") # Added
+    # API hosts; only overridden to point at local stand-ins (see benchmark.py)
+    DINGTALK_API_BASE = os.getenv("DINGTALK_API_BASE", "https://api.dingtalk.com")
+    DINGTALK_OAPI_BASE = os.getenv("DINGTALK_OAPI_BASE", "https://oapi.dingtalk.com")
+    # Optional file to share the access token across restarts and worker processes
+    DINGTALK_TOKEN_CACHE_FILE = os.getenv("DINGTALK_TOKEN_CACHE_FILE", "")
+    # Refresh the access token this many seconds before it expires
+    DINGTALK_TOKEN_REFRESH_MARGIN = int(os.getenv("DINGTALK_TOKEN_REFRESH_MARGIN", "300"))
+
+    # HTTP Client Config (DingTalk API)
+    HTTP_CONNECT_TIMEOUT = float(os.getenv("HTTP_CONNECT_TIMEOUT", "5"))
+    HTTP_READ_TIMEOUT = float(os.getenv("HTTP_READ_TIMEOUT", "15"))
+    # Number of hosts kept in the pool, and max keep-alive connections per host
+    HTTP_POOL_CONNECTIONS = int(os.getenv("HTTP_POOL_CONNECTIONS", "4"))
+    HTTP_POOL_MAXSIZE = int(os.getenv("HTTP_POOL_MAXSIZE", "16"))
+
+    # Resilience Config (retries with jittered backoff + circuit breakers)
+    RETRY_MAX_ATTEMPTS = int(os.getenv("RETRY_MAX_ATTEMPTS", "3"))
+    RETRY_BASE_DELAY = float(os.getenv("RETRY_BASE_DELAY", "0.5"))
+    RETRY_MAX_DELAY = float(os.getenv("RETRY_MAX_DELAY", "8"))
+    # Total time budget (seconds) for a call including retries
+    DASHSCOPE_DEADLINE = float(os.getenv("DASHSCOPE_DEADLINE", "90"))
+    DINGTALK_DEADLINE = float(os.getenv("DINGTALK_DEADLINE", "20"))
+    # Open the circuit when this share of the last CIRCUIT_WINDOW calls failed (min CIRCUIT_MIN_CALLS)
+    CIRCUIT_FAILURE_RATE = float(os.getenv("CIRCUIT_FAILURE_RATE", "0.5"))
+    CIRCUIT_WINDOW = int(os.getenv("CIRCUIT_WINDOW", "20"))
+    CIRCUIT_MIN_CALLS = int(os.getenv("CIRCUIT_MIN_CALLS", "5"))
+    # Seconds before an open circuit lets a probe call through
+    CIRCUIT_RESET_TIMEOUT = float(os.getenv("CIRCUIT_RESET_TIMEOUT", "30"))
+
+    # Outbound Notification Config (batchSend fan-out)
+    DISPATCH_BATCH_SIZE = int(os.getenv("DISPATCH_BATCH_SIZE", "20"))
+    DISPATCH_RATE = float(os.getenv("DISPATCH_RATE", "10"))
+    DISPATCH_BURST = int(os.getenv("DISPATCH_BURST", "10"))
+    DISPATCH_MAX_RETRIES = int(os.getenv("DISPATCH_MAX_RETRIES", "3"))
     DASHSCOPE_API_KEY = os.getenv("DASHSCOPE_API_KEY")
     
     # Database Config
@@ -21,6 +55,98 @@ class Config:
     SQLSERVER_PASSWORD = os.getenv("SQLSERVER_PASSWORD")
     SQLSERVER_DB = os.getenv("SQLSERVER_DB")
 
+    # Connection Pool Config
+    # SQL Server uses a shared pool; SQLite keeps one WAL-mode connection per thread
+    DB_POOL_ENABLED = os.getenv("DB_POOL_ENABLED", "true").lower() == "true"
+    DB_POOL_SIZE = int(os.getenv("DB_POOL_SIZE", "5"))
+    DB_POOL_IDLE_TIMEOUT = int(os.getenv("DB_POOL_IDLE_TIMEOUT", "300"))
+    DB_POOL_HEALTH_CHECK_INTERVAL = int(os.getenv("DB_POOL_HEALTH_CHECK_INTERVAL", "30"))
+    DB_POOL_TIMEOUT = int(os.getenv("DB_POOL_TIMEOUT", "30"))
+
+    # Write Buffer Config (opt-in group commit for add_record)
+    DB_WRITE_BUFFER_ENABLED = os.getenv("DB_WRITE_BUFFER_ENABLED", "false").lower() == "true"
+    DB_WRITE_BUFFER_MAX_ROWS = int(os.getenv("DB_WRITE_BUFFER_MAX_ROWS", "50"))
+    DB_WRITE_BUFFER_MAX_DELAY_MS = int(os.getenv("DB_WRITE_BUFFER_MAX_DELAY_MS", "50"))
+    DB_WRITE_BUFFER_TIMEOUT = int(os.getenv("DB_WRITE_BUFFER_TIMEOUT", "30"))
+
+    # Concurrency Config
+    # Max threads used for blocking I/O (DingTalk HTTP, DashScope, DB) off the event loop
+    IO_WORKERS = int(os.getenv("IO_WORKERS", "8"))
+    # Image analysis jobs processed at once, and how many may wait in the queue
+    ANALYSIS_WORKERS = int(os.getenv("ANALYSIS_WORKERS", "4"))
+    ANALYSIS_QUEUE_SIZE = int(os.getenv("ANALYSIS_QUEUE_SIZE", "200"))
+
+    # Message Dedup Config (drop stream redeliveries by DingTalk message ID)
+    MESSAGE_DEDUP_ENABLED = os.getenv("MESSAGE_DEDUP_ENABLED", "true").lower() == "true"
+    # Message IDs remembered, and for how many seconds
+    MESSAGE_DEDUP_SIZE = int(os.getenv("MESSAGE_DEDUP_SIZE", "10000"))
+    MESSAGE_DEDUP_TTL = int(os.getenv("MESSAGE_DEDUP_TTL", "600"))
+
+    # Job Journal Config (write-ahead log of picture jobs, resumed after a restart)
+    JOB_JOURNAL_ENABLED = os.getenv("JOB_JOURNAL_ENABLED", "true").lower() == "true"
+    JOB_JOURNAL_PATH = os.getenv("JOB_JOURNAL_PATH", "job_journal.db")
+    # Finished jobs are kept this many days before being pruned at startup
+    JOB_JOURNAL_RETENTION_DAYS = int(os.getenv("JOB_JOURNAL_RETENTION_DAYS", "7"))
+    # Unfinished jobs re-run at once when resuming after a restart
+    JOB_RESUME_CONCURRENCY = int(os.getenv("JOB_RESUME_CONCURRENCY", "2"))
+
+    # Supervisor Mode Config (main.py --workers N)
+    # Worker processes running image analysis; 0 keeps everything in one process
+    WORKER_PROCESSES = int(os.getenv("WORKER_PROCESSES", "0"))
+    # SQLite file holding the job queue shared by the supervisor and its workers
+    JOB_QUEUE_PATH = os.getenv("JOB_QUEUE_PATH", "job_queue.db")
+    JOB_QUEUE_POLL_INTERVAL = float(os.getenv("JOB_QUEUE_POLL_INTERVAL", "0.2"))
+    WORKER_HEARTBEAT_INTERVAL = float(os.getenv("WORKER_HEARTBEAT_INTERVAL", "5"))
+    # Restart a worker whose last heartbeat is older than this
+    WORKER_HEARTBEAT_TIMEOUT = float(os.getenv("WORKER_HEARTBEAT_TIMEOUT", "60"))
+    # Seconds workers get to finish their jobs on shutdown before being killed
+    WORKER_DRAIN_TIMEOUT = float(os.getenv("WORKER_DRAIN_TIMEOUT", "120"))
+
+    # Image Analysis Config
+    IMAGE_DOWNLOAD_TIMEOUT = int(os.getenv("IMAGE_DOWNLOAD_TIMEOUT", "15"))
+    # Downscale and re-encode photos locally before sending them to the VL model (off by
+    # default: it costs CPU on the I/O executor for every picture)
+    IMAGE_PREPROCESS_ENABLED = os.getenv("IMAGE_PREPROCESS_ENABLED", "false").lower() == "true"
+    IMAGE_MAX_EDGE = int(os.getenv("IMAGE_MAX_EDGE", "1280"))
+    IMAGE_JPEG_QUALITY = int(os.getenv("IMAGE_JPEG_QUALITY", "85"))
+    # How the preprocessed image is sent: "base64" (inline data URI) or "file" (local temp file)
+    IMAGE_UPLOAD_MODE = os.getenv("IMAGE_UPLOAD_MODE", "base64")
+    # Local seven-segment reader tried before the VL model; readings below the
+    # confidence threshold (or not read as three plausible numbers) still go to VL
+    LOCAL_OCR_ENABLED = os.getenv("LOCAL_OCR_ENABLED", "false").lower() == "true"
+    LOCAL_OCR_MIN_CONFIDENCE = float(os.getenv("LOCAL_OCR_MIN_CONFIDENCE", "0.6"))
+    # VL models tried in order, cheapest first; a reply that is missing fields or isn't a
+    # plausible reading is escalated to the next model
+    VL_MODELS = [m.strip() for m in os.getenv("VL_MODELS", "qwen-vl-plus,qwen-vl-max").split(",") if m.strip()]
+    # Skip a model while its success rate over the last VL_ROUTE_WINDOW calls is below
+    # VL_ROUTE_MIN_SUCCESS_RATE, or trying it first is slower than VL_ROUTE_LATENCY_SLACK x
+    # going straight to the next model; every VL_ROUTE_PROBE_INTERVAL-th image tries it anyway
+    VL_ROUTE_WINDOW = int(os.getenv("VL_ROUTE_WINDOW", "50"))
+    VL_ROUTE_MIN_CALLS = int(os.getenv("VL_ROUTE_MIN_CALLS", "10"))
+    VL_ROUTE_MIN_SUCCESS_RATE = float(os.getenv("VL_ROUTE_MIN_SUCCESS_RATE", "0.7"))
+    VL_ROUTE_LATENCY_SLACK = float(os.getenv("VL_ROUTE_LATENCY_SLACK", "1.2"))
+    VL_ROUTE_PROBE_INTERVAL = int(os.getenv("VL_ROUTE_PROBE_INTERVAL", "20"))
+    # Stream VL replies and stop reading as soon as the JSON answer is complete
+    VL_STREAM_ENABLED = os.getenv("VL_STREAM_ENABLED", "false").lower() == "true"
+    # Micro-batching: images arriving within VL_BATCH_MAX_DELAY_MS of each other (up to
+    # VL_BATCH_MAX_IMAGES, at most ANALYSIS_WORKERS in practice) share one VL request
+    VL_BATCH_ENABLED = os.getenv("VL_BATCH_ENABLED", "false").lower() == "true"
+    VL_BATCH_MAX_IMAGES = int(os.getenv("VL_BATCH_MAX_IMAGES", "4"))
+    VL_BATCH_MAX_DELAY_MS = int(os.getenv("VL_BATCH_MAX_DELAY_MS", "200"))
+    # Cache of analysis results keyed by image content (skips repeat VL calls)
+    RESULT_CACHE_ENABLED = os.getenv("RESULT_CACHE_ENABLED", "true").lower() == "true"
+    RESULT_CACHE_SIZE = int(os.getenv("RESULT_CACHE_SIZE", "1000"))
+    RESULT_CACHE_TTL = int(os.getenv("RESULT_CACHE_TTL", "86400"))
+    # Optional SQLite file for a persistent cache tier; empty keeps the cache in memory only
+    RESULT_CACHE_DB_PATH = os.getenv("RESULT_CACHE_DB_PATH", "")
+    # Max perceptual hash distance for near-duplicate hits; -1 disables near-duplicate matching
+    RESULT_CACHE_PHASH_DISTANCE = int(os.getenv("RESULT_CACHE_PHASH_DISTANCE", "-1"))
+
+    # Metrics Config (Prometheus text format at http://METRICS_HOST:METRICS_PORT/metrics)
+    METRICS_ENABLED = os.getenv("METRICS_ENABLED", "true").lower() == "true"
+    METRICS_HOST = os.getenv("METRICS_HOST", "127.0.0.1")
+    METRICS_PORT = int(os.getenv("METRICS_PORT", "9108"))
+
     @classmethod
     def validate(cls):
         missing = []
@@ -0,0 +1,57 @@
+import argparse
+import logging
+import os
+import sys
+import time
+from datetime import datetime
+from services.database import DatabaseService
+from services.exporter import FORMATS, export_records, load_watermark, save_watermark
+
+# Setup logging
+logging.basicConfig(level=logging.INFO, format='%(asctime)s - %(levelname)s - %(message)s')
+logger = logging.getLogger(__name__)
+
+WATERMARK_FILE = "export_watermark.json"
+
+def run_export(out_dir, fmt="parquet", incremental=False, since=None, chunk_size=5000):
+    """
+    Export records to a new file in out_dir.
+    With incremental=True only records after the last export's watermark are read,
+    and the watermark is advanced once the file is complete.
+    """
+    os.makedirs(out_dir, exist_ok=True)
+    watermark_path = os.path.join(out_dir, WATERMARK_FILE)
+    after = load_watermark(watermark_path) if incremental else None
+    if after:
+        logger.info(f"Exporting records after watermark {after[0]} (id {after[1]})")
+
+    out_path = os.path.join(out_dir, f"bp_records_{datetime.now().strftime('%Y%m%d_%H%M%S')}{FORMATS[fmt]}")
+    db = DatabaseService()
+    started = time.monotonic()
+    try:
+        count, watermark = export_records(db, out_path, fmt=fmt, since=since, after=after, chunk_size=chunk_size)
+    finally:
+        db.close()
+
+    if count == 0:
+        logger.info("No new records to export.")
+        return None
+
+    if incremental:
+        save_watermark(watermark_path, watermark)
+    logger.info(f"Exported {count} records to {out_path} in {time.monotonic() - started:.1f}s")
+    return out_path
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(description="Export blood pressure records to Parquet or Arrow IPC files.")
+    parser.add_argument("--out-dir", default="exports", help="directory for export files and the watermark")
+    parser.add_argument("--format", choices=sorted(FORMATS), default="parquet")
+    parser.add_argument("--incremental", action="store_true", help="only export records added since the last incremental export")
+    parser.add_argument("--since", help="only export records at or after this time (YYYY-MM-DD[ HH:MM:SS])")
+    parser.add_argument("--chunk-size", type=int, default=5000, help="rows read and written per batch")
+    args = parser.parse_args()
+
+    try:
+        run_export(args.out_dir, args.format, args.incremental, args.since, args.chunk_size)
+    except ImportError:
+        sys.exit(1)
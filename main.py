@@ -1,15 +1,19 @@
+import argparse
 import asyncio
+import importlib
 import logging
-from dingtalk_stream import DingTalkStreamClient, AckMessage, Credential
-from dingtalk_stream.chatbot import ChatbotMessage
+import os
+import subprocess
+import sys
+import tempfile
+import time
 from config import Config
-from services.handlers import CallbackHandler
 
 # Configure logging
 logging.basicConfig(level=logging.DEBUG, format='%(asctime)s - %(name)s - %(levelname)s - %(message)s')
 logger = logging.getLogger(__name__)
 
-async def main():
+async def main(processes=0):
     # Load and validate config
     try:
         Config.validate()
@@ -17,13 +21,29 @@ async def main():
         logger.error(str(e))
         return
 
+    # Imported here rather than at module level: spawned worker processes re-import
+    # this module, and --check-startup wants to time these imports itself
+    from dingtalk_stream import DingTalkStreamClient, AckMessage, Credential
+    from dingtalk_stream.chatbot import ChatbotMessage
+    from services.stream_handler import CallbackHandler
+    from services.metrics import start_metrics_server
+
+    if Config.METRICS_ENABLED:
+        start_metrics_server(Config.METRICS_HOST, Config.METRICS_PORT)
+
     # Initialize Client
     credential = Credential(Config.DINGTALK_APP_KEY, Config.DINGTALK_APP_SECRET)
     client = DingTalkStreamClient(credential)
 
+    # Supervisor mode: this process keeps the stream connection, worker processes run the analysis
+    supervisor = None
+    if processes > 0:
+        from services.supervisor import Supervisor
+        supervisor = Supervisor(processes)
+
     # Initialize Handlers
     # We need to pass the client to the handler so it can send replies
-    handler = CallbackHandler()
+    handler = CallbackHandler(job_queue=supervisor.queue if supervisor else None)
     
     # Monkey patch or set the client on the handler if we improve the handler class
     # handler.client = client 
@@ -55,7 +75,83 @@ async def main():
     client.register_callback_handler(ChatbotMessage.TOPIC, handler)
 
     logger.info("Starting DingTalk Stream Client...")
-    await client.start()
+    resume_task = None
+    try:
+        if supervisor:
+            logger.info(f"Supervisor mode with {processes} worker processes")
+            await supervisor.run(client.start())
+        else:
+            # Pick up picture jobs interrupted by the last shutdown (supervisor mode requeues them instead)
+            resume_task = asyncio.create_task(handler.resume_unfinished_jobs())
+            await client.start()
+    finally:
+        if resume_task is not None:
+            resume_task.cancel()
+            await asyncio.gather(resume_task, return_exceptions=True)
+        # Flush any buffered record writes before exiting
+        handler.db.close()
+
+def _time_import(module):
+    """Seconds to import `module` in a fresh interpreter, so no earlier import hides its cost."""
+    code = f"import time; t = time.perf_counter(); import {module}; print(time.perf_counter() - t)"
+    out = subprocess.run([sys.executable, "-c", code], capture_output=True, text=True, check=True,
+                         cwd=os.path.dirname(os.path.abspath(__file__)))
+    return float(out.stdout.strip().splitlines()[-1])
+
+def check_startup():
+    """
+    Time each step of a cold start (imports, schema check, handler construction)
+    and print a report instead of connecting to DingTalk. SQLite files are created
+    in a temporary directory, not next to the real databases.
+    """
+    timings = []
+
+    def step(name, func):
+        started = time.perf_counter()
+        result = func()
+        timings.append((name, time.perf_counter() - started))
+        return result
+
+    # Worker processes only import services.handlers; the stream process also loads the SDK
+    imports = [(f"import {module}", _time_import(module))
+               for module in ("services.handlers", "dingtalk_stream", "services.stream_handler")]
+
+    with tempfile.TemporaryDirectory() as tmp:
+        Config.DB_PATH = os.path.join(tmp, "bp_data.db")
+        Config.JOB_JOURNAL_PATH = os.path.join(tmp, "job_journal.db")
+
+        handlers = importlib.import_module("services.handlers")
+        database = importlib.import_module("services.database")
+        db = step("DatabaseService() (schema check)", database.DatabaseService)
+        step("DatabaseService() (already checked)", database.DatabaseService).close()
+        handler = step("MessageHandler()", handlers.MessageHandler)
+        image_analyzer = importlib.import_module("services.image_analyzer")
+        step("import dashscope (first VL call)", image_analyzer._get_dashscope)
+
+        handler.executor.shutdown(wait=False)
+        handler.db.close()
+        handler.dt_api.close()
+        if handler.journal is not None:
+            handler.journal.close()
+        db.close()
+
+    # Each import is timed on its own, so they overlap (stream_handler includes the other two)
+    print("\nImport timing (fresh interpreter each)")
+    for name, seconds in imports:
+        print(f"  {name:<40} {seconds * 1000:8.1f} ms")
+    print("\nStartup timing")
+    for name, seconds in timings:
+        print(f"  {name:<40} {seconds * 1000:8.1f} ms")
+    print(f"  {'total':<40} {sum(s for _, s in timings) * 1000:8.1f} ms")
 
 if __name__ == '__main__':
-    asyncio.run(main())
+    parser = argparse.ArgumentParser(description="DingTalk blood pressure assistant")
+    parser.add_argument("--workers", type=int, default=Config.WORKER_PROCESSES,
+                        help="worker processes for image analysis (0 = analyse in this process)")
+    parser.add_argument("--check-startup", action="store_true",
+                        help="print how long each startup step takes and exit")
+    args = parser.parse_args()
+    if args.check_startup:
+        check_startup()
+    else:
+        asyncio.run(main(args.workers))
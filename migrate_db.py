@@ -1,6 +1,8 @@
+import argparse
 import sqlite3
 import os
 import sys
+import time
 import logging
 from config import Config
 from services.database import DatabaseService
@@ -9,10 +11,81 @@ from services.database import DatabaseService
 logging.basicConfig(level=logging.INFO, format='%(asctime)s - %(levelname)s - %(message)s')
 logger = logging.getLogger(__name__)
 
-def migrate():
+INSERT_SQL = """
+    INSERT INTO 员工血压记录 (员工ID, 员工姓名, 收缩压, 舒张压, 脉搏, 图片链接, 分析结果, 记录时间, 消息ID)
+    VALUES (?, ?, ?, ?, ?, ?, ?, ?, ?)
+"""
+
+def _load_checkpoint(cursor, source):
+    """Return the last migrated SQLite rowid for this source file (0 if none)."""
+    cursor.execute("""
+        IF NOT EXISTS (SELECT * FROM sysobjects WHERE name='迁移检查点' AND xtype='U')
+        BEGIN
+            CREATE TABLE 迁移检查点 (
+                来源 NVARCHAR(400) PRIMARY KEY,
+                最后行ID BIGINT NOT NULL,
+                更新时间 DATETIME DEFAULT GETDATE()
+            )
+        END
+    """)
+    cursor.execute("SELECT 最后行ID FROM 迁移检查点 WHERE 来源 = ?", (source,))
+    row = cursor.fetchone()
+    return row[0] if row else 0
+
+def _ensure_rejects_table(cursor):
+    cursor.execute("""
+        IF NOT EXISTS (SELECT * FROM sysobjects WHERE name='迁移失败记录' AND xtype='U')
+        BEGIN
+            CREATE TABLE 迁移失败记录 (
+                来源 NVARCHAR(400) NOT NULL,
+                行ID BIGINT NOT NULL,
+                错误 NVARCHAR(MAX),
+                记录时间 DATETIME DEFAULT GETDATE(),
+                PRIMARY KEY (来源, 行ID)
+            )
+        END
+    """)
+
+def _record_reject(cursor, source, rowid, error):
+    """Remember a row that failed to insert, so it isn't lost once the checkpoint moves past it."""
+    cursor.execute("UPDATE 迁移失败记录 SET 错误 = ?, 记录时间 = GETDATE() WHERE 来源 = ? AND 行ID = ?", (error, source, rowid))
+    if cursor.rowcount == 0:
+        cursor.execute("INSERT INTO 迁移失败记录 (来源, 行ID, 错误) VALUES (?, ?, ?)", (source, rowid, error))
+
+def _set_input_sizes(cursor, pyodbc):
+    """
+    Declare parameter types for fast_executemany. Without this pyodbc sizes string
+    buffers from the first row, which fails for NVARCHAR(MAX) values longer than 4000
+    characters (图片链接, 分析结果).
+    """
+    cursor.setinputsizes([
+        (pyodbc.SQL_WVARCHAR, 100, 0),   # 员工ID
+        (pyodbc.SQL_WVARCHAR, 100, 0),   # 员工姓名
+        (pyodbc.SQL_INTEGER, 0, 0),      # 收缩压
+        (pyodbc.SQL_INTEGER, 0, 0),      # 舒张压
+        (pyodbc.SQL_INTEGER, 0, 0),      # 脉搏
+        (pyodbc.SQL_WVARCHAR, 0, 0),     # 图片链接 (size 0 = MAX)
+        (pyodbc.SQL_WVARCHAR, 0, 0),     # 分析结果
+        (pyodbc.SQL_WVARCHAR, 30, 0),    # 记录时间 (SQLite text timestamp)
+        (pyodbc.SQL_WVARCHAR, 100, 0),   # 消息ID
+    ])
+
+def _save_checkpoint(cursor, source, last_rowid):
+    cursor.execute("UPDATE 迁移检查点 SET 最后行ID = ?, 更新时间 = GETDATE() WHERE 来源 = ?", (last_rowid, source))
+    if cursor.rowcount == 0:
+        cursor.execute("INSERT INTO 迁移检查点 (来源, 最后行ID) VALUES (?, ?)", (source, last_rowid))
+
+def migrate(batch_size=1000, reset=False, retry_rejects=False, truncate_target=False):
     """
     Migrate data from SQLite to SQL Server.
     Assumes Config is set up for SQL Server, but we need to manually access SQLite.
+
+    Rows are streamed in batches of `batch_size`, each committed together with a
+    checkpoint so an interrupted run resumes where it stopped. `reset` starts over,
+    and is refused while the target already has records (they would be copied and
+    counted again) unless `truncate_target` first empties the target tables.
+    Rows that fail to insert are listed in 迁移失败记录; `retry_rejects` migrates
+    only those rows again.
     """
     
     # Check if we are configured for SQL Server
@@ -41,45 +114,140 @@ def migrate():
     try:
         sqlite_conn = sqlite3.connect(sqlite_path)
         sqlite_cursor = sqlite_conn.cursor()
-        
-        # Read all records from SQLite
-        sqlite_cursor.execute("SELECT user_id, user_name, systolic, diastolic, pulse, image_url, result, created_at FROM records")
-        records = sqlite_cursor.fetchall()
-        logger.info(f"Found {len(records)} records in SQLite database.")
-        
-        sqlite_conn.close()
     except Exception as e:
-        logger.error(f"Error reading from SQLite: {e}")
+        logger.error(f"Error opening SQLite database: {e}")
         return
 
-    # Insert into SQL Server
-    success_count = 0
-    fail_count = 0
-    
     conn = db_service._get_connection()
     cursor = conn.cursor()
-    
-    for r in records:
-        # r: user_id, user_name, sys, dia, pulse, url, result, created_at
-        try:
-            # Check if record already exists (optional, simple check by time and user)
-            # Or just insert blindly assuming empty target table
-            
-            cursor.execute("""
-                INSERT INTO 员工血压记录 (员工ID, 员工姓名, 收缩压, 舒张压, 脉搏, 图片链接, 分析结果, 记录时间)
-                VALUES (?, ?, ?, ?, ?, ?, ?, ?)
-            """, (r[0], r[1], r[2], r[3], r[4], r[5], r[6], r[7]))
-            success_count += 1
-        except Exception as e:
-            logger.error(f"Failed to insert record for user {r[0]}: {e}")
-            fail_count += 1
-            
+    # Send each batch as one parameter array instead of one round trip per row. Input
+    # sizes stick to a cursor, so inserts get their own and other statements use `cursor`.
+    insert_cursor = conn.cursor()
+    insert_cursor.fast_executemany = True
+    _set_input_sizes(insert_cursor, db_service.pyodbc)
+
+    source = os.path.abspath(sqlite_path)
+    last_rowid = _load_checkpoint(cursor, source)
+    _ensure_rejects_table(cursor)
+    if truncate_target:
+        # Clears everything migrated from any source, so every checkpoint starts over too
+        logger.warning("Deleting all records, daily statistics and checkpoints in SQL Server before migrating.")
+        cursor.execute("DELETE FROM 员工血压记录")
+        cursor.execute("DELETE FROM 员工血压日统计")
+        cursor.execute("DELETE FROM 迁移检查点")
+        cursor.execute("DELETE FROM 迁移失败记录")
+        last_rowid = 0
+    elif reset:
+        cursor.execute("SELECT TOP 1 1 FROM 员工血压记录")
+        if cursor.fetchone() is not None:
+            logger.error("Refusing --reset: 员工血压记录 already has records, which would be duplicated "
+                         "and counted twice in the daily statistics. Use --truncate-target to empty it first.")
+            sqlite_conn.close()
+            conn.close()
+            db_service.close()
+            return
+        last_rowid = 0
+        _save_checkpoint(cursor, source, last_rowid)
+        cursor.execute("DELETE FROM 迁移失败记录 WHERE 来源 = ?", (source,))
+    conn.commit()
+
+    # Databases created before message IDs were stored have no msg_id column
+    sqlite_cursor.execute("PRAGMA table_info(records)")
+    msg_id_column = "msg_id" if "msg_id" in [info[1] for info in sqlite_cursor.fetchall()] else "NULL"
+    columns = f"rowid, user_id, user_name, systolic, diastolic, pulse, image_url, result, created_at, {msg_id_column}"
+
+    if retry_rejects:
+        cursor.execute("SELECT 行ID FROM 迁移失败记录 WHERE 来源 = ? ORDER BY 行ID", (source,))
+        reject_ids = [row[0] for row in cursor.fetchall()]
+        total = len(reject_ids)
+        logger.info(f"Retrying {total} previously failed records.")
+        sqlite_cursor.execute("CREATE TEMP TABLE retry_ids (id INTEGER PRIMARY KEY)")
+        sqlite_cursor.executemany("INSERT INTO retry_ids (id) VALUES (?)", [(i,) for i in reject_ids])
+        sqlite_cursor.execute(f"""
+            SELECT {columns}
+            FROM records
+            WHERE rowid IN (SELECT id FROM retry_ids)
+            ORDER BY rowid
+        """)
+    else:
+        if last_rowid:
+            logger.info(f"Resuming after SQLite rowid {last_rowid}.")
+        sqlite_cursor.execute("SELECT COUNT(*) FROM records WHERE rowid > ?", (last_rowid,))
+        total = sqlite_cursor.fetchone()[0]
+        logger.info(f"Found {total} records to migrate in SQLite database.")
+
+        # Stream rows in rowid order so the checkpoint is a simple high-water mark
+        sqlite_cursor.execute(f"""
+            SELECT {columns}
+            FROM records
+            WHERE rowid > ?
+            ORDER BY rowid
+        """, (last_rowid,))
+
+    success_count = 0
+    fail_count = 0
+    started = time.monotonic()
+
     try:
-        conn.commit()
-        conn.close()
-        logger.info(f"Migration complete. Success: {success_count}, Failed: {fail_count}")
+        while True:
+            batch = sqlite_cursor.fetchmany(batch_size)
+            if not batch:
+                break
+
+            # r: rowid, user_id, user_name, sys, dia, pulse, url, result, created_at, msg_id
+            rowids = [r[0] for r in batch]
+            rows = [tuple(r[1:]) for r in batch]
+            try:
+                insert_cursor.executemany(INSERT_SQL, rows)
+                inserted = rows
+            except Exception as e:
+                # Fall back to row by row so one bad record doesn't block the batch
+                logger.warning(f"Batch insert failed ({e}), retrying rows individually...")
+                conn.rollback()
+                inserted = []
+                for rowid, r in zip(rowids, rows):
+                    try:
+                        insert_cursor.execute(INSERT_SQL, r)
+                        inserted.append(r)
+                    except Exception as row_error:
+                        logger.error(f"Failed to insert record {rowid} for user {r[0]}: {row_error}")
+                        _record_reject(cursor, source, rowid, str(row_error))
+                        fail_count += 1
+                        continue
+                    if retry_rejects:
+                        cursor.execute("DELETE FROM 迁移失败记录 WHERE 来源 = ? AND 行ID = ?", (source, rowid))
+            else:
+                if retry_rejects:
+                    cursor.executemany(
+                        "DELETE FROM 迁移失败记录 WHERE 来源 = ? AND 行ID = ?",
+                        [(source, rowid) for rowid in rowids],
+                    )
+            success_count += len(inserted)
+
+            # Migrated rows bypass add_record, so fold them into the daily aggregates here
+            db_service._update_daily_stats(cursor, [(r[0], r[2], r[3], r[4], r[7]) for r in inserted if r[7] is not None])
+
+            # The checkpoint, rejects and aggregates commit atomically with the batch,
+            # so a rerun never double-counts and failed rows stay listed for --retry-rejects
+            if not retry_rejects:
+                _save_checkpoint(cursor, source, batch[-1][0])
+            conn.commit()
+
+            elapsed = time.monotonic() - started
+            done = success_count + fail_count
+            rate = done / elapsed if elapsed > 0 else 0
+            logger.info(f"Migrated {done}/{total} records ({rate:.0f} rows/sec)")
     except Exception as e:
-        logger.error(f"Error committing transaction: {e}")
+        logger.error(f"Migration interrupted: {e}. Rerun to resume from the last checkpoint.")
+        return
+    finally:
+        sqlite_conn.close()
+        conn.close()
+        db_service.close()
+
+    logger.info(f"Migration complete. Success: {success_count}, Failed: {fail_count}")
+    if fail_count:
+        logger.info("Failed rows are listed in 迁移失败记录; fix them and rerun with --retry-rejects.")
 
 if __name__ == "__main__":
     # Ensure pyodbc is installed
@@ -88,5 +256,14 @@ if __name__ == "__main__":
     except ImportError:
         print("Error: pyodbc is not installed. Please run: pip install pyodbc")
         sys.exit(1)
-        
-    migrate()
+
+    parser = argparse.ArgumentParser(description="Migrate blood pressure records from SQLite to SQL Server.")
+    parser.add_argument("--batch-size", type=int, default=1000, help="rows read and inserted per transaction")
+    parser.add_argument("--reset", action="store_true", help="ignore the saved checkpoint and start from the first row")
+    parser.add_argument("--retry-rejects", action="store_true", help="migrate only the rows that failed in earlier runs")
+    parser.add_argument("--truncate-target", action="store_true",
+                        help="delete all records and daily statistics in SQL Server, then migrate from the first row")
+    args = parser.parse_args()
+
+    migrate(batch_size=args.batch_size, reset=args.reset, retry_rejects=args.retry_rejects,
+            truncate_target=args.truncate_target)
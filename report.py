@@ -0,0 +1,54 @@
+import argparse
+import logging
+import sys
+import time
+from services.analytics import cohort_report, export_report
+from services.database import DatabaseService
+
+# Setup logging
+logging.basicConfig(level=logging.INFO, format='%(asctime)s - %(levelname)s - %(message)s')
+logger = logging.getLogger(__name__)
+
+def build_report(start=None, end=None, by_user=False):
+    """
+    Load readings in [start, end) and build a cohort report.
+    Rows are streamed from the database in chunks and only the numeric columns are kept.
+    """
+    db = DatabaseService()
+    systolic, diastolic, pulse, users = [], [], [], []
+    started = time.monotonic()
+    try:
+        for chunk in db.iter_records(since=start, until=end):
+            # row: id, user_id, user_name, sys, dia, pulse, result, created_at
+            for row in chunk:
+                users.append(row[1])
+                systolic.append(row[3])
+                diastolic.append(row[4])
+                pulse.append(row[5])
+    finally:
+        db.close()
+    logger.info(f"Loaded {len(systolic)} readings in {time.monotonic() - started:.1f}s")
+
+    started = time.monotonic()
+    report = cohort_report(systolic, diastolic, pulse, groups=users if by_user else None)
+    logger.info(f"Computed report in {time.monotonic() - started:.2f}s")
+    report["period"] = {"start": start, "end": end}
+    return report
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(description="Build a blood pressure cohort report (distributions, percentiles, category prevalence).")
+    parser.add_argument("--start", help="include readings at or after this date (YYYY-MM-DD)")
+    parser.add_argument("--end", help="include readings before this date (YYYY-MM-DD)")
+    parser.add_argument("--by-user", action="store_true", help="add per-employee statistics")
+    parser.add_argument("--out", default="bp_report.json", help="output file (.json or .csv)")
+    args = parser.parse_args()
+
+    report = build_report(args.start, args.end, args.by_user)
+    if report["readings"] == 0:
+        logger.info("No readings in the selected period.")
+        sys.exit(0)
+
+    export_report(report, args.out)
+    categories = report["categories"]
+    logger.info(f"Readings: {report['valid_readings']}, hypertension prevalence: {categories['hypertension_prevalence']:.1%}")
+    logger.info(f"Report written to {args.out}")
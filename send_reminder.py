@@ -0,0 +1,59 @@
+import argparse
+import logging
+import sys
+from config import Config
+from services.database import DatabaseService
+from services.dingtalk_api import DingTalkAPI
+from services.dispatcher import MessageDispatcher
+
+# Setup logging
+logging.basicConfig(level=logging.INFO, format='%(asctime)s - %(levelname)s - %(message)s')
+logger = logging.getLogger(__name__)
+
+DEFAULT_MESSAGE = "⏰ 今日血压测量提醒：请测量血压后将血压计屏幕照片发送给我，帮您记录健康数据。"
+
+def send_reminder(message, user_ids=None):
+    """
+    Send the same message to many employees through batchSend.
+    Defaults to every employee who has at least one record.
+    """
+    if user_ids is None:
+        db = DatabaseService()
+        user_ids = db.get_all_user_ids()
+        db.close()
+
+    if not user_ids:
+        logger.info("No users to notify.")
+        return True
+
+    logger.info(f"Sending reminder to {len(user_ids)} users...")
+    dispatcher = MessageDispatcher(
+        DingTalkAPI(),
+        batch_size=Config.DISPATCH_BATCH_SIZE,
+        rate=Config.DISPATCH_RATE,
+        burst=Config.DISPATCH_BURST,
+        max_retries=Config.DISPATCH_MAX_RETRIES,
+    )
+    dispatcher.send(user_ids, message)
+    dispatcher.close()
+
+    stats = dispatcher.stats()
+    logger.info(f"Done. Requests: {stats['requests']}, Delivered: {stats['delivered']}, Failed: {stats['failed']}")
+    if dispatcher.failed_users:
+        logger.error(f"Failed users: {','.join(dispatcher.failed_users)}")
+    return stats["failed"] == 0
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(description="Send a measurement reminder to employees via the DingTalk robot.")
+    parser.add_argument("--message", default=DEFAULT_MESSAGE, help="text to send")
+    parser.add_argument("--users", help="comma-separated user ids (default: everyone with a record)")
+    args = parser.parse_args()
+
+    try:
+        Config.validate()
+    except ValueError as e:
+        logger.error(str(e))
+        sys.exit(1)
+
+    users = args.users.split(',') if args.users else None
+    sys.exit(0 if send_reminder(args.message, users) else 1)
@@ -0,0 +1,159 @@
+"""
+Vectorized blood pressure analytics for cohort reports.
+
+Classifies whole arrays of readings at once with the same guideline
+thresholds as services.bp_classifier, and builds distributions,
+percentiles and per-category prevalence for a cohort or for groups
+within it.
+"""
+import csv
+import json
+import numpy as np
+from services.bp_classifier import BP_CATEGORIES
+
+CATEGORY_LABELS = [c[2] for c in BP_CATEGORIES]
+# Index of the first non-hypertensive category; everything before it counts as hypertension
+HYPERTENSION_UPTO = next(i for i, c in enumerate(BP_CATEGORIES) if c[0] == "high_normal_plus")
+
+DEFAULT_PERCENTILES = (5, 25, 50, 75, 95)
+
+
+def to_float_array(values):
+    """Convert values (ints, numeric strings, None) to a float array with NaN for missing/invalid."""
+    try:
+        return np.asarray(values, dtype=float)
+    except (TypeError, ValueError):
+        out = np.empty(len(values), dtype=float)
+        for i, v in enumerate(values):
+            try:
+                out[i] = float(v)
+            except (TypeError, ValueError):
+                out[i] = np.nan
+        return out
+
+
+def classify_array(systolic, diastolic):
+    """
+    Classify arrays of readings.
+
+    Returns an int array of indices into BP_CATEGORIES, with -1 where
+    either value is missing.
+    """
+    sys = to_float_array(systolic)
+    dia = to_float_array(diastolic)
+    valid = ~(np.isnan(sys) | np.isnan(dia))
+
+    # NaN compares False, so invalid rows fall through to the default and are masked below
+    conditions = [(sys >= sys_min) | (dia >= dia_min) for _, _, _, sys_min, dia_min in BP_CATEGORIES]
+    categories = np.select(conditions, np.arange(len(BP_CATEGORIES)), default=len(BP_CATEGORIES) - 1)
+    return np.where(valid, categories, -1)
+
+
+def _distribution(values, percentiles):
+    values = values[~np.isnan(values)]
+    if values.size == 0:
+        return None
+    pct = np.percentile(values, percentiles)
+    return {
+        "mean": round(float(values.mean()), 1),
+        "std": round(float(values.std()), 1),
+        "min": float(values.min()),
+        "max": float(values.max()),
+        "percentiles": {f"p{p}": round(float(v), 1) for p, v in zip(percentiles, pct)},
+    }
+
+
+def _category_counts(categories):
+    counts = np.bincount(categories[categories >= 0], minlength=len(BP_CATEGORIES))
+    total = int(counts.sum())
+    return {
+        "counts": dict(zip(CATEGORY_LABELS, counts.tolist())),
+        "prevalence": {label: round(n / total, 4) if total else 0.0 for label, n in zip(CATEGORY_LABELS, counts.tolist())},
+        "hypertension_prevalence": round(int(counts[:HYPERTENSION_UPTO].sum()) / total, 4) if total else 0.0,
+    }
+
+
+def cohort_report(systolic, diastolic, pulse=None, groups=None, percentiles=DEFAULT_PERCENTILES):
+    """
+    Summarize a cohort of readings.
+
+    Args:
+        systolic, diastolic, pulse: array-likes of equal length
+        groups: optional array-like of group keys (e.g. user or department) for per-group stats
+        percentiles: percentiles reported for each measure
+
+    Returns:
+        dict with overall distributions and category prevalence, plus
+        "groups" (per-group reading count, means and category counts) when groups are given.
+    """
+    sys = to_float_array(systolic)
+    dia = to_float_array(diastolic)
+    pul = to_float_array(pulse) if pulse is not None else np.full(sys.shape, np.nan)
+    categories = classify_array(sys, dia)
+
+    report = {
+        "readings": int(sys.size),
+        "valid_readings": int((categories >= 0).sum()),
+        "systolic": _distribution(sys, percentiles),
+        "diastolic": _distribution(dia, percentiles),
+        "pulse": _distribution(pul, percentiles),
+        "categories": _category_counts(categories),
+    }
+
+    if groups is not None:
+        keys, inverse = np.unique(np.asarray(groups, dtype=str), return_inverse=True)
+        valid = categories >= 0
+        n_groups = keys.size
+
+        counts = np.bincount(inverse[valid], minlength=n_groups)
+        sys_sum = np.bincount(inverse[valid], weights=sys[valid], minlength=n_groups)
+        dia_sum = np.bincount(inverse[valid], weights=dia[valid], minlength=n_groups)
+        # One bincount over (group, category) pairs gives the whole count matrix
+        pair = inverse[valid] * len(BP_CATEGORIES) + categories[valid]
+        matrix = np.bincount(pair, minlength=n_groups * len(BP_CATEGORIES)).reshape(n_groups, len(BP_CATEGORIES))
+
+        with np.errstate(invalid="ignore", divide="ignore"):
+            sys_mean = sys_sum / counts
+            dia_mean = dia_sum / counts
+            hyper_share = matrix[:, :HYPERTENSION_UPTO].sum(axis=1) / counts
+
+        report["groups"] = {
+            str(key): {
+                "readings": int(counts[i]),
+                "systolic_mean": None if counts[i] == 0 else round(float(sys_mean[i]), 1),
+                "diastolic_mean": None if counts[i] == 0 else round(float(dia_mean[i]), 1),
+                "hypertension_prevalence": 0.0 if counts[i] == 0 else round(float(hyper_share[i]), 4),
+                "categories": dict(zip(CATEGORY_LABELS, matrix[i].tolist())),
+            }
+            for i, key in enumerate(keys)
+        }
+
+    return report
+
+
+def export_report(report, path):
+    """
+    Write a report to `path`: JSON for .json, otherwise a per-group CSV
+    (or a single 'all' row when the report has no groups).
+    """
+    if path.endswith(".json"):
+        with open(path, "w", encoding="utf-8") as f:
+            json.dump(report, f, ensure_ascii=False, indent=2)
+        return
+
+    groups = report.get("groups") or {
+        "all": {
+            "readings": report["valid_readings"],
+            "systolic_mean": report["systolic"]["mean"] if report["systolic"] else None,
+            "diastolic_mean": report["diastolic"]["mean"] if report["diastolic"] else None,
+            "hypertension_prevalence": report["categories"]["hypertension_prevalence"],
+            "categories": report["categories"]["counts"],
+        }
+    }
+    # utf-8-sig so Excel opens the Chinese headers correctly
+    with open(path, "w", encoding="utf-8-sig", newline="") as f:
+        writer = csv.writer(f)
+        writer.writerow(["group", "readings", "systolic_mean", "diastolic_mean", "hypertension_prevalence"] + CATEGORY_LABELS)
+        for key, g in groups.items():
+            writer.writerow([key, g["readings"], g["systolic_mean"], g["diastolic_mean"], g["hypertension_prevalence"]]
+                            + [g["categories"][label] for label in CATEGORY_LABELS])
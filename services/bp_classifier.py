@@ -0,0 +1,70 @@
+"""
+Blood pressure classification based on the Chinese hypertension guidelines.
+"""
+
+# (key, label, short label, systolic threshold, diastolic threshold), most severe first.
+# A reading belongs to the first category where systolic >= threshold or diastolic >= threshold.
+BP_CATEGORIES = [
+    ("severe", "重度高血压 (请立即就医)", "重度高血压", 180, 110),
+    ("moderate", "中度高血压", "中度高血压", 160, 100),
+    ("mild", "轻度高血压", "轻度高血压", 140, 90),
+    ("high_normal_plus", "正常高值 (偏高)", "正常高值偏高", 130, 85),
+    ("high_normal", "正常高值", "正常高值", 120, 80),
+    ("normal", "正常血压", "正常血压", 0, 0),
+]
+
+UNKNOWN_LABEL = "未知"
+
+# Readings outside these ranges (inclusive) are treated as misreads, not measurements
+SYSTOLIC_RANGE = (60, 260)
+DIASTOLIC_RANGE = (30, 160)
+PULSE_RANGE = (30, 200)
+
+
+def classify_bp(sys, dia):
+    """
+    Return the index into BP_CATEGORIES for a reading, or None if the values aren't numbers.
+    """
+    try:
+        sys = int(sys)
+        dia = int(dia)
+    except (ValueError, TypeError):
+        return None
+
+    for index, (_, _, _, sys_min, dia_min) in enumerate(BP_CATEGORIES):
+        if sys >= sys_min or dia >= dia_min:
+            return index
+    return len(BP_CATEGORIES) - 1
+
+
+def bp_status(sys, dia):
+    """
+    Human readable category label for a reading.
+    """
+    index = classify_bp(sys, dia)
+    if index is None:
+        return UNKNOWN_LABEL
+    return BP_CATEGORIES[index][1]
+
+
+def is_plausible(reading):
+    """
+    True if a parsed reading has integer systolic/diastolic values within the
+    plausible ranges and systolic above diastolic. Pulse is optional (not every
+    monitor shows it); when present it must be an integer in range too.
+    """
+    if not isinstance(reading, dict):
+        return False
+    values = [reading.get(key) for key in ("systolic", "diastolic")]
+    pulse = reading.get("pulse")
+    if pulse is not None:
+        values.append(pulse)
+    if not all(isinstance(v, int) and not isinstance(v, bool) for v in values):
+        return False
+    sys, dia = values[:2]
+    return (
+        SYSTOLIC_RANGE[0] <= sys <= SYSTOLIC_RANGE[1]
+        and DIASTOLIC_RANGE[0] <= dia <= DIASTOLIC_RANGE[1]
+        and (pulse is None or PULSE_RANGE[0] <= pulse <= PULSE_RANGE[1])
+        and sys > dia
+    )
@@ -0,0 +1,155 @@
+"""
+Per-user daily blood pressure aggregates.
+
+Each reading is folded into one row per (user, CST day), so 7/30/90-day
+trends are answered from at most 90 small rows per user instead of
+scanning the raw records.
+"""
+from datetime import date, datetime, timedelta
+from services.bp_classifier import BP_CATEGORIES, classify_bp
+
+# CST hours counted as morning / evening measurements
+MORNING_HOURS = range(5, 12)
+EVENING_HOURS = range(18, 24)
+
+TREND_WINDOWS = (7, 30, 90)
+
+# (SQLite column, SQL Server column, how a new value is merged into the stored one)
+DAILY_STATS_COLUMNS = [
+    ("count", "次数", "sum"),
+    ("sum_systolic", "收缩压合计", "sum"),
+    ("sum_diastolic", "舒张压合计", "sum"),
+    ("pulse_count", "脉搏次数", "sum"),
+    ("sum_pulse", "脉搏合计", "sum"),
+    ("min_systolic", "收缩压最低", "min"),
+    ("max_systolic", "收缩压最高", "max"),
+    ("min_diastolic", "舒张压最低", "min"),
+    ("max_diastolic", "舒张压最高", "max"),
+    ("morning_count", "早间次数", "sum"),
+    ("morning_sum_systolic", "早间收缩压合计", "sum"),
+    ("morning_sum_diastolic", "早间舒张压合计", "sum"),
+    ("evening_count", "晚间次数", "sum"),
+    ("evening_sum_systolic", "晚间收缩压合计", "sum"),
+    ("evening_sum_diastolic", "晚间舒张压合计", "sum"),
+] + [(f"cat_{key}", f"{short}次数", "sum") for key, _, short, _, _ in BP_CATEGORIES]
+
+COLUMN_NAMES = [c[0] for c in DAILY_STATS_COLUMNS]
+
+
+def to_cst(utc_time):
+    """Convert a UTC datetime (or 'YYYY-MM-DD HH:MM:SS' string) to CST."""
+    if not isinstance(utc_time, datetime):
+        utc_time = datetime.strptime(str(utc_time)[:19], "%Y-%m-%d %H:%M:%S")
+    return utc_time + timedelta(hours=8)
+
+
+def reading_delta(systolic, diastolic, pulse, recorded_at_utc):
+    """
+    Aggregate contribution of one reading.
+
+    Returns (cst_day, {column: value}), or None when systolic/diastolic aren't numbers.
+    """
+    category = classify_bp(systolic, diastolic)
+    if category is None:
+        return None
+    systolic, diastolic = int(systolic), int(diastolic)
+    try:
+        pulse = int(pulse)
+    except (ValueError, TypeError):
+        pulse = None
+
+    cst = to_cst(recorded_at_utc)
+    morning = cst.hour in MORNING_HOURS
+    evening = cst.hour in EVENING_HOURS
+
+    values = {name: 0 for name in COLUMN_NAMES}
+    values.update({
+        "count": 1,
+        "sum_systolic": systolic,
+        "sum_diastolic": diastolic,
+        "pulse_count": 0 if pulse is None else 1,
+        "sum_pulse": pulse or 0,
+        "min_systolic": systolic,
+        "max_systolic": systolic,
+        "min_diastolic": diastolic,
+        "max_diastolic": diastolic,
+        "morning_count": int(morning),
+        "morning_sum_systolic": systolic if morning else 0,
+        "morning_sum_diastolic": diastolic if morning else 0,
+        "evening_count": int(evening),
+        "evening_sum_systolic": systolic if evening else 0,
+        "evening_sum_diastolic": diastolic if evening else 0,
+    })
+    values[f"cat_{BP_CATEGORIES[category][0]}"] = 1
+    return cst.strftime("%Y-%m-%d"), values
+
+
+def merge_values(current, delta):
+    """Fold `delta` into `current` using each column's merge rule."""
+    merged = {}
+    for name, _, rule in DAILY_STATS_COLUMNS:
+        a, b = current.get(name), delta.get(name)
+        if a is None or b is None:
+            merged[name] = b if a is None else a
+        elif rule == "min":
+            merged[name] = min(a, b)
+        elif rule == "max":
+            merged[name] = max(a, b)
+        else:
+            merged[name] = a + b
+    return merged
+
+
+def summarize(day_rows, today=None):
+    """
+    Build trend summaries from daily rows.
+
+    Args:
+        day_rows: iterable of (day, {column: value}) with day as date or 'YYYY-MM-DD'
+        today: CST date the windows end on (defaults to now)
+
+    Returns:
+        {window_days: summary dict or None when there are no readings}
+    """
+    today = today or to_cst(datetime.utcnow()).date()
+    parsed = []
+    for day, values in day_rows:
+        if not isinstance(day, date):
+            day = datetime.strptime(str(day)[:10], "%Y-%m-%d").date()
+        elif isinstance(day, datetime):
+            day = day.date()
+        parsed.append((day, values))
+
+    summaries = {}
+    for window in TREND_WINDOWS:
+        start = today - timedelta(days=window - 1)
+        totals = {}
+        for day, values in parsed:
+            if start <= day <= today:
+                totals = merge_values(totals, values)
+        summaries[window] = _summary(totals) if totals.get("count") else None
+    return summaries
+
+
+def _avg(total, count):
+    return round(total / count) if count else None
+
+
+def _summary(t):
+    return {
+        "count": t["count"],
+        "avg_systolic": _avg(t["sum_systolic"], t["count"]),
+        "avg_diastolic": _avg(t["sum_diastolic"], t["count"]),
+        "avg_pulse": _avg(t["sum_pulse"], t["pulse_count"]),
+        "min_systolic": t["min_systolic"],
+        "max_systolic": t["max_systolic"],
+        "min_diastolic": t["min_diastolic"],
+        "max_diastolic": t["max_diastolic"],
+        "morning_count": t["morning_count"],
+        "morning_avg_systolic": _avg(t["morning_sum_systolic"], t["morning_count"]),
+        "morning_avg_diastolic": _avg(t["morning_sum_diastolic"], t["morning_count"]),
+        "evening_count": t["evening_count"],
+        "evening_avg_systolic": _avg(t["evening_sum_systolic"], t["evening_count"]),
+        "evening_avg_diastolic": _avg(t["evening_sum_diastolic"], t["evening_count"]),
+        "categories": [(short, t[f"cat_{key}"]) for key, _, short, _, _ in BP_CATEGORIES if t[f"cat_{key}"]],
+    }
@@ -1,12 +1,74 @@
 import sqlite3
 import logging
 import os
-from datetime import datetime
+import threading
+from contextlib import contextmanager
+from datetime import datetime, timedelta
 from config import Config
+from services.daily_stats import (
+    COLUMN_NAMES, DAILY_STATS_COLUMNS, TREND_WINDOWS,
+    merge_values, reading_delta, summarize, to_cst,
+)
+from services.db_pool import ConnectionPool, SQLiteThreadLocal
+from services.write_buffer import WriteBuffer
 
 logger = logging.getLogger(__name__)
 
+def _merge_readings(readings, merged):
+    """Fold (user_id, systolic, diastolic, pulse, recorded_at) readings into {(user_id, day): values}."""
+    for user_id, systolic, diastolic, pulse, recorded_at in readings:
+        delta = reading_delta(systolic, diastolic, pulse, recorded_at)
+        if delta is None:
+            continue
+        day, values = delta
+        key = (user_id, day)
+        merged[key] = merge_values(merged.get(key, {}), values)
+    return merged
+
+def _sqlite_merge_expr(col, rule):
+    if rule == "min":
+        return f"{col} = MIN(COALESCE({col}, excluded.{col}), COALESCE(excluded.{col}, {col}))"
+    if rule == "max":
+        return f"{col} = MAX(COALESCE({col}, excluded.{col}), COALESCE(excluded.{col}, {col}))"
+    return f"{col} = {col} + excluded.{col}"
+
+def _sqlserver_merge_expr(col, rule):
+    if rule == "min":
+        return f"t.{col} = CASE WHEN t.{col} IS NULL OR s.{col} < t.{col} THEN s.{col} ELSE t.{col} END"
+    if rule == "max":
+        return f"t.{col} = CASE WHEN t.{col} IS NULL OR s.{col} > t.{col} THEN s.{col} ELSE t.{col} END"
+    return f"t.{col} = t.{col} + s.{col}"
+
+# Upserts that fold one (user, day) delta into the aggregate row
+_SQLITE_STATS_UPSERT = f"""
+    INSERT INTO daily_stats (user_id, day, {", ".join(c[0] for c in DAILY_STATS_COLUMNS)})
+    VALUES (?, ?, {", ".join("?" for _ in DAILY_STATS_COLUMNS)})
+    ON CONFLICT (user_id, day) DO UPDATE SET
+    {", ".join(_sqlite_merge_expr(c[0], c[2]) for c in DAILY_STATS_COLUMNS)}
+"""
+
+_SQLSERVER_STATS_UPSERT = f"""
+    MERGE 员工血压日统计 WITH (HOLDLOCK) AS t
+    USING (SELECT ? AS 员工ID, CAST(? AS DATE) AS 统计日期, {", ".join(f"? AS {c[1]}" for c in DAILY_STATS_COLUMNS)}) AS s
+    ON t.员工ID = s.员工ID AND t.统计日期 = s.统计日期
+    WHEN MATCHED THEN UPDATE SET
+        {", ".join(_sqlserver_merge_expr(c[1], c[2]) for c in DAILY_STATS_COLUMNS)}
+    WHEN NOT MATCHED THEN
+        INSERT (员工ID, 统计日期, {", ".join(c[1] for c in DAILY_STATS_COLUMNS)})
+        VALUES (s.员工ID, s.统计日期, {", ".join(f"s.{c[1]}" for c in DAILY_STATS_COLUMNS)});
+"""
+
 class DatabaseService:
+    # 9 parameters per row keeps each batched insert under SQL Server's 2100-parameter limit
+    SQLSERVER_INSERT_CHUNK = 200
+    # Bump whenever _create_schema changes so existing databases run the DDL once more
+    # 2: unique DingTalk message ID per record
+    SCHEMA_VERSION = 2
+
+    # Databases whose schema was already verified by this process
+    _schema_ready = set()
+    _schema_lock = threading.Lock()
+
     def __init__(self):
         self.db_type = Config.DB_TYPE
         
@@ -19,9 +81,57 @@ class DatabaseService:
                 raise
                 
         self.db_path = Config.DB_PATH
+        self._pool = self._build_pool()
         self._init_db()
 
+        self._write_buffer = None
+        if Config.DB_WRITE_BUFFER_ENABLED:
+            self._write_buffer = WriteBuffer(
+                self._insert_records,
+                max_rows=Config.DB_WRITE_BUFFER_MAX_ROWS,
+                max_delay_ms=Config.DB_WRITE_BUFFER_MAX_DELAY_MS,
+            )
+
+    def _build_pool(self):
+        if not Config.DB_POOL_ENABLED:
+            return None
+        if self.db_type == "sqlserver":
+            return ConnectionPool(
+                self._get_connection,
+                size=Config.DB_POOL_SIZE,
+                idle_timeout=Config.DB_POOL_IDLE_TIMEOUT,
+                health_check_interval=Config.DB_POOL_HEALTH_CHECK_INTERVAL,
+                checkout_timeout=Config.DB_POOL_TIMEOUT,
+            )
+        # Saved readings are the system of record, so a commit must survive a power failure
+        return SQLiteThreadLocal(self.db_path, synchronous="FULL")
+
+    @contextmanager
+    def _connection(self):
+        """
+        Yield a connection from the pool (or a fresh one when pooling is disabled).
+        The caller is responsible for committing.
+        """
+        if self._pool is not None:
+            with self._pool.connection() as conn:
+                yield conn
+            return
+
+        conn = self._get_connection()
+        try:
+            yield conn
+        finally:
+            conn.close()
+
+    def close(self):
+        """Flush buffered writes and close all pooled connections."""
+        if self._write_buffer is not None:
+            self._write_buffer.close()
+        if self._pool is not None:
+            self._pool.close_all()
+
     def _get_connection(self):
+        """Open a new, unpooled connection."""
         if self.db_type == "sqlserver":
             conn_str = (
                 f"DRIVER={{ODBC Driver 18 for SQL Server}};"
@@ -36,138 +146,517 @@ class DatabaseService:
         else:
             return sqlite3.connect(self.db_path)
 
+    def _schema_key(self):
+        if self.db_type == "sqlserver":
+            return self.db_type, f"{Config.SQLSERVER_HOST}:{Config.SQLSERVER_PORT}/{Config.SQLSERVER_DB}"
+        return self.db_type, os.path.abspath(self.db_path)
+
     def _init_db(self):
-        """Initialize the database schema."""
-        try:
-            conn = self._get_connection()
-            cursor = conn.cursor()
-            
-            if self.db_type == "sqlserver":
-                # SQL Server Schema
-                # Check if table exists
-                cursor.execute("""
-                    IF NOT EXISTS (SELECT * FROM sysobjects WHERE name='员工血压记录' AND xtype='U')
-                    BEGIN
-                        CREATE TABLE 员工血压记录 (
-                            ID INT IDENTITY(1,1) PRIMARY KEY,
-                            员工ID NVARCHAR(100) NOT NULL,
-                            员工姓名 NVARCHAR(100),
-                            收缩压 INT,
-                            舒张压 INT,
-                            脉搏 INT,
-                            图片链接 NVARCHAR(MAX),
-                            分析结果 NVARCHAR(MAX),
-                            记录时间 DATETIME DEFAULT GETDATE()
-                        )
-                    END
+        """
+        Initialize the database schema.
+        The DDL only runs when the stored schema version is older than SCHEMA_VERSION,
+        and each database is checked once per process.
+        """
+        key = self._schema_key()
+        if key in DatabaseService._schema_ready:
+            return
+        with DatabaseService._schema_lock:
+            if key in DatabaseService._schema_ready:
+                return
+            try:
+                with self._connection() as conn:
+                    version = self._get_schema_version(conn)
+                    if version >= self.SCHEMA_VERSION:
+                        logger.info(f"Database ({self.db_type}) schema is up to date (version {version}).")
+                    else:
+                        self._create_schema(conn)
+                        self._set_schema_version(conn, self.SCHEMA_VERSION)
+                        conn.commit()
+                        logger.info(f"Database ({self.db_type}) initialized successfully (schema version {self.SCHEMA_VERSION}).")
+                DatabaseService._schema_ready.add(key)
+            except Exception as e:
+                logger.error(f"Error initializing database: {e}")
+                raise
+
+    def _get_schema_version(self, conn):
+        cursor = conn.cursor()
+        if self.db_type == "sqlserver":
+            cursor.execute("""
+                SELECT CASE WHEN OBJECT_ID('架构版本', 'U') IS NULL THEN 0
+                            ELSE (SELECT MAX(版本) FROM 架构版本) END
+            """)
+            row = cursor.fetchone()
+            return row[0] or 0
+        cursor.execute("PRAGMA user_version")
+        return cursor.fetchone()[0]
+
+    def _set_schema_version(self, conn, version):
+        cursor = conn.cursor()
+        if self.db_type == "sqlserver":
+            cursor.execute("""
+                IF OBJECT_ID('架构版本', 'U') IS NULL
+                    CREATE TABLE 架构版本 (版本 INT NOT NULL)
+            """)
+            cursor.execute("DELETE FROM 架构版本")
+            cursor.execute("INSERT INTO 架构版本 (版本) VALUES (?)", (version,))
+        else:
+            # PRAGMA doesn't take parameters; version is always an int
+            cursor.execute(f"PRAGMA user_version = {int(version)}")
+
+    def _create_schema(self, conn):
+        cursor = conn.cursor()
+
+        if self.db_type == "sqlserver":
+            # SQL Server Schema
+            # Check if table exists
+            cursor.execute("""
+                IF NOT EXISTS (SELECT * FROM sysobjects WHERE name='员工血压记录' AND xtype='U')
+                BEGIN
+                    CREATE TABLE 员工血压记录 (
+                        ID INT IDENTITY(1,1) PRIMARY KEY,
+                        员工ID NVARCHAR(100) NOT NULL,
+                        员工姓名 NVARCHAR(100),
+                        收缩压 INT,
+                        舒张压 INT,
+                        脉搏 INT,
+                        图片链接 NVARCHAR(MAX),
+                        分析结果 NVARCHAR(MAX),
+                        记录时间 DATETIME DEFAULT GETDATE(),
+                        消息ID NVARCHAR(100) NULL
+                    )
+                END
+            """)
+
+            # Migration for existing tables; DDL referencing the new column runs in a later batch
+            cursor.execute("""
+                IF COL_LENGTH('员工血压记录', '消息ID') IS NULL
+                    ALTER TABLE 员工血压记录 ADD 消息ID NVARCHAR(100) NULL
+            """)
+
+            # One record per DingTalk message; records without a message ID are not constrained
+            cursor.execute("""
+                IF NOT EXISTS (SELECT * FROM sys.indexes WHERE name='UX_员工血压记录_消息ID' AND object_id=OBJECT_ID('员工血压记录'))
+                BEGIN
+                    CREATE UNIQUE NONCLUSTERED INDEX UX_员工血压记录_消息ID
+                    ON 员工血压记录 (消息ID) WHERE 消息ID IS NOT NULL
+                END
+            """)
+
+            # Covering index for per-user history: seek on employee, read newest first
+            cursor.execute("""
+                IF NOT EXISTS (SELECT * FROM sys.indexes WHERE name='IX_员工血压记录_员工ID_记录时间' AND object_id=OBJECT_ID('员工血压记录'))
+                BEGIN
+                    CREATE NONCLUSTERED INDEX IX_员工血压记录_员工ID_记录时间
+                    ON 员工血压记录 (员工ID, 记录时间 DESC, ID DESC)
+                    INCLUDE (收缩压, 舒张压, 脉搏, 图片链接, 分析结果)
+                END
+            """)
+
+            # Time-ordered index for reports and incremental exports
+            cursor.execute("""
+                IF NOT EXISTS (SELECT * FROM sys.indexes WHERE name='IX_员工血压记录_记录时间' AND object_id=OBJECT_ID('员工血压记录'))
+                BEGIN
+                    CREATE NONCLUSTERED INDEX IX_员工血压记录_记录时间 ON 员工血压记录 (记录时间, ID)
+                END
+            """)
+
+            # Per-user daily aggregates for trend queries
+            cursor.execute("SELECT OBJECT_ID('员工血压日统计', 'U')")
+            stats_exists = cursor.fetchone()[0] is not None
+            if not stats_exists:
+                columns = ",\n".join(f"{col} INT" for _, col, _ in DAILY_STATS_COLUMNS)
+                cursor.execute(f"""
+                    CREATE TABLE 员工血压日统计 (
+                        员工ID NVARCHAR(100) NOT NULL,
+                        统计日期 DATE NOT NULL,
+                        {columns},
+                        PRIMARY KEY (员工ID, 统计日期)
+                    )
                 """)
-            else:
-                # SQLite Schema (Legacy)
-                cursor.execute("""
-                    CREATE TABLE IF NOT EXISTS records (
-                        id INTEGER PRIMARY KEY AUTOINCREMENT,
+        else:
+            # SQLite Schema (Legacy)
+            cursor.execute("""
+                CREATE TABLE IF NOT EXISTS records (
+                    id INTEGER PRIMARY KEY AUTOINCREMENT,
+                    user_id TEXT NOT NULL,
+                    user_name TEXT,
+                    systolic INTEGER,
+                    diastolic INTEGER,
+                    pulse INTEGER,
+                    image_url TEXT,
+                    result TEXT,
+                    created_at TIMESTAMP DEFAULT CURRENT_TIMESTAMP,
+                    msg_id TEXT
+                )
+            """)
+
+            # Check if 'result' column exists (migration for existing dbs)
+            cursor.execute("PRAGMA table_info(records)")
+            columns = [info[1] for info in cursor.fetchall()]
+            if "result" not in columns:
+                logger.info("Adding 'result' column to records table...")
+                cursor.execute("ALTER TABLE records ADD COLUMN result TEXT")
+            if "msg_id" not in columns:
+                logger.info("Adding 'msg_id' column to records table...")
+                cursor.execute("ALTER TABLE records ADD COLUMN msg_id TEXT")
+
+            # One record per DingTalk message (SQLite unique indexes allow any number of NULLs)
+            cursor.execute("CREATE UNIQUE INDEX IF NOT EXISTS idx_records_msg_id ON records (msg_id)")
+
+            # Covering index for per-user history (SQLite has no INCLUDE, so all read columns are keys)
+            cursor.execute("""
+                CREATE INDEX IF NOT EXISTS idx_records_user_created
+                ON records (user_id, created_at DESC, id DESC, systolic, diastolic, pulse, result, image_url)
+            """)
+
+            # Time-ordered index for reports and incremental exports
+            cursor.execute("CREATE INDEX IF NOT EXISTS idx_records_created ON records (created_at, id)")
+
+            # Per-user daily aggregates for trend queries
+            cursor.execute("SELECT 1 FROM sqlite_master WHERE type='table' AND name='daily_stats'")
+            stats_exists = cursor.fetchone() is not None
+            if not stats_exists:
+                columns = ",\n".join(f"{col} INTEGER" for col, _, _ in DAILY_STATS_COLUMNS)
+                cursor.execute(f"""
+                    CREATE TABLE daily_stats (
                         user_id TEXT NOT NULL,
-                        user_name TEXT,
-                        systolic INTEGER,
-                        diastolic INTEGER,
-                        pulse INTEGER,
-                        image_url TEXT,
-                        result TEXT,
-                        created_at TIMESTAMP DEFAULT CURRENT_TIMESTAMP
+                        day TEXT NOT NULL,
+                        {columns},
+                        PRIMARY KEY (user_id, day)
                     )
                 """)
-                
-                # Check if 'result' column exists (migration for existing dbs)
-                cursor.execute("PRAGMA table_info(records)")
-                columns = [info[1] for info in cursor.fetchall()]
-                if "result" not in columns:
-                    logger.info("Adding 'result' column to records table...")
-                    cursor.execute("ALTER TABLE records ADD COLUMN result TEXT")
-            
-            conn.commit()
-            conn.close()
-            logger.info(f"Database ({self.db_type}) initialized successfully.")
-        except Exception as e:
-            logger.error(f"Error initializing database: {e}")
-            raise
 
-    def add_record(self, user_id, user_name, systolic, diastolic, pulse, image_url=None, result=None):
-        """Add a new blood pressure record."""
+        if not stats_exists:
+            self._backfill_daily_stats(cursor)
+
+    def add_record(self, user_id, user_name, systolic, diastolic, pulse, image_url=None, result=None, msg_id=None):
+        """
+        Add a new blood pressure record.
+        With a DingTalk `msg_id`, a second insert for the same message returns the existing record's ID.
+        """
+        row = (user_id, user_name, systolic, diastolic, pulse, image_url, result, msg_id)
         try:
-            conn = self._get_connection()
+            if self._write_buffer is not None:
+                # Group commit: wait until the batch containing this row is durable
+                return self._write_buffer.submit(row).result(timeout=Config.DB_WRITE_BUFFER_TIMEOUT)
+            return self._insert_records([row])[0]
+        except Exception as e:
+            logger.error(f"Error adding record: {e}")
+            return None
+
+    def _insert_records(self, rows):
+        """
+        Insert rows in a single transaction and return their IDs in order.
+        Each row is (user_id, user_name, systolic, diastolic, pulse, image_url, result, msg_id).
+        Rows whose msg_id is already stored are not inserted again; the existing record's ID
+        is returned for them.
+        """
+        with self._connection() as conn:
             cursor = conn.cursor()
-            
+
             if self.db_type == "sqlserver":
-                cursor.execute("""
-                    INSERT INTO 员工血压记录 (员工ID, 员工姓名, 收缩压, 舒张压, 脉搏, 图片链接, 分析结果)
-                    VALUES (?, ?, ?, ?, ?, ?, ?)
-                """, (user_id, user_name, systolic, diastolic, pulse, image_url, result))
-                
-                # Get last inserted ID
-                cursor.execute("SELECT @@IDENTITY")
-                last_id = cursor.fetchone()[0]
+                if len(rows) == 1 and rows[0][7] is None:
+                    # OUTPUT returns the identity in the same round trip as the insert
+                    cursor.execute("""
+                        INSERT INTO 员工血压记录 (员工ID, 员工姓名, 收缩压, 舒张压, 脉搏, 图片链接, 分析结果)
+                        OUTPUT INSERTED.ID
+                        VALUES (?, ?, ?, ?, ?, ?, ?)
+                    """, rows[0][:7])
+                    ids = [cursor.fetchone()[0]]
+                else:
+                    ids = []
+                    for i in range(0, len(rows), self.SQLSERVER_INSERT_CHUNK):
+                        ids.extend(self._merge_insert_chunk(cursor, rows[i:i + self.SQLSERVER_INSERT_CHUNK]))
             else:
-                cursor.execute("""
-                    INSERT INTO records (user_id, user_name, systolic, diastolic, pulse, image_url, result)
-                    VALUES (?, ?, ?, ?, ?, ?, ?)
-                """, (user_id, user_name, systolic, diastolic, pulse, image_url, result))
-                last_id = cursor.lastrowid
-                
+                ids = []
+                for row in rows:
+                    cursor.execute("""
+                        INSERT INTO records (user_id, user_name, systolic, diastolic, pulse, image_url, result, msg_id)
+                        VALUES (?, ?, ?, ?, ?, ?, ?, ?)
+                        ON CONFLICT (msg_id) DO NOTHING
+                    """, row)
+                    ids.append(cursor.lastrowid if cursor.rowcount else None)
+
+            inserted = [(row, row_id) for row, row_id in zip(rows, ids) if row_id is not None]
+            duplicates = [i for i, row_id in enumerate(ids) if row_id is None]
+            if duplicates:
+                existing = self._record_ids_by_msg_id(cursor, {rows[i][7] for i in duplicates})
+                for i in duplicates:
+                    ids[i] = existing.get(rows[i][7])
+                logger.info(f"Skipped {len(duplicates)} duplicate records for already stored messages")
+
+            # Keep the daily aggregates in step with the records, in the same transaction,
+            # dated by each record's stored timestamp as the backfill does
+            if inserted:
+                created = self._created_at_by_id(cursor, [row_id for _, row_id in inserted])
+                self._update_daily_stats(cursor, [(r[0], r[2], r[3], r[4], created[row_id])
+                                                  for r, row_id in inserted if created.get(row_id) is not None])
+
             conn.commit()
-            conn.close()
-            return last_id
-        except Exception as e:
-            logger.error(f"Error adding record: {e}")
-            return None
+            return ids
+
+    def _created_at_by_id(self, cursor, record_ids):
+        """{record ID: stored timestamp} for the given records."""
+        created = {}
+        # Chunked to stay under the bound-parameter limits
+        for i in range(0, len(record_ids), self.SQLSERVER_INSERT_CHUNK):
+            chunk = record_ids[i:i + self.SQLSERVER_INSERT_CHUNK]
+            placeholders = ", ".join("?" for _ in chunk)
+            if self.db_type == "sqlserver":
+                cursor.execute(f"SELECT ID, 记录时间 FROM 员工血压记录 WHERE ID IN ({placeholders})", chunk)
+            else:
+                cursor.execute(f"SELECT id, created_at FROM records WHERE id IN ({placeholders})", chunk)
+            created.update((row_id, created_at) for row_id, created_at in cursor.fetchall())
+        return created
+
+    def _record_ids_by_msg_id(self, cursor, msg_ids):
+        """{msg_id: record ID} for the given DingTalk message IDs that are already stored."""
+        msg_ids = list(msg_ids)
+        placeholders = ", ".join("?" for _ in msg_ids)
+        if self.db_type == "sqlserver":
+            cursor.execute(f"SELECT 消息ID, ID FROM 员工血压记录 WHERE 消息ID IN ({placeholders})", msg_ids)
+        else:
+            cursor.execute(f"SELECT msg_id, id FROM records WHERE msg_id IN ({placeholders})", msg_ids)
+        return {msg_id: row_id for msg_id, row_id in cursor.fetchall()}
+
+    def _update_daily_stats(self, cursor, readings):
+        """
+        Fold readings into the daily aggregate table.
+        Each reading is (user_id, systolic, diastolic, pulse, recorded_at_utc).
+        """
+        merged = _merge_readings(readings, {})
+        for (user_id, day), values in merged.items():
+            params = [user_id, day] + [values[name] for name in COLUMN_NAMES]
+            if self.db_type == "sqlserver":
+                cursor.execute(_SQLSERVER_STATS_UPSERT, params)
+            else:
+                cursor.execute(_SQLITE_STATS_UPSERT, params)
+
+    def _backfill_daily_stats(self, cursor):
+        """Build the daily aggregates from existing records (runs once, when the table is created)."""
+        if self.db_type == "sqlserver":
+            cursor.execute("SELECT 员工ID, 收缩压, 舒张压, 脉搏, 记录时间 FROM 员工血压记录")
+        else:
+            cursor.execute("SELECT user_id, systolic, diastolic, pulse, created_at FROM records")
+
+        # Memory grows with the number of (user, day) pairs, not with the number of records
+        merged = {}
+        while True:
+            rows = cursor.fetchmany(1000)
+            if not rows:
+                break
+            _merge_readings((tuple(r) for r in rows if r[4] is not None), merged)
+
+        for (user_id, day), values in merged.items():
+            params = [user_id, day] + [values[name] for name in COLUMN_NAMES]
+            if self.db_type == "sqlserver":
+                cursor.execute(_SQLSERVER_STATS_UPSERT, params)
+            else:
+                cursor.execute(_SQLITE_STATS_UPSERT, params)
+        if merged:
+            logger.info(f"Built daily statistics for {len(merged)} user-days from existing records.")
+
+    def _merge_insert_chunk(self, cursor, rows):
+        """
+        Insert many rows in one statement on SQL Server and map identities back to rows.
+
+        A plain multi-row INSERT ... OUTPUT doesn't guarantee output order, so
+        MERGE is used because its OUTPUT clause can return the source row's ordinal.
+        Rows whose message ID is already stored match and are skipped (their ID is None);
+        rows without a message ID never match.
+        """
+        values = ", ".join(["(?, ?, ?, ?, ?, ?, ?, ?, ?)"] * len(rows))
+        params = []
+        for ordinal, row in enumerate(rows):
+            params.extend(row)
+            params.append(ordinal)
+
+        cursor.execute(f"""
+            MERGE INTO 员工血压记录 AS t
+            USING (VALUES {values}) AS s (员工ID, 员工姓名, 收缩压, 舒张压, 脉搏, 图片链接, 分析结果, 消息ID, 序号)
+            ON t.消息ID = s.消息ID
+            WHEN NOT MATCHED THEN
+                INSERT (员工ID, 员工姓名, 收缩压, 舒张压, 脉搏, 图片链接, 分析结果, 消息ID)
+                VALUES (s.员工ID, s.员工姓名, s.收缩压, s.舒张压, s.脉搏, s.图片链接, s.分析结果, s.消息ID)
+            OUTPUT s.序号, INSERTED.ID;
+        """, params)
 
-    def get_user_history(self, user_id, limit=10):
+        ids = [None] * len(rows)
+        for ordinal, row_id in cursor.fetchall():
+            ids[ordinal] = row_id
+        return ids
+
+    def get_user_history(self, user_id, limit=10, before=None):
         """Get the last N records for a user."""
+        rows, _ = self.get_user_history_page(user_id, limit, before)
+        return rows
+
+    def get_user_history_page(self, user_id, limit=10, before=None):
+        """
+        Get one page of a user's records, newest first, using keyset pagination.
+
+        Args:
+            user_id: employee id
+            limit: page size
+            before: cursor returned by the previous page, or None for the newest records
+
+        Returns:
+            (rows, next_cursor) where next_cursor is None when there are no older records.
+        """
         try:
-            conn = self._get_connection()
-            cursor = conn.cursor()
-            
-            if self.db_type == "sqlserver":
-                # Note: TOP is used in SQL Server instead of LIMIT
-                cursor.execute("""
-                    SELECT TOP (?) 收缩压, 舒张压, 脉搏, 记录时间, 图片链接, 分析结果
-                    FROM 员工血压记录
-                    WHERE 员工ID = ?
-                    ORDER BY 记录时间 DESC
-                """, (limit, user_id))
-                
+            with self._connection() as conn:
+                cursor = conn.cursor()
+
+                # Seek past the cursor instead of OFFSET so every page is an index range scan.
+                # (time, id) breaks ties between records written in the same second.
+                if self.db_type == "sqlserver":
+                    # Note: TOP is used in SQL Server instead of LIMIT
+                    if before is None:
+                        cursor.execute("""
+                            SELECT TOP (?) 收缩压, 舒张压, 脉搏, 记录时间, 图片链接, 分析结果, ID
+                            FROM 员工血压记录
+                            WHERE 员工ID = ?
+                            ORDER BY 记录时间 DESC, ID DESC
+                        """, (limit + 1, user_id))
+                    else:
+                        cursor.execute("""
+                            SELECT TOP (?) 收缩压, 舒张压, 脉搏, 记录时间, 图片链接, 分析结果, ID
+                            FROM 员工血压记录
+                            WHERE 员工ID = ?
+                              AND (记录时间 < ? OR (记录时间 = ? AND ID < ?))
+                            ORDER BY 记录时间 DESC, ID DESC
+                        """, (limit + 1, user_id, before[0], before[0], before[1]))
+                else:
+                    if before is None:
+                        cursor.execute("""
+                            SELECT systolic, diastolic, pulse, created_at, image_url, result, id
+                            FROM records
+                            WHERE user_id = ?
+                            ORDER BY created_at DESC, id DESC
+                            LIMIT ?
+                        """, (user_id, limit + 1))
+                    else:
+                        cursor.execute("""
+                            SELECT systolic, diastolic, pulse, created_at, image_url, result, id
+                            FROM records
+                            WHERE user_id = ?
+                              AND (created_at < ? OR (created_at = ? AND id < ?))
+                            ORDER BY created_at DESC, id DESC
+                            LIMIT ?
+                        """, (user_id, before[0], before[0], before[1], limit + 1))
+
                 # Convert pyodbc rows to tuples to match sqlite format if needed
                 # pyodbc returns Row objects which are indexable like tuples
                 rows = cursor.fetchall()
-                
-                # Format time string to match SQLite's string format if necessary
-                # SQL Server returns datetime objects. SQLite returns strings (usually).
-                # The handlers.py expects a string in _format_time_to_cst: datetime.strptime(time_str, "%Y-%m-%d %H:%M:%S")
-                # So we need to convert datetime objects to string
-                result_rows = []
-                for row in rows:
-                    # row indices: 0:sys, 1:dia, 2:pulse, 3:time, 4:url, 5:result
-                    time_val = row[3]
-                    if isinstance(time_val, datetime):
-                        time_str = time_val.strftime("%Y-%m-%d %H:%M:%S")
-                    else:
-                        time_str = str(time_val)
-                    
-                    result_rows.append((row[0], row[1], row[2], time_str, row[4], row[5]))
-                
-                conn.close()
-                return result_rows
-            else:
-                cursor.execute("""
-                    SELECT systolic, diastolic, pulse, created_at, image_url, result
-                    FROM records
-                    WHERE user_id = ?
-                    ORDER BY created_at DESC
-                    LIMIT ?
-                """, (user_id, limit))
-                rows = cursor.fetchall()
-                conn.close()
-                return rows
-                
+
+            # One extra row was fetched to know whether another page exists
+            next_cursor = None
+            if len(rows) > limit:
+                rows = rows[:limit]
+                last = rows[-1]
+                # Keep the raw time value so the next seek compares like with like
+                next_cursor = (last[3], last[6])
+
+            # Format time string to match SQLite's string format if necessary
+            # SQL Server returns datetime objects. SQLite returns strings (usually).
+            # The handlers.py expects a string in _format_time_to_cst: datetime.strptime(time_str, "%Y-%m-%d %H:%M:%S")
+            # So we need to convert datetime objects to string
+            result_rows = []
+            for row in rows:
+                # row indices: 0:sys, 1:dia, 2:pulse, 3:time, 4:url, 5:result
+                time_val = row[3]
+                if isinstance(time_val, datetime):
+                    time_str = time_val.strftime("%Y-%m-%d %H:%M:%S")
+                else:
+                    time_str = str(time_val)
+
+                result_rows.append((row[0], row[1], row[2], time_str, row[4], row[5]))
+
+            return result_rows, next_cursor
+
         except Exception as e:
             logger.error(f"Error fetching history: {e}")
+            return [], None
+
+    def iter_records(self, since=None, until=None, after=None, chunk_size=5000):
+        """
+        Stream records in (time, id) order as lists of up to `chunk_size` rows.
+
+        Args:
+            since: only records at or after this time ('YYYY-MM-DD[ HH:MM:SS]' or datetime)
+            until: only records before this time
+            after: (time, id) watermark; only records strictly after it (incremental exports)
+
+        Yields:
+            lists of (id, user_id, user_name, systolic, diastolic, pulse, result, created_at)
+        """
+        if self.db_type == "sqlserver":
+            sql = "SELECT ID, 员工ID, 员工姓名, 收缩压, 舒张压, 脉搏, 分析结果, 记录时间 FROM 员工血压记录 WHERE 1 = 1"
+            time_col, id_col = "记录时间", "ID"
+        else:
+            sql = "SELECT id, user_id, user_name, systolic, diastolic, pulse, result, created_at FROM records WHERE 1 = 1"
+            time_col, id_col = "created_at", "id"
+
+        params = []
+        if since is not None:
+            sql += f" AND {time_col} >= ?"
+            params.append(since)
+        if until is not None:
+            sql += f" AND {time_col} < ?"
+            params.append(until)
+        if after is not None:
+            sql += f" AND ({time_col} > ? OR ({time_col} = ? AND {id_col} > ?))"
+            params.extend([after[0], after[0], after[1]])
+        sql += f" ORDER BY {time_col}, {id_col}"
+
+        with self._connection() as conn:
+            cursor = conn.cursor()
+            cursor.execute(sql, params)
+            while True:
+                rows = cursor.fetchmany(chunk_size)
+                if not rows:
+                    break
+                yield [tuple(r) for r in rows]
+
+    def get_all_user_ids(self):
+        """Get the IDs of every employee who has at least one record."""
+        try:
+            with self._connection() as conn:
+                cursor = conn.cursor()
+                if self.db_type == "sqlserver":
+                    cursor.execute("SELECT DISTINCT 员工ID FROM 员工血压记录")
+                else:
+                    cursor.execute("SELECT DISTINCT user_id FROM records")
+                return [row[0] for row in cursor.fetchall()]
+        except Exception as e:
+            logger.error(f"Error fetching user ids: {e}")
             return []
+
+    def get_user_trends(self, user_id):
+        """
+        Get 7/30/90-day trend summaries for a user from the daily aggregates.
+        Returns {window_days: summary or None}, or None on error.
+        """
+        since = (to_cst(datetime.utcnow()) - timedelta(days=max(TREND_WINDOWS))).strftime("%Y-%m-%d")
+        columns = [col for col, _, _ in DAILY_STATS_COLUMNS]
+        try:
+            with self._connection() as conn:
+                cursor = conn.cursor()
+                if self.db_type == "sqlserver":
+                    select = ", ".join(col for _, col, _ in DAILY_STATS_COLUMNS)
+                    cursor.execute(f"""
+                        SELECT 统计日期, {select}
+                        FROM 员工血压日统计
+                        WHERE 员工ID = ? AND 统计日期 >= ?
+                    """, (user_id, since))
+                else:
+                    cursor.execute(f"""
+                        SELECT day, {", ".join(columns)}
+                        FROM daily_stats
+                        WHERE user_id = ? AND day >= ?
+                    """, (user_id, since))
+                rows = cursor.fetchall()
+            return summarize((row[0], dict(zip(columns, row[1:]))) for row in rows)
+        except Exception as e:
+            logger.error(f"Error fetching trends: {e}")
+            return None
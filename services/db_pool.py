@@ -0,0 +1,206 @@
+import sqlite3
+import threading
+import time
+import logging
+from collections import deque
+from contextlib import contextmanager
+
+logger = logging.getLogger(__name__)
+
+
+class PoolTimeoutError(Exception):
+    """Raised when no pooled connection becomes available in time."""
+
+
+class ConnectionPool:
+    """
+    Thread-safe pool of reusable DB-API connections (used for SQL Server).
+
+    Connections are created lazily up to `size`, closed after sitting idle
+    for `idle_timeout` seconds, and health-checked on checkout when they
+    have been idle longer than `health_check_interval` seconds.
+    """
+
+    def __init__(self, connect, size=5, idle_timeout=300, health_check_interval=30,
+                 checkout_timeout=30, health_check_query="SELECT 1"):
+        """
+        Args:
+            connect: callable returning a new DB-API connection
+            size: max number of open connections
+            idle_timeout: seconds after which an idle connection is closed
+            health_check_interval: idle seconds after which a connection is pinged before reuse
+            checkout_timeout: seconds to wait for a free connection
+            health_check_query: query used to ping a connection
+        """
+        self._connect = connect
+        self.size = size
+        self.idle_timeout = idle_timeout
+        self.health_check_interval = health_check_interval
+        self.checkout_timeout = checkout_timeout
+        self.health_check_query = health_check_query
+
+        self._idle = deque()  # (conn, last_used)
+        self._open = 0
+        self._cond = threading.Condition()
+        self._closed = False
+
+    def acquire(self):
+        """Check out a connection, waiting up to checkout_timeout seconds."""
+        deadline = time.monotonic() + self.checkout_timeout
+        while True:
+            conn, last_used, create = None, None, False
+            with self._cond:
+                if self._closed:
+                    raise RuntimeError("Connection pool is closed")
+                if self._idle:
+                    # LIFO keeps a small set of connections warm
+                    conn, last_used = self._idle.pop()
+                elif self._open < self.size:
+                    self._open += 1
+                    create = True
+                else:
+                    remaining = deadline - time.monotonic()
+                    if remaining <= 0:
+                        raise PoolTimeoutError(f"No database connection available within {self.checkout_timeout}s")
+                    self._cond.wait(remaining)
+                    continue
+
+            if create:
+                try:
+                    return self._connect()
+                except Exception:
+                    self._discard(None)
+                    raise
+
+            idle_for = time.monotonic() - last_used
+            if idle_for > self.idle_timeout:
+                self._discard(conn)
+                continue
+            if idle_for > self.health_check_interval and not self._is_healthy(conn):
+                logger.warning("Discarding unhealthy pooled database connection")
+                self._discard(conn)
+                continue
+            return conn
+
+    def release(self, conn, broken=False):
+        """Return a connection to the pool, or drop it if it is broken."""
+        if not broken:
+            try:
+                # Never hand a connection with an open transaction to the next caller
+                conn.rollback()
+            except Exception:
+                broken = True
+
+        if broken:
+            self._discard(conn)
+            return
+
+        with self._cond:
+            if self._closed:
+                self._close_quietly(conn)
+                self._open -= 1
+            else:
+                self._idle.append((conn, time.monotonic()))
+            self._cond.notify()
+
+    @contextmanager
+    def connection(self):
+        """Context manager that checks a connection out and back in."""
+        conn = self.acquire()
+        broken = False
+        try:
+            yield conn
+        except Exception:
+            broken = not self._is_healthy(conn)
+            raise
+        finally:
+            self.release(conn, broken=broken)
+
+    def close_all(self):
+        """Close every idle connection and refuse new checkouts."""
+        with self._cond:
+            self._closed = True
+            while self._idle:
+                conn, _ = self._idle.pop()
+                self._close_quietly(conn)
+                self._open -= 1
+            self._cond.notify_all()
+
+    def _is_healthy(self, conn):
+        try:
+            cursor = conn.cursor()
+            cursor.execute(self.health_check_query)
+            cursor.fetchall()
+            cursor.close()
+            return True
+        except Exception:
+            return False
+
+    def _discard(self, conn):
+        if conn is not None:
+            self._close_quietly(conn)
+        with self._cond:
+            self._open -= 1
+            self._cond.notify()
+
+    @staticmethod
+    def _close_quietly(conn):
+        try:
+            conn.close()
+        except Exception:
+            pass
+
+
+class SQLiteThreadLocal:
+    """
+    One long-lived SQLite connection per thread, opened in WAL mode.
+
+    Exposes the same `connection()` / `close_all()` interface as
+    ConnectionPool so DatabaseService can use either transparently.
+
+    `synchronous` is the PRAGMA value. In WAL mode NORMAL never corrupts the
+    database, but the last commits before a power failure or OS crash can be
+    lost; FULL syncs the WAL on every commit so committed data survives.
+    """
+
+    def __init__(self, db_path, busy_timeout=30, synchronous="NORMAL"):
+        self.db_path = db_path
+        self.busy_timeout = busy_timeout
+        self.synchronous = synchronous
+        self._local = threading.local()
+        self._all = []
+        self._lock = threading.Lock()
+
+    def _open(self):
+        conn = sqlite3.connect(self.db_path, timeout=self.busy_timeout, check_same_thread=False)
+        # WAL lets readers run alongside the writer
+        conn.execute("PRAGMA journal_mode=WAL")
+        conn.execute(f"PRAGMA synchronous={self.synchronous}")
+        with self._lock:
+            self._all.append(conn)
+        return conn
+
+    @contextmanager
+    def connection(self):
+        conn = getattr(self._local, "conn", None)
+        if conn is None:
+            conn = self._open()
+            self._local.conn = conn
+        try:
+            yield conn
+        except Exception:
+            conn.rollback()
+            raise
+        finally:
+            if conn.in_transaction:
+                conn.rollback()
+
+    def close_all(self):
+        with self._lock:
+            for conn in self._all:
+                try:
+                    conn.close()
+                except Exception:
+                    pass
+            self._all = []
+        self._local = threading.local()
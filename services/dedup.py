@@ -0,0 +1,41 @@
+import threading
+import time
+from collections import OrderedDict
+
+
+class SeenMessages:
+    """
+    Bounded set of recently seen message IDs with a TTL.
+
+    Used to drop stream redeliveries before any work is done. Entries
+    expire after `ttl` seconds, and the oldest entries are evicted once
+    `max_entries` is reached, so memory stays bounded however many
+    messages arrive.
+    """
+
+    def __init__(self, max_entries=10000, ttl=600):
+        self.max_entries = max_entries
+        self.ttl = ttl
+        self._seen = OrderedDict()  # msg_id -> expiry (monotonic), oldest first
+        self._lock = threading.Lock()
+
+    def seen(self, msg_id):
+        """Record `msg_id`; return True if it was already seen within the TTL."""
+        now = time.monotonic()
+        with self._lock:
+            expiry = self._seen.get(msg_id)
+            if expiry is not None and expiry > now:
+                return True
+            self._seen[msg_id] = now + self.ttl
+            self._seen.move_to_end(msg_id)
+            # Entries are in insertion order, so expired ones are at the front
+            while self._seen:
+                oldest, oldest_expiry = next(iter(self._seen.items()))
+                if oldest_expiry > now and len(self._seen) <= self.max_entries:
+                    break
+                del self._seen[oldest]
+            return False
+
+    def __len__(self):
+        with self._lock:
+            return len(self._seen)
@@ -1,45 +1,77 @@
-import requests
 import json
-import time
 import logging
 from config import Config
+from services.resilience import call_with_retry, get_breaker
+from services.token_manager import TokenManager
 
 logger = logging.getLogger(__name__)
 
+def _is_retryable_response(resp):
+    return resp.status_code == 429 or resp.status_code >= 500
+
 class DingTalkAPI:
     def __init__(self):
         self.app_key = Config.DINGTALK_APP_KEY
         self.app_secret = Config.DINGTALK_APP_SECRET
-        self.access_token = None
-        self.token_expires_at = 0
+        # (connect, read) timeouts so a hung socket can't block a worker forever
+        self.timeout = (Config.HTTP_CONNECT_TIMEOUT, Config.HTTP_READ_TIMEOUT)
+        self.session = self._build_session()
+        # Shared by every DingTalkAPI in the process so the token is fetched once
+        self.token_manager = TokenManager.for_app(
+            self.app_key,
+            self.app_secret,
+            cache_file=Config.DINGTALK_TOKEN_CACHE_FILE or None,
+            refresh_margin=Config.DINGTALK_TOKEN_REFRESH_MARGIN,
+            session=self.session,
+            timeout=self.timeout,
+            token_url=f"{Config.DINGTALK_OAPI_BASE}/gettoken",
+        )
+
+    @staticmethod
+    def _build_session():
+        """
+        Keep-alive session reused for every DingTalk request.
+        pool_connections caps the number of hosts kept warm, pool_maxsize the
+        connections per host; pool_block makes callers wait instead of opening more.
+        """
+        # Imported here so importing the module (e.g. by CLI tools) stays cheap
+        import requests
+        from requests.adapters import HTTPAdapter
+
+        session = requests.Session()
+        adapter = HTTPAdapter(
+            pool_connections=Config.HTTP_POOL_CONNECTIONS,
+            pool_maxsize=Config.HTTP_POOL_MAXSIZE,
+            pool_block=True,
+        )
+        session.mount("https://", adapter)
+        session.mount("http://", adapter)
+        return session
+
+    def close(self):
+        self.session.close()
+
+    def _post(self, endpoint, url, max_attempts=None, **kwargs):
+        """
+        POST through the shared session, retrying network errors, 429 and 5xx
+        under a per-endpoint circuit breaker and deadline. `max_attempts=1`
+        makes a single attempt, for callers that retry (and rate-limit) themselves.
+        """
+        return call_with_retry(
+            lambda: self.session.post(url, timeout=self.timeout, **kwargs),
+            breaker=get_breaker(f"dingtalk.{endpoint}"),
+            should_retry=_is_retryable_response,
+            max_attempts=max_attempts,
+            deadline=Config.DINGTALK_DEADLINE,
+        )
 
     def get_access_token(self):
         """
         Get logic to fetch or refresh access_token.
         """
-        if self.access_token and time.time() < self.token_expires_at:
-            return self.access_token
-        
-        url = "https://oapi.dingtalk.com/gettoken"
-        params = {
-            "appkey": self.app_key,
-            "appsecret": self.app_secret
-        }
-        try:
-            resp = requests.get(url, params=params)
-            data = resp.json()
-            if data.get("errcode") == 0:
-                self.access_token = data["access_token"]
-                self.token_expires_at = time.time() + data["expires_in"] - 60 # Buffer
-                return self.access_token
-            else:
-                logger.error(f"Failed to get token: {data}")
-                return None
-        except Exception as e:
-            logger.error(f"Error fetching token: {e}")
-            return None
+        return self.token_manager.get_token()
 
-    def send_text_message(self, user_id, content, webhook_url=None, msg_type="text", title=None):
+    def send_text_message(self, user_id, content, webhook_url=None, msg_type="text", title=None, retry=True):
         """
         Send a message to a user.
         Supports text and markdown.
@@ -50,7 +82,9 @@ class DingTalkAPI:
             webhook_url: session webhook url
             msg_type: "text" or "markdown"
             title: title for markdown message
+            retry: retry failed requests; pass False when the caller retries itself
         """
+        max_attempts = None if retry else 1
         # Method 1: Session Webhook (Preferred for Chat Window Reply)
         if webhook_url:
             try:
@@ -70,7 +104,7 @@ class DingTalkAPI:
                         }
                     }
                     
-                resp = requests.post(webhook_url, json=payload)
+                resp = self._post("webhook", webhook_url, max_attempts=max_attempts, json=payload)
                 if resp.status_code == 200:
                     return True
                 else:
@@ -83,7 +117,7 @@ class DingTalkAPI:
         if not token:
             return False
 
-        url = "https://api.dingtalk.com/v1.0/robot/oToMessages/batchSend"
+        url = f"{Config.DINGTALK_API_BASE}/v1.0/robot/oToMessages/batchSend"
         
         headers = {
             "x-acs-dingtalk-access-token": token,
@@ -111,7 +145,7 @@ class DingTalkAPI:
         }
         
         try:
-            resp = requests.post(url, headers=headers, json=payload)
+            resp = self._post("batch_send", url, max_attempts=max_attempts, headers=headers, json=payload)
             data = resp.json()
             # v1.0 API usually returns request_id on success, or check status code
             if resp.status_code == 200:
@@ -136,7 +170,7 @@ class DingTalkAPI:
         if not token:
             return None
             
-        url = "https://api.dingtalk.com/v1.0/robot/messageFiles/download"
+        url = f"{Config.DINGTALK_API_BASE}/v1.0/robot/messageFiles/download"
         
         headers = {
             "x-acs-dingtalk-access-token": token,
@@ -149,7 +183,7 @@ class DingTalkAPI:
         }
         
         try:
-            resp = requests.post(url, headers=headers, json=data)
+            resp = self._post("file_download", url, headers=headers, json=data)
             res = resp.json()
             
             if resp.status_code == 200 and "downloadUrl" in res:
@@ -0,0 +1,155 @@
+import logging
+import threading
+import time
+
+logger = logging.getLogger(__name__)
+
+
+class TokenBucket:
+    """
+    Thread-safe token bucket: `rate` requests per second with bursts up to `capacity`.
+    """
+
+    def __init__(self, rate, capacity):
+        self.rate = rate
+        self.capacity = capacity
+        self._tokens = capacity
+        self._updated = time.monotonic()
+        self._lock = threading.Lock()
+
+    def acquire(self):
+        """Block until a token is available, then take it."""
+        while True:
+            with self._lock:
+                now = time.monotonic()
+                self._tokens = min(self.capacity, self._tokens + (now - self._updated) * self.rate)
+                self._updated = now
+                if self._tokens >= 1:
+                    self._tokens -= 1
+                    return
+                wait = (1 - self._tokens) / self.rate
+            time.sleep(wait)
+
+
+class MessageDispatcher:
+    """
+    Outbound fan-out through the robot batchSend API.
+
+    Identical messages queued within `coalesce_ms` of each other are merged
+    and sent to up to `batch_size` users per request. Requests are paced
+    by a token bucket, and failed chunks are retried with exponential
+    backoff. Sending runs on a background thread; call flush() or close()
+    to wait for delivery.
+    """
+
+    # oToMessages/batchSend accepts at most 20 userIds per call
+    MAX_BATCH_SIZE = 20
+
+    def __init__(self, dt_api, batch_size=20, rate=10, burst=10, max_retries=3, retry_delay=1.0, coalesce_ms=200):
+        """
+        Args:
+            dt_api: DingTalkAPI used to send each chunk
+            batch_size: users per batchSend request (capped at MAX_BATCH_SIZE)
+            rate: sustained batchSend requests per second
+            burst: max requests sent back to back
+            max_retries: retries per failed chunk before giving up
+            retry_delay: first retry delay in seconds (doubles each attempt)
+            coalesce_ms: how long to wait for identical messages to merge
+        """
+        self.dt_api = dt_api
+        self.batch_size = min(batch_size, self.MAX_BATCH_SIZE)
+        self.bucket = TokenBucket(rate, burst)
+        self.max_retries = max_retries
+        self.retry_delay = retry_delay
+        self.coalesce = coalesce_ms / 1000.0
+
+        # (msg_type, title, content) -> user ids in arrival order (dict as ordered set)
+        self._pending = {}
+        self._in_flight = 0
+        self._cond = threading.Condition()
+        self._closed = False
+        self._stats = {"requests": 0, "delivered": 0, "failed": 0, "retries": 0}
+        self.failed_users = []
+        self._thread = threading.Thread(target=self._run, name="bp-dispatcher", daemon=True)
+        self._thread.start()
+
+    def send(self, user_ids, content, msg_type="text", title=None):
+        """Queue a message for one or more users."""
+        if isinstance(user_ids, str):
+            user_ids = user_ids.split(',')
+        key = (msg_type, title, content)
+        with self._cond:
+            if self._closed:
+                raise RuntimeError("Dispatcher is closed")
+            users = self._pending.setdefault(key, {})
+            for user_id in user_ids:
+                users[user_id] = None
+            self._cond.notify()
+
+    def flush(self):
+        """Block until every queued message has been sent or given up on."""
+        with self._cond:
+            while self._pending or self._in_flight:
+                self._cond.wait()
+
+    def close(self):
+        """Send everything still queued and stop the dispatcher thread."""
+        with self._cond:
+            self._closed = True
+            self._cond.notify_all()
+        self._thread.join()
+
+    def stats(self):
+        with self._cond:
+            return dict(self._stats)
+
+    def _run(self):
+        while True:
+            with self._cond:
+                while not self._pending and not self._closed:
+                    self._cond.wait()
+                if not self._pending and self._closed:
+                    return
+
+            # Give identical messages a moment to coalesce into fuller batches
+            if not self._closed and self.coalesce > 0:
+                time.sleep(self.coalesce)
+
+            with self._cond:
+                groups = self._pending
+                self._pending = {}
+                self._in_flight += 1
+
+            try:
+                for (msg_type, title, content), users in groups.items():
+                    user_ids = list(users)
+                    for i in range(0, len(user_ids), self.batch_size):
+                        self._send_chunk(user_ids[i:i + self.batch_size], content, msg_type, title)
+            finally:
+                with self._cond:
+                    self._in_flight -= 1
+                    self._cond.notify_all()
+
+    def _send_chunk(self, user_ids, content, msg_type, title):
+        delay = self.retry_delay
+        for attempt in range(self.max_retries + 1):
+            self.bucket.acquire()
+            # Single attempt: retries happen here so each one takes a bucket token
+            ok = self.dt_api.send_text_message(user_ids, content, None, msg_type, title, retry=False)
+            with self._cond:
+                self._stats["requests"] += 1
+                if ok:
+                    self._stats["delivered"] += len(user_ids)
+                    return True
+                if attempt < self.max_retries:
+                    self._stats["retries"] += 1
+            if attempt < self.max_retries:
+                logger.warning(f"batchSend to {len(user_ids)} users failed, retrying in {delay:.1f}s")
+                time.sleep(delay)
+                delay *= 2
+
+        logger.error(f"Giving up on batchSend to {len(user_ids)} users after {self.max_retries} retries")
+        with self._cond:
+            self._stats["failed"] += len(user_ids)
+            self.failed_users.extend(user_ids)
+        return False
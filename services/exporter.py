@@ -0,0 +1,151 @@
+"""
+Columnar export of blood pressure records to Parquet or Arrow IPC files.
+"""
+import json
+import logging
+import os
+from datetime import datetime
+from services.analytics import CATEGORY_LABELS, classify_array
+
+logger = logging.getLogger(__name__)
+
+FORMATS = {"parquet": ".parquet", "arrow": ".arrow"}
+
+
+def _require_pyarrow():
+    try:
+        import pyarrow
+        return pyarrow
+    except ImportError:
+        logger.error("pyarrow is required for exports but not installed. Please run: pip install pyarrow")
+        raise
+
+
+def record_schema(pa):
+    return pa.schema([
+        ("id", pa.int64()),
+        ("user_id", pa.string()),
+        ("user_name", pa.string()),
+        ("systolic", pa.int32()),
+        ("diastolic", pa.int32()),
+        ("pulse", pa.int32()),
+        ("category", pa.dictionary(pa.int8(), pa.string())),
+        ("result", pa.string()),
+        ("created_at", pa.timestamp("s")),
+    ])
+
+
+def _to_int(value):
+    try:
+        return int(value)
+    except (TypeError, ValueError):
+        return None
+
+
+def _to_datetime(value):
+    if value is None or isinstance(value, datetime):
+        return value
+    return datetime.strptime(str(value)[:19], "%Y-%m-%d %H:%M:%S")
+
+
+def rows_to_batch(pa, schema, rows):
+    """
+    Convert iter_records rows (id, user_id, user_name, sys, dia, pulse, result, created_at)
+    into a typed RecordBatch.
+    """
+    systolic = [_to_int(r[3]) for r in rows]
+    diastolic = [_to_int(r[4]) for r in rows]
+    categories = classify_array(systolic, diastolic)
+    category = pa.DictionaryArray.from_arrays(
+        pa.array(categories, type=pa.int8(), mask=categories < 0),
+        pa.array(CATEGORY_LABELS, type=pa.string()),
+    )
+    columns = [
+        pa.array([r[0] for r in rows], type=pa.int64()),
+        pa.array([r[1] for r in rows], type=pa.string()),
+        pa.array([r[2] for r in rows], type=pa.string()),
+        pa.array(systolic, type=pa.int32()),
+        pa.array(diastolic, type=pa.int32()),
+        pa.array([_to_int(r[5]) for r in rows], type=pa.int32()),
+        category,
+        pa.array([r[6] for r in rows], type=pa.string()),
+        pa.array([_to_datetime(r[7]) for r in rows], type=pa.timestamp("s")),
+    ]
+    return pa.RecordBatch.from_arrays(columns, schema=schema)
+
+
+def load_watermark(path):
+    """Return the (time, id) watermark saved by the last export, or None."""
+    if not os.path.exists(path):
+        return None
+    with open(path, "r", encoding="utf-8") as f:
+        data = json.load(f)
+    return data["created_at"], data["id"]
+
+
+def save_watermark(path, watermark):
+    tmp_path = f"{path}.tmp"
+    with open(tmp_path, "w", encoding="utf-8") as f:
+        json.dump({"created_at": watermark[0], "id": watermark[1]}, f)
+    os.replace(tmp_path, path)
+
+
+def export_records(db, out_path, fmt="parquet", since=None, after=None, chunk_size=5000):
+    """
+    Stream records from the database into a Parquet or Arrow IPC file, one chunk at a time.
+
+    Args:
+        db: DatabaseService
+        out_path: output file; written to a temp file and renamed when complete
+        fmt: "parquet" or "arrow"
+        since: only records at or after this time
+        after: (time, id) watermark from a previous export
+        chunk_size: rows fetched and written per batch
+
+    Returns:
+        (row_count, new_watermark); no file is written when there are no rows.
+    """
+    pa = _require_pyarrow()
+    schema = record_schema(pa)
+    tmp_path = f"{out_path}.tmp"
+    writer = None
+    sink = None
+    count = 0
+    watermark = after
+
+    try:
+        for rows in db.iter_records(since=since, after=after, chunk_size=chunk_size):
+            if writer is None:
+                if fmt == "parquet":
+                    import pyarrow.parquet as pq
+                    writer = pq.ParquetWriter(tmp_path, schema, compression="zstd")
+                else:
+                    sink = pa.OSFile(tmp_path, "wb")
+                    writer = pa.ipc.new_file(sink, schema)
+
+            writer.write_batch(rows_to_batch(pa, schema, rows))
+            count += len(rows)
+
+            last = rows[-1]
+            # Store the time as text so the watermark round-trips through JSON;
+            # ISO 8601 with 'T' is parsed the same way by SQL Server regardless of DATEFORMAT
+            last_time = last[7].isoformat(timespec="milliseconds") if isinstance(last[7], datetime) else str(last[7])
+            watermark = (last_time, last[0])
+            logger.info(f"Exported {count} records...")
+    except Exception:
+        if writer is not None:
+            writer.close()
+        if sink is not None:
+            sink.close()
+        if os.path.exists(tmp_path):
+            os.remove(tmp_path)
+        raise
+
+    if writer is None:
+        return 0, watermark
+
+    writer.close()
+    if sink is not None:
+        sink.close()
+    os.replace(tmp_path, out_path)
+    return count, watermark
@@ -1,19 +1,100 @@
+import asyncio
+import functools
 import logging
 import json
-from dingtalk_stream import AckMessage, CallbackHandler as BaseCallbackHandler
+import uuid
+from concurrent.futures import ThreadPoolExecutor
+from services.bp_classifier import bp_status
 from services.database import DatabaseService
+from services.dedup import SeenMessages
 from services.image_analyzer import ImageAnalyzer
+from services.job_journal import JobJournal
 from services.dingtalk_api import DingTalkAPI
+from services.metrics import DUPLICATE_MESSAGES, MESSAGES, stage
+from services.resilience import CircuitBreaker, get_breaker
+from services.scheduler import AnalysisScheduler, QueueFullError
+from config import Config
 
 from datetime import datetime, timedelta
 
 logger = logging.getLogger(__name__)
 
-class CallbackHandler(BaseCallbackHandler):
-    def __init__(self):
+class MessageHandler:
+    """
+    Message handling and picture-job logic, without the DingTalk stream SDK.
+
+    Worker processes use this class directly so they never import
+    dingtalk_stream; the stream process uses the CallbackHandler subclass
+    in services.stream_handler.
+    """
+
+    # Seconds between checks for replaying parked jobs
+    REPLAY_INTERVAL = 5
+    # Ack status for handled messages (self.STATUS_OK in the SDK)
+    STATUS_OK = 200
+
+    def __init__(self, job_queue=None):
+        """
+        Args:
+            job_queue: optional shared JobQueue; picture jobs are then submitted to it
+                for worker processes instead of the in-process scheduler
+        """
         super().__init__()
         self.db = DatabaseService()
         self.dt_api = DingTalkAPI()
+        # All blocking calls (requests, dashscope, sqlite/pyodbc) run on this bounded pool
+        # so a slow VL call never stalls other messages on the stream connection.
+        self.executor = ThreadPoolExecutor(max_workers=Config.IO_WORKERS, thread_name_prefix="bp-io")
+        # JobQueue.submit has the same contract as AnalysisScheduler.submit
+        self.job_queue = job_queue
+        self.scheduler = job_queue if job_queue is not None else AnalysisScheduler(
+            self._run_picture_job,
+            workers=Config.ANALYSIS_WORKERS,
+            max_queue_size=Config.ANALYSIS_QUEUE_SIZE,
+        )
+        self._background_tasks = set()
+        # user_id -> keyset cursor of the last history page shown
+        self._history_cursors = {}
+        # Picture jobs held while the DashScope circuit is open
+        self.vl_breaker = get_breaker("dashscope.vl")
+        self._parked_jobs = []
+        self._replay_task = None
+        # Recently handled DingTalk message IDs, to drop stream redeliveries
+        self.seen_messages = None
+        if Config.MESSAGE_DEDUP_ENABLED:
+            self.seen_messages = SeenMessages(max_entries=Config.MESSAGE_DEDUP_SIZE, ttl=Config.MESSAGE_DEDUP_TTL)
+        # Write-ahead journal so picture jobs survive restarts
+        self.journal = None
+        if Config.JOB_JOURNAL_ENABLED:
+            self.journal = JobJournal(Config.JOB_JOURNAL_PATH)
+            pruned = self.journal.prune(Config.JOB_JOURNAL_RETENTION_DAYS * 86400)
+            if pruned:
+                logger.info(f"Pruned {pruned} finished jobs from the journal")
+
+    async def _run_blocking(self, func, *args, **kwargs):
+        """
+        Run a blocking function on the I/O executor and await its result.
+        """
+        loop = asyncio.get_running_loop()
+        return await loop.run_in_executor(self.executor, functools.partial(func, *args, **kwargs))
+
+    @staticmethod
+    def _message_id(event):
+        """DingTalk message ID of a callback (data msgId, else the stream header's), or None."""
+        data = getattr(event, "data", None) or {}
+        msg_id = data.get("msgId") if isinstance(data, dict) else None
+        if not msg_id:
+            msg_id = getattr(getattr(event, "headers", None), "message_id", None)
+        return msg_id or None
+
+    async def _submit(self, job, priority=AnalysisScheduler.PRIORITY_NORMAL):
+        """
+        Submit a picture job. The shared JobQueue does SQLite work (and may wait on its
+        write lock), so it runs on the executor; the in-process scheduler is loop-bound.
+        """
+        if self.job_queue is not None:
+            return await self._run_blocking(self.job_queue.submit, job, priority)
+        return self.scheduler.submit(job, priority)
 
     def _format_time_to_cst(self, time_str):
         """
@@ -36,34 +117,24 @@ class CallbackHandler(BaseCallbackHandler):
         Calculate blood pressure status based on systolic and diastolic values.
         Using Chinese hypertension guidelines.
         """
-        try:
-            sys = int(sys)
-            dia = int(dia)
-        except (ValueError, TypeError):
-            return "未知"
-
-        if sys >= 180 or dia >= 110:
-            return "重度高血压 (请立即就医)"
-        elif sys >= 160 or dia >= 100:
-            return "中度高血压"
-        elif sys >= 140 or dia >= 90:
-            return "轻度高血压"
-        elif sys >= 130 or dia >= 85:
-            return "正常高值 (偏高)"
-        elif sys >= 120 or dia >= 80:
-            return "正常高值"
-        else:
-            return "正常血压"
+        return bp_status(sys, dia)
 
     async def process(self, event):
         """
         Process incoming DingTalk events.
         """
-        logger.info(f"Received event: {event}")
         if not event:
             logger.warning("Event is empty")
-            return AckMessage.STATUS_OK, "ignored"
-            
+            return self.STATUS_OK, "ignored"
+
+        # Stream redeliveries (e.g. after a slow ack) are dropped before any work is done
+        msg_id = self._message_id(event)
+        if self.seen_messages is not None and msg_id and self.seen_messages.seen(msg_id):
+            logger.info(f"Ignoring redelivered message {msg_id}")
+            DUPLICATE_MESSAGES.inc()
+            return self.STATUS_OK, "duplicate"
+
+        logger.info(f"Received event: {event}")
         # Debug: print event attributes
         try:
             logger.info(f"Event headers: {event.headers}")
@@ -78,80 +149,276 @@ class CallbackHandler(BaseCallbackHandler):
         data = event.data
         if not data:
              logger.warning("Event data is empty")
-             return AckMessage.STATUS_OK, "empty data"
+             return self.STATUS_OK, "empty data"
 
         msg_type = data.get("msgType") or data.get("msgtype")
+        MESSAGES.inc(msg_type=msg_type or "unknown")
         sender_id = data.get("senderStaffId", "")
         sender_nick = data.get("senderNick", "User")
         session_webhook = data.get("sessionWebhook")
         
         if not sender_id:
-             return AckMessage.STATUS_OK, "no sender"
+             return self.STATUS_OK, "no sender"
 
         # Text Message Handling
         if msg_type == "text":
             content = data.get("text", {}).get("content", "").strip()
             if content == "历史":
                 return await self.handle_history(sender_id, session_webhook)
+            elif content == "更多":
+                return await self.handle_history(sender_id, session_webhook, more=True)
+            elif content == "趋势":
+                return await self.handle_trends(sender_id, session_webhook)
             else:
-                await self.reply_text(sender_id, f"欢迎 {sender_nick}! 请发送血压计的照片给我，或者输入 '历史' 查看您的记录。", session_webhook)
-                return AckMessage.STATUS_OK, "replied"
+                await self.reply_text(sender_id, f"欢迎 {sender_nick}! 请发送血压计的照片给我，或者输入 '历史' 查看您的记录，输入 '趋势' 查看统计。", session_webhook)
+                return self.STATUS_OK, "replied"
 
         # Image Message Handling
         elif msg_type == "picture":
             content_data = data.get("content", {})
             logger.info(f"Picture content data: {content_data}")
-            download_code = content_data.get("downloadCode")
-            
-            if not download_code:
+
+            job = {
+                "job_id": uuid.uuid4().hex,
+                "msg_id": msg_id,
+                "sender_id": sender_id,
+                "sender_nick": sender_nick,
+                "session_webhook": session_webhook,
+                "download_code": content_data.get("downloadCode"),
                 # Fallback: maybe 'pictureDownloadUrl' exists in some contexts
-                image_url = content_data.get("pictureDownloadUrl") # Legacy
-            else:
-                image_url = self.dt_api.get_file_download_url(download_code)
+                "image_url": content_data.get("pictureDownloadUrl"), # Legacy
+            }
+
+            # Journal before acking, so the job is resumed if we restart before it finishes.
+            # The shared JobQueue is durable itself; workers only journal checkpoints and outcomes.
+            if self.job_queue is None:
+                await self._journal(job, "queued", job)
+
+            # Ack right away; the analysis runs on the scheduler's worker pool
+            try:
+                position = await self._submit(job)
+            except QueueFullError as e:
+                logger.warning(f"Rejecting picture from {sender_id}: {e}")
+                await self._journal(job, "failed")
+                self._reply_in_background(sender_id, "当前识别请求过多，请稍后再发送照片。", session_webhook)
+                return self.STATUS_OK, "busy"
+
+            if position > 0:
+                self._reply_in_background(sender_id, f"当前识别人数较多，您的照片已排在第 {position} 位，请稍候...", session_webhook)
+            return self.STATUS_OK, "queued"
+
+        return self.STATUS_OK, "processed"
+
+    async def _run_picture_job(self, job):
+        """
+        Download, analyze and store one picture message. Runs on a scheduler worker.
+        """
+        sender_id = job["sender_id"]
+        sender_nick = job["sender_nick"]
+        session_webhook = job["session_webhook"]
 
-            if not image_url:
-                await self.reply_text(sender_id, "抱歉，无法下载图片，请重试。", session_webhook)
-                return AckMessage.STATUS_OK, "failed download"
+        # A job resumed after a restart may already have been analyzed (and saved)
+        checkpoint = await self._journal_checkpoint(job)
+        if checkpoint is not None:
+            logger.info(f"Resuming job {job.get('job_id')} from its journaled analysis")
+            image_url, result = checkpoint["image_url"], checkpoint["analysis"]
+        else:
+            image_url, result = await self._analyze_job(job)
+            if result is None:
+                return
+            await self._journal(job, "analyzed", {"image_url": image_url, "analysis": result})
+
+        # Save to DB
+        sys = result.get("systolic")
+        dia = result.get("diastolic")
+        pulse = result.get("pulse")
+
+        bp_result = self._calculate_bp_status(sys, dia)
+
+        if checkpoint is None or checkpoint.get("record_id") is None:
+            with stage("db_write") as db_stage:
+                record_id = await self._run_blocking(self.db.add_record, sender_id, sender_nick, sys, dia, pulse, image_url, bp_result,
+                                                     msg_id=job.get("msg_id"))
+                if record_id is None:
+                    db_stage.fail()
+            if record_id is None:
+                # The user resends, so the job must not be resumed as well
+                await self.reply_text(sender_id, f"识别结果: {sys}/{dia} mmHg，脉搏 {pulse}，但保存失败，请稍后重新发送照片。", session_webhook)
+                await self._journal(job, "failed")
+                return
+            await self._journal(job, "saved", {"image_url": image_url, "analysis": result, "record_id": record_id})
+
+        msg = (f"**分析结果**\n\n"
+               f"收缩压 (高压): {sys}\n"
+               f"舒张压 (低压): {dia}\n"
+               f"脉搏: {pulse}\n"
+               f"结果: **{bp_result}**\n\n"
+               f"已保存到您的历史记录。")
+
+        with stage("result_reply") as reply_stage:
+            if not await self.reply_text(sender_id, msg, session_webhook, msg_type="markdown", title="血压分析结果"):
+                reply_stage.fail()
+        await self._journal(job, "done")
+
+    async def _analyze_job(self, job):
+        """
+        Download and analyze a job's picture.
+        Returns (image_url, analysis), or (None, None) when the job was parked or
+        failed (the user has been told and the job journaled accordingly).
+        """
+        sender_id = job["sender_id"]
+        session_webhook = job["session_webhook"]
+        download_code = job.get("download_code")
 
-            await self.reply_text(sender_id, "已收到图片，正在分析...", session_webhook)
+        # Don't even fetch the download URL while the VL service is known to be down
+        if self.vl_breaker.state == CircuitBreaker.OPEN:
+            await self._park_job(job)
+            return None, None
 
-            # Analyze
-            result = ImageAnalyzer.analyze_bp_image(image_url)
-            
-            if "error" in result:
-                await self.reply_text(sender_id, f"分析失败: {result['error']}", session_webhook)
+        if not download_code:
+            image_url = job.get("image_url")
+        else:
+            with stage("download_url") as url_stage:
+                image_url = await self._run_blocking(self.dt_api.get_file_download_url, download_code)
+                if not image_url:
+                    url_stage.fail()
+
+        if not image_url:
+            await self.reply_text(sender_id, "抱歉，无法下载图片，请重试。", session_webhook)
+            await self._journal(job, "failed")
+            return None, None
+
+        # Parked and resumed jobs were already acknowledged
+        if not job.get("parked") and not job.get("resumed"):
+            with stage("ack_reply") as reply_stage:
+                if not await self.reply_text(sender_id, "已收到图片，正在分析...", session_webhook):
+                    reply_stage.fail()
+
+        # Analyze
+        result = await self._run_blocking(ImageAnalyzer.analyze_bp_image, image_url)
+
+        if result.get("circuit_open"):
+            await self._park_job(job)
+            return None, None
+        if "error" in result:
+            await self.reply_text(sender_id, f"分析失败: {result['error']}", session_webhook)
+            await self._journal(job, "failed")
+            return None, None
+        return image_url, result
+
+    async def _journal(self, job, state, data=None):
+        """Append a job state to the journal; journal problems never fail the job itself."""
+        if self.journal is None or not job.get("job_id"):
+            return
+        try:
+            await self._run_blocking(self.journal.record, job["job_id"], state, data)
+        except Exception as e:
+            logger.error(f"Failed to journal job {job['job_id']} as {state}: {e}")
+
+    async def _journal_checkpoint(self, job):
+        if self.journal is None or not job.get("job_id"):
+            return None
+        try:
+            return await self._run_blocking(self.journal.checkpoint, job["job_id"])
+        except Exception as e:
+            logger.error(f"Failed to read journal for job {job['job_id']}: {e}")
+            return None
+
+    async def resume_unfinished_jobs(self):
+        """
+        Re-run journaled jobs that didn't finish before the last shutdown,
+        at most JOB_RESUME_CONCURRENCY at a time.
+        """
+        if self.journal is None:
+            return
+        jobs = await self._run_blocking(self.journal.unfinished)
+        if not jobs:
+            return
+        logger.info(f"Resuming {len(jobs)} unfinished picture jobs from the journal")
+
+        semaphore = asyncio.Semaphore(Config.JOB_RESUME_CONCURRENCY)
+
+        async def resume(job):
+            async with semaphore:
+                job["resumed"] = True
+                try:
+                    await self._run_picture_job(job)
+                except Exception as e:
+                    # Give up rather than retrying the same failure on every restart
+                    logger.error(f"Failed to resume job {job.get('job_id')}: {e}")
+                    await self._journal(job, "failed")
+
+        await asyncio.gather(*(resume(job) for job in jobs))
+
+    async def _park_job(self, job):
+        """
+        Hold a picture job while the VL circuit is open; it is replayed once the circuit allows calls again.
+        In a worker process the job goes back to the shared JobQueue (claimable again after
+        REPLAY_INTERVAL), so it survives the worker dying before the circuit closes.
+        """
+        first_time = not job.get("parked")
+        job["parked"] = True
+        if self.job_queue is not None:
+            await self._run_blocking(self.job_queue.put, job, AnalysisScheduler.PRIORITY_HIGH, self.REPLAY_INTERVAL)
+        else:
+            self._parked_jobs.append(job)
+        if first_time:
+            await self._journal(job, "parked")
+            await self.reply_text(job["sender_id"], "识别服务繁忙，您的照片已排队，服务恢复后将自动为您识别。", job["session_webhook"])
+
+        if self.job_queue is None and (self._replay_task is None or self._replay_task.done()):
+            self._replay_task = asyncio.create_task(self._replay_parked_jobs())
+
+    async def _replay_parked_jobs(self):
+        while self._parked_jobs:
+            await asyncio.sleep(self.REPLAY_INTERVAL)
+            state = self.vl_breaker.state
+            if state == CircuitBreaker.OPEN:
+                continue
+
+            if state == CircuitBreaker.HALF_OPEN:
+                # Release a single job as the probe; the backlog follows once the circuit closes
+                jobs, self._parked_jobs = self._parked_jobs[:1], self._parked_jobs[1:]
             else:
-                # Save to DB
-                sys = result.get("systolic")
-                dia = result.get("diastolic")
-                pulse = result.get("pulse")
-                
-                bp_result = self._calculate_bp_status(sys, dia)
-                
-                self.db.add_record(sender_id, sender_nick, sys, dia, pulse, image_url, bp_result)
-                
-                msg = (f"**分析结果**\n\n"
-                       f"收缩压 (高压): {sys}\n"
-                       f"舒张压 (低压): {dia}\n"
-                       f"脉搏: {pulse}\n"
-                       f"结果: **{bp_result}**\n\n"
-                       f"已保存到您的历史记录。")
-                
-                await self.reply_text(sender_id, msg, session_webhook, msg_type="markdown", title="血压分析结果")
+                jobs, self._parked_jobs = self._parked_jobs, []
+            logger.info(f"Replaying {len(jobs)} parked picture jobs")
+            for job in jobs:
+                try:
+                    await self._submit(job, AnalysisScheduler.PRIORITY_HIGH)
+                except QueueFullError:
+                    self._parked_jobs.append(job)
 
-        return AckMessage.STATUS_OK, "processed"
+    def _reply_in_background(self, user_id, text, webhook_url=None):
+        # Keep a reference so the task isn't garbage collected before it finishes
+        task = asyncio.create_task(self.reply_text(user_id, text, webhook_url))
+        self._background_tasks.add(task)
+        task.add_done_callback(self._background_tasks.discard)
 
     async def reply_text(self, user_id, text, webhook_url=None, msg_type="text", title=None):
-        success = self.dt_api.send_text_message(user_id, text, webhook_url, msg_type, title)
+        success = await self._run_blocking(self.dt_api.send_text_message, user_id, text, webhook_url, msg_type, title)
         if not success:
             logger.error(f"Failed to reply to user {user_id}")
+        return success
+
+    async def handle_history(self, user_id, webhook_url=None, more=False):
+        before = None
+        if more:
+            before = self._history_cursors.get(user_id)
+            if before is None:
+                await self.reply_text(user_id, "没有更早的记录了。请输入 '历史' 查看最近记录。", webhook_url)
+                return self.STATUS_OK, "history processed"
+
+        records, next_cursor = await self._run_blocking(self.db.get_user_history_page, user_id, 10, before)
+        # Remember where this page ended so '更多' can seek past it
+        if next_cursor is None:
+            self._history_cursors.pop(user_id, None)
+        else:
+            self._history_cursors[user_id] = next_cursor
 
-    async def handle_history(self, user_id, webhook_url=None):
-        records = self.db.get_user_history(user_id)
         if not records:
             response_text = "暂无记录。"
         else:
-            lines = ["### 最近记录"]
+            lines = ["### 更早记录" if more else "### 最近记录"]
             for r in records:
                 # r = (sys, dias, pulse, time, url, result)
                 # indices: 0:sys, 1:dia, 2:pulse, 3:time, 4:url, 5:result
@@ -161,7 +428,35 @@ class CallbackHandler(BaseCallbackHandler):
                 
                 res_str = f" **{r[5]}**" if r[5] else ""
                 lines.append(f"- {time_str}\n  - 高压: {r[0]} | 低压: {r[1]} | 脉搏: {r[2]}{res_str}")
+            if next_cursor is not None:
+                lines.append("\n输入 '更多' 查看更早的记录。")
             response_text = "\n".join(lines)
         
         await self.reply_text(user_id, response_text, webhook_url, msg_type="markdown", title="历史记录")
-        return AckMessage.STATUS_OK, "history processed"
+        return self.STATUS_OK, "history processed"
+
+    async def handle_trends(self, user_id, webhook_url=None):
+        trends = await self._run_blocking(self.db.get_user_trends, user_id)
+        if trends is None:
+            response_text = "查询统计失败，请稍后再试。"
+        elif not any(trends.values()):
+            response_text = "近 90 天暂无记录。"
+        else:
+            lines = ["### 血压趋势"]
+            for window, t in trends.items():
+                if not t:
+                    lines.append(f"\n**近{window}天**: 暂无记录")
+                    continue
+                lines.append(f"\n**近{window}天** (共 {t['count']} 次)")
+                pulse_str = f"，脉搏 {t['avg_pulse']}" if t["avg_pulse"] is not None else ""
+                lines.append(f"- 平均: {t['avg_systolic']}/{t['avg_diastolic']} mmHg{pulse_str}")
+                lines.append(f"- 高压范围: {t['min_systolic']}~{t['max_systolic']} | 低压范围: {t['min_diastolic']}~{t['max_diastolic']}")
+                if t["morning_count"] or t["evening_count"]:
+                    morning = f"{t['morning_avg_systolic']}/{t['morning_avg_diastolic']}" if t["morning_count"] else "-"
+                    evening = f"{t['evening_avg_systolic']}/{t['evening_avg_diastolic']}" if t["evening_count"] else "-"
+                    lines.append(f"- 早间平均: {morning} | 晚间平均: {evening}")
+                lines.append("- 分级: " + "，".join(f"{label} {n} 次" for label, n in t["categories"]))
+            response_text = "\n".join(lines)
+
+        await self.reply_text(user_id, response_text, webhook_url, msg_type="markdown", title="血压趋势")
+        return self.STATUS_OK, "trends processed"
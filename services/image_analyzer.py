@@ -1,59 +1,394 @@
 from http import HTTPStatus
-import dashscope
-import json
 import logging
+import os
+import time
+from types import SimpleNamespace
 from config import Config
+from services.bp_classifier import is_plausible
+from services.image_preprocessor import preprocess_image, to_data_uri, to_temp_file
+from services.metrics import DASHSCOPE_ERRORS, LOCAL_OCR, VL_ESCALATIONS, record_dashscope_usage, stage
+from services.model_router import ModelRouter
+from services.resilience import CircuitOpenError, call_with_retry, get_breaker
+from services.result_cache import ResultCache
+from services.vl_batcher import Retry, VLBatcher
+from services.vl_reply import JSONScanner, coerce_reading, extract_json
 
 logger = logging.getLogger(__name__)
 
-# Ensure API key is set
-dashscope.api_key = Config.DASHSCOPE_API_KEY
+_dashscope = None
+
+
+def _get_dashscope():
+    """
+    Import dashscope on first use (it takes a noticeable share of startup time)
+    and set the API key.
+    """
+    global _dashscope
+    if _dashscope is None:
+        import dashscope
+        dashscope.api_key = Config.DASHSCOPE_API_KEY
+        _dashscope = dashscope
+    return _dashscope
+
+
+def _error_class(status_code):
+    """Metrics label for a failed DashScope response."""
+    if status_code == HTTPStatus.TOO_MANY_REQUESTS:
+        return "throttled"
+    if status_code >= 500:
+        return "server_error"
+    return "client_error"
+
+PROMPT = (
+    "Please analyze this image of a blood pressure monitor. "
+    "Extract the Systolic (High), Diastolic (Low), and Pulse (Heart Rate) numbers. "
+    "Return the result ONLY as a JSON object with keys: 'systolic', 'diastolic', 'pulse'. "
+    "If you cannot read the screen or it's not a BP monitor, return {'error': 'Cannot read image'}. "
+    "Do not include markdown or explanations, just the JSON string."
+)
+
+BATCH_PROMPT = (
+    "You are given {count} images of blood pressure monitors, in order. "
+    "For each image, extract the Systolic (High), Diastolic (Low), and Pulse (Heart Rate) numbers. "
+    "Return the result ONLY as a JSON array with exactly {count} elements, one per image in the same order. "
+    "Each element is a JSON object with keys: 'systolic', 'diastolic', 'pulse', "
+    "or {{'error': 'Cannot read image'}} if that screen can't be read or it's not a BP monitor. "
+    "Do not include markdown or explanations, just the JSON string."
+)
+
+
+def _reply_text(response):
+    """Concatenated text parts of a (possibly partial) DashScope reply."""
+    try:
+        parts = response.output.choices[0].message.content
+    except (AttributeError, IndexError, KeyError, TypeError):
+        return ""
+    return "".join(part.get("text", "") for part in parts if isinstance(part, dict))
+
+
+def _call_model(dashscope, model, messages, opener):
+    """
+    One MultiModalConversation call. With VL_STREAM_ENABLED the reply is streamed
+    and reading stops as soon as the first JSON value is complete.
+    Returns the response status with the reply `text` and parsed `value` (None if not found yet).
+    """
+    value = None
+    if Config.VL_STREAM_ENABLED:
+        responses = dashscope.MultiModalConversation.call(
+            model=model, messages=messages, stream=True, incremental_output=True)
+        scanner = JSONScanner(opener)
+        response = None
+        try:
+            for response in responses:
+                if response.status_code != HTTPStatus.OK:
+                    break
+                value = scanner.feed(_reply_text(response))
+                if value is not None:
+                    break
+            else:
+                # Stream ended: retry past any candidate that never closed
+                value = scanner.finish()
+        finally:
+            # Closing the generator drops the rest of the stream
+            close = getattr(responses, "close", None)
+            if close is not None:
+                close()
+        if response is None:
+            raise RuntimeError("DashScope returned an empty stream")
+        text = scanner.text
+    else:
+        response = dashscope.MultiModalConversation.call(model=model, messages=messages)
+        text = _reply_text(response) if response.status_code == HTTPStatus.OK else ""
+    return SimpleNamespace(
+        status_code=response.status_code,
+        code=getattr(response, "code", None),
+        message=getattr(response, "message", ""),
+        usage=getattr(response, "usage", None),
+        text=text,
+        value=value,
+    )
+
 
 class ImageAnalyzer:
+    _cache = None
+    _batcher = None
+    _router = None
+
+    @classmethod
+    def get_cache(cls):
+        """
+        Shared result cache, or None when caching is disabled.
+        """
+        if cls._cache is None and Config.RESULT_CACHE_ENABLED:
+            cls._cache = ResultCache(
+                max_entries=Config.RESULT_CACHE_SIZE,
+                ttl=Config.RESULT_CACHE_TTL,
+                db_path=Config.RESULT_CACHE_DB_PATH or None,
+                phash_distance=Config.RESULT_CACHE_PHASH_DISTANCE,
+            )
+        return cls._cache
+
+    @classmethod
+    def get_router(cls):
+        """
+        Shared model router (VL_MODELS, cheapest first).
+        """
+        if cls._router is None:
+            cls._router = ModelRouter(
+                Config.VL_MODELS,
+                window=Config.VL_ROUTE_WINDOW,
+                min_calls=Config.VL_ROUTE_MIN_CALLS,
+                min_success_rate=Config.VL_ROUTE_MIN_SUCCESS_RATE,
+                latency_slack=Config.VL_ROUTE_LATENCY_SLACK,
+                probe_interval=Config.VL_ROUTE_PROBE_INTERVAL,
+            )
+        return cls._router
+
+    @classmethod
+    def get_batcher(cls):
+        """
+        Shared VL request batcher, or None when batching is disabled.
+        """
+        if cls._batcher is None and Config.VL_BATCH_ENABLED:
+            cls._batcher = VLBatcher(
+                ImageAnalyzer._call_vl_model,
+                ImageAnalyzer._call_vl_model_batch,
+                max_images=Config.VL_BATCH_MAX_IMAGES,
+                max_delay_ms=Config.VL_BATCH_MAX_DELAY_MS,
+            )
+        return cls._batcher
+
+    @classmethod
+    def cache_stats(cls):
+        cache = cls.get_cache()
+        return cache.stats() if cache else {}
+
+    @staticmethod
+    def download_image(image_url):
+        """
+        Download the image bytes, or return None on failure.
+        """
+        import requests
+        try:
+            resp = requests.get(image_url, timeout=Config.IMAGE_DOWNLOAD_TIMEOUT)
+            if resp.status_code == 200:
+                return resp.content
+            logger.error(f"Failed to download image. Status: {resp.status_code}")
+        except Exception as e:
+            logger.error(f"Error downloading image: {e}")
+        return None
+
     @staticmethod
     def analyze_bp_image(image_url):
         """
         Analyzes a blood pressure monitor image using Qwen-VL.
         Returns a dictionary with systolic, diastolic, and pulse values.
+        Identical images (resends, redeliveries) are answered from the result cache,
+        and clear seven-segment displays from the local reader when it is enabled.
+        """
+        cache = ImageAnalyzer.get_cache()
+        image_bytes = None
+        # Download once and share the bytes between the cache, local OCR and the preprocessor
+        if cache is not None or Config.IMAGE_PREPROCESS_ENABLED or Config.LOCAL_OCR_ENABLED:
+            image_bytes = ImageAnalyzer.download_image(image_url)
+
+        if cache is not None and image_bytes is not None:
+            cached = cache.get(image_bytes)
+            if cached is not None:
+                logger.info("Analysis result served from cache")
+                return cached
+
+        if Config.LOCAL_OCR_ENABLED and image_bytes is not None:
+            result = ImageAnalyzer._read_locally(image_bytes)
+            if result is not None:
+                if cache is not None:
+                    cache.put(image_bytes, result)
+                return result
+
+        image_input, temp_path = image_url, None
+        if Config.IMAGE_PREPROCESS_ENABLED and image_bytes is not None:
+            processed = preprocess_image(image_bytes, Config.IMAGE_MAX_EDGE, Config.IMAGE_JPEG_QUALITY)
+            if processed is not None:
+                if Config.IMAGE_UPLOAD_MODE == "file":
+                    temp_path = to_temp_file(processed)
+                    image_input = f"file://{temp_path}"
+                else:
+                    image_input = to_data_uri(processed)
+
+        batcher = ImageAnalyzer.get_batcher()
+        try:
+            if batcher is not None:
+                result = batcher.submit(image_input)
+            else:
+                result = ImageAnalyzer._call_vl_model(image_input)
+        finally:
+            if temp_path:
+                os.remove(temp_path)
+
+        if cache is not None and image_bytes is not None and "error" not in result:
+            cache.put(image_bytes, result)
+        return result
+
+    @staticmethod
+    def _read_locally(image_bytes):
+        """
+        Try the local seven-segment reader. Returns the reading, or None when
+        its confidence is below LOCAL_OCR_MIN_CONFIDENCE and the VL model should decide.
+        """
+        from services.seven_segment import read_display
+
+        with stage("local_ocr"):
+            reading = read_display(image_bytes)
+        if reading is None or reading["confidence"] < Config.LOCAL_OCR_MIN_CONFIDENCE:
+            LOCAL_OCR.inc(outcome="fallback")
+            return None
+        LOCAL_OCR.inc(outcome="hit")
+        logger.info(f"Reading served by local OCR (confidence {reading['confidence']})")
+        return {"systolic": reading["systolic"], "diastolic": reading["diastolic"], "pulse": reading["pulse"]}
+
+    @staticmethod
+    def _call_vl_model(image_url, start=0):
+        """
+        Send the image (URL, data URI or file:// path) to Qwen-VL and parse the JSON reply.
+        Models are tried in the router's order (from VL_MODELS[start]), escalating while
+        the reply is unusable; the last model's reply is returned as-is.
+        """
+        router = ImageAnalyzer.get_router()
+        models = router.plan(start)
+        result = None
+        for i, model in enumerate(models):
+            started = time.perf_counter()
+            data, text, error = ImageAnalyzer._request_vl([{"image": image_url}, {"text": PROMPT}], model)
+            elapsed = time.perf_counter() - started
+            if error is not None:
+                if error.get("circuit_open"):
+                    return error
+                router.record(model, elapsed, False)
+                result = error
+            else:
+                result = ImageAnalyzer._reading_from_reply(data, text)
+                accepted = is_plausible(result)
+                router.record(model, elapsed, accepted)
+                if accepted:
+                    return result
+            if i + 1 < len(models):
+                logger.info(f"Unusable reading from {model}, escalating to {models[i + 1]}")
+                VL_ESCALATIONS.inc(model=model)
+        return ImageAnalyzer._validated(result)
+
+    @staticmethod
+    def _call_vl_model_batch(image_urls):
+        """
+        Send several images in one Qwen-VL request and return one result per image, in order.
+        Images the first routed model can't read plausibly get a Retry from the next model,
+        which each image's submitter runs itself.
+        Raises ValueError when the reply isn't a JSON array with one entry per image.
+        """
+        router = ImageAnalyzer.get_router()
+        model = router.plan()[0]
+        prompt = BATCH_PROMPT.format(count=len(image_urls))
+        started = time.perf_counter()
+        data, text, error = ImageAnalyzer._request_vl(
+            [{"image": url} for url in image_urls] + [{"text": prompt}], model, opener="[")
+        # The router compares models by single-image latency, so charge each image its share
+        elapsed = (time.perf_counter() - started) / len(image_urls)
+        if error is not None:
+            # The whole request failed; retrying image by image would only add load
+            if not error.get("circuit_open"):
+                router.record(model, elapsed, False)
+            return [dict(error) for _ in image_urls]
+
+        if not isinstance(data, list) or len(data) != len(image_urls):
+            DASHSCOPE_ERRORS.inc(error_class="parse_error")
+            router.record(model, elapsed, False)
+            raise ValueError(f"Expected a JSON array of {len(image_urls)} results, got: {text}")
+
+        results = []
+        next_model = router.models.index(model) + 1
+        for item in data:
+            if not isinstance(item, dict):
+                DASHSCOPE_ERRORS.inc(error_class="parse_error")
+                item = {"error": "Failed to parse data"}
+            else:
+                item = coerce_reading(item)
+                if "error" in item:
+                    DASHSCOPE_ERRORS.inc(error_class="unreadable")
+            accepted = is_plausible(item)
+            router.record(model, elapsed, accepted)
+            if not accepted and next_model < len(router.models):
+                VL_ESCALATIONS.inc(model=model)
+                results.append(Retry(start=next_model))
+            else:
+                results.append(ImageAnalyzer._validated(item))
+        return results
+
+    @staticmethod
+    def _reading_from_reply(data, text):
+        """Turn a single-image reply into a result dict (a reading or an error)."""
+        if not isinstance(data, dict):
+            logger.error(f"Failed to parse JSON from VL response: {text}")
+            DASHSCOPE_ERRORS.inc(error_class="parse_error")
+            return {"error": "Failed to parse data"}
+        data = coerce_reading(data)
+        if "error" in data:
+            DASHSCOPE_ERRORS.inc(error_class="unreadable")
+        return data
+
+    @staticmethod
+    def _validated(result):
+        """Replace a reading that is incomplete or out of range with an error, so it isn't saved."""
+        if "error" in result or is_plausible(result):
+            return result
+        logger.warning(f"Discarding implausible reading: {result}")
+        DASHSCOPE_ERRORS.inc(error_class="implausible")
+        return {"error": "Implausible reading"}
+
+    @staticmethod
+    def _request_vl(content, model, opener="{"):
+        """
+        Make one call to the given Qwen-VL model with the given message content.
+        Returns (value, reply_text, None) on success, where value is the first JSON
+        object (or array, with opener='[') found in the reply or None, and
+        (None, None, error_result) on failure.
         """
-        prompt = (
-            "Please analyze this image of a blood pressure monitor. "
-            "Extract the Systolic (High), Diastolic (Low), and Pulse (Heart Rate) numbers. "
-            "Return the result ONLY as a JSON object with keys: 'systolic', 'diastolic', 'pulse'. "
-            "If you cannot read the screen or it's not a BP monitor, return {'error': 'Cannot read image'}. "
-            "Do not include markdown or explanations, just the JSON string."
-        )
-        
-        # We need to use the qwen-vl-max or qwen-vl-plus model
         # Messages format for Qwen-VL
         messages = [
             {
                 "role": "user",
-                "content": [
-                    {"image": image_url},
-                    {"text": prompt}
-                ]
+                "content": content
             }
         ]
 
+        dashscope = _get_dashscope()
         try:
-            response = dashscope.MultiModalConversation.call(model='qwen-vl-max',
-                                                             messages=messages)
-            
+            # Retry throttling (429) and server errors; the breaker fails fast during brownouts
+            with stage("vl_call") as vl_stage:
+                response = call_with_retry(
+                    lambda: _call_model(dashscope, model, messages, opener),
+                    breaker=get_breaker("dashscope.vl"),
+                    should_retry=lambda resp: resp.status_code == HTTPStatus.TOO_MANY_REQUESTS or resp.status_code >= 500,
+                    deadline=Config.DASHSCOPE_DEADLINE,
+                )
+                if response.status_code != HTTPStatus.OK:
+                    vl_stage.fail()
+            record_dashscope_usage(model, getattr(response, "usage", None))
+
             if response.status_code == HTTPStatus.OK:
-                content = response.output.choices[0].message.content[0]['text']
-                # Clean up potential markdown code blocks
-                content = content.replace("```json", "").replace("```", "").strip()
-                try:
-                    data = json.loads(content)
-                    return data
-                except json.JSONDecodeError:
-                    logger.error(f"Failed to parse JSON from VL response: {content}")
-                    return {"error": "Failed to parse data"}
+                with stage("json_parse") as parse_stage:
+                    value = response.value if response.value is not None else extract_json(response.text, opener)
+                    if value is None:
+                        parse_stage.fail()
+                return value, response.text, None
             else:
                 logger.error(f"DashScope API Error: {response.code} - {response.message}")
-                return {"error": f"API Error: {response.message}"}
+                DASHSCOPE_ERRORS.inc(error_class=_error_class(response.status_code))
+                return None, None, {"error": f"API Error: {response.message}"}
                 
+        except CircuitOpenError as e:
+            logger.warning(f"Skipping VL call: {e}")
+            DASHSCOPE_ERRORS.inc(error_class="circuit_open")
+            return None, None, {"error": "Service busy", "circuit_open": True}
         except Exception as e:
             logger.error(f"Exception during image analysis: {e}")
-            return {"error": "Internal error during analysis"}
+            DASHSCOPE_ERRORS.inc(error_class="exception")
+            return None, None, {"error": "Internal error during analysis"}
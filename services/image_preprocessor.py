@@ -0,0 +1,53 @@
+import base64
+import io
+import logging
+import os
+import tempfile
+
+logger = logging.getLogger(__name__)
+
+
+def preprocess_image(image_bytes, max_edge=1280, quality=85):
+    """
+    Prepare a photo for the VL model.
+
+    Applies the EXIF orientation, downsizes so the longest edge is at most
+    `max_edge` pixels and re-encodes as a compressed JPEG. Returns the new
+    bytes, or None if the image can't be decoded (callers then fall back
+    to the original).
+    """
+    try:
+        from PIL import Image, ImageOps
+        with Image.open(io.BytesIO(image_bytes)) as img:
+            # Phone photos are often stored sideways with an EXIF rotation flag
+            img = ImageOps.exif_transpose(img)
+            if img.mode != "RGB":
+                img = img.convert("RGB")
+            if max(img.size) > max_edge:
+                img.thumbnail((max_edge, max_edge), Image.LANCZOS)
+
+            out = io.BytesIO()
+            img.save(out, format="JPEG", quality=quality, optimize=True)
+            data = out.getvalue()
+    except Exception as e:
+        logger.warning(f"Image preprocessing failed, using original image: {e}")
+        return None
+
+    logger.debug(f"Preprocessed image: {len(image_bytes)} -> {len(data)} bytes")
+    return data
+
+
+def to_data_uri(jpeg_bytes):
+    """Encode JPEG bytes as a base64 data URI accepted by DashScope."""
+    return "data:image/jpeg;base64," + base64.b64encode(jpeg_bytes).decode("ascii")
+
+
+def to_temp_file(jpeg_bytes):
+    """
+    Write JPEG bytes to a temporary file and return its path.
+    The caller is responsible for deleting it.
+    """
+    fd, path = tempfile.mkstemp(suffix=".jpg", prefix="bp_")
+    with os.fdopen(fd, "wb") as f:
+        f.write(jpeg_bytes)
+    return path
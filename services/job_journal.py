@@ -0,0 +1,107 @@
+import json
+import logging
+import time
+from services.db_pool import SQLiteThreadLocal
+
+logger = logging.getLogger(__name__)
+
+
+class JobJournal:
+    """
+    Append-only, write-ahead journal of picture jobs.
+
+    Every state change of a job is appended as a row:
+
+        queued    -> data is the job itself (sender, webhook, download code)
+        parked    -> waiting for the VL circuit to close
+        analyzed  -> {"image_url", "analysis"}: the VL result, so it is never paid for twice
+        saved     -> same as analyzed plus "record_id"
+        done / failed (terminal)
+
+    After a restart, jobs whose latest state isn't terminal are resumed
+    from their last checkpoint.
+    """
+
+    TERMINAL_STATES = ("done", "failed")
+    CHECKPOINT_STATES = ("analyzed", "saved")
+
+    def __init__(self, path, busy_timeout=30):
+        self.path = path
+        self._db = SQLiteThreadLocal(path, busy_timeout=busy_timeout)
+        self._init_db()
+
+    def _init_db(self):
+        with self._db.connection() as conn:
+            conn.execute('''
+                CREATE TABLE IF NOT EXISTS job_events (
+                    seq INTEGER PRIMARY KEY AUTOINCREMENT,
+                    job_id TEXT NOT NULL,
+                    state TEXT NOT NULL,
+                    data TEXT,
+                    created_at REAL NOT NULL
+                )
+            ''')
+            conn.execute('CREATE INDEX IF NOT EXISTS idx_job_events_job ON job_events (job_id, seq)')
+            conn.commit()
+
+    def close(self):
+        self._db.close_all()
+
+    def record(self, job_id, state, data=None):
+        """Append a state transition; it is durable when this returns."""
+        with self._db.connection() as conn:
+            conn.execute(
+                "INSERT INTO job_events (job_id, state, data, created_at) VALUES (?, ?, ?, ?)",
+                (job_id, state, None if data is None else json.dumps(data, ensure_ascii=False), time.time())
+            )
+            conn.commit()
+
+    def latest(self, job_id):
+        """(state, data) of the job's most recent event, or None if it was never journaled."""
+        with self._db.connection() as conn:
+            row = conn.execute(
+                "SELECT state, data FROM job_events WHERE job_id = ? ORDER BY seq DESC LIMIT 1", (job_id,)
+            ).fetchone()
+        if row is None:
+            return None
+        return row[0], json.loads(row[1]) if row[1] else None
+
+    def checkpoint(self, job_id):
+        """Data of the job's latest analyzed/saved event, or None when there is nothing to reuse."""
+        latest = self.latest(job_id)
+        if latest is None or latest[0] not in self.CHECKPOINT_STATES:
+            return None
+        return latest[1]
+
+    def unfinished(self):
+        """Jobs (as originally queued) whose latest state isn't terminal, oldest first."""
+        placeholders = ", ".join("?" for _ in self.TERMINAL_STATES)
+        with self._db.connection() as conn:
+            rows = conn.execute(f'''
+                SELECT q.data
+                FROM job_events q
+                JOIN (SELECT job_id, MAX(seq) AS seq FROM job_events GROUP BY job_id) last
+                  ON last.job_id = q.job_id
+                JOIN job_events e ON e.seq = last.seq
+                WHERE q.state = 'queued' AND e.state NOT IN ({placeholders})
+                ORDER BY q.seq
+            ''', self.TERMINAL_STATES).fetchall()
+        return [json.loads(r[0]) for r in rows]
+
+    def prune(self, max_age):
+        """
+        Delete the events of finished jobs older than `max_age` seconds.
+        Returns the number of jobs removed.
+        """
+        cutoff = time.time() - max_age
+        placeholders = ", ".join("?" for _ in self.TERMINAL_STATES)
+        with self._db.connection() as conn:
+            finished = [r[0] for r in conn.execute(f'''
+                SELECT e.job_id
+                FROM job_events e
+                JOIN (SELECT job_id, MAX(seq) AS seq FROM job_events GROUP BY job_id) last ON last.seq = e.seq
+                WHERE e.state IN ({placeholders}) AND e.created_at < ?
+            ''', (*self.TERMINAL_STATES, cutoff)).fetchall()]
+            conn.executemany("DELETE FROM job_events WHERE job_id = ?", [(job_id,) for job_id in finished])
+            conn.commit()
+        return len(finished)
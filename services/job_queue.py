@@ -0,0 +1,187 @@
+import json
+import logging
+import os
+import time
+from services.db_pool import SQLiteThreadLocal
+from services.scheduler import AnalysisScheduler, QueueFullError
+
+logger = logging.getLogger(__name__)
+
+
+class JobQueue:
+    """
+    Durable picture-job queue shared between processes through a SQLite file.
+
+    The supervisor's stream handler submits jobs; worker processes claim
+    them one at a time (lower priority value first, then FIFO), report
+    completion, and publish heartbeats so the supervisor can tell healthy
+    workers from hung ones. Jobs a dead worker was running are put back
+    with requeue_running().
+
+    submit() has the same contract as AnalysisScheduler.submit, so the
+    handler can use either one.
+    """
+
+    PRIORITY_HIGH = AnalysisScheduler.PRIORITY_HIGH
+    PRIORITY_NORMAL = AnalysisScheduler.PRIORITY_NORMAL
+
+    def __init__(self, path, capacity=1, max_queue_size=200, busy_timeout=30):
+        """
+        Args:
+            path: SQLite file shared by the supervisor and the workers
+            capacity: jobs processed at once across all workers (for queue positions)
+            max_queue_size: max number of pending jobs before submit() rejects
+        """
+        self.path = path
+        self.capacity = capacity
+        self.max_queue_size = max_queue_size
+        self._db = SQLiteThreadLocal(path, busy_timeout=busy_timeout)
+        self._init_db()
+
+    def _init_db(self):
+        with self._db.connection() as conn:
+            conn.execute('''
+                CREATE TABLE IF NOT EXISTS jobs (
+                    id INTEGER PRIMARY KEY AUTOINCREMENT,
+                    priority INTEGER NOT NULL,
+                    payload TEXT NOT NULL,
+                    status TEXT NOT NULL DEFAULT 'pending',
+                    worker_id TEXT,
+                    attempts INTEGER NOT NULL DEFAULT 0,
+                    error TEXT,
+                    created_at REAL NOT NULL,
+                    claimed_at REAL,
+                    available_at REAL NOT NULL DEFAULT 0
+                )
+            ''')
+            # Queue files created before delayed jobs existed
+            columns = [info[1] for info in conn.execute("PRAGMA table_info(jobs)").fetchall()]
+            if "available_at" not in columns:
+                conn.execute("ALTER TABLE jobs ADD COLUMN available_at REAL NOT NULL DEFAULT 0")
+            conn.execute('CREATE INDEX IF NOT EXISTS idx_jobs_status_priority ON jobs (status, priority, id)')
+            conn.execute('''
+                CREATE TABLE IF NOT EXISTS workers (
+                    worker_id TEXT PRIMARY KEY,
+                    pid INTEGER,
+                    state TEXT,
+                    active INTEGER NOT NULL DEFAULT 0,
+                    processed INTEGER NOT NULL DEFAULT 0,
+                    failed INTEGER NOT NULL DEFAULT 0,
+                    started_at REAL,
+                    updated_at REAL
+                )
+            ''')
+            conn.commit()
+
+    def close(self):
+        self._db.close_all()
+
+    def put(self, job, priority=PRIORITY_NORMAL, delay=0):
+        """
+        Insert a job without checking the queue limit; it can't be claimed for
+        `delay` seconds. Returns the job id.
+        """
+        now = time.time()
+        with self._db.connection() as conn:
+            cursor = conn.execute(
+                "INSERT INTO jobs (priority, payload, created_at, available_at) VALUES (?, ?, ?, ?)",
+                (priority, json.dumps(job, ensure_ascii=False), now, now + delay)
+            )
+            conn.commit()
+            return cursor.lastrowid
+
+    def submit(self, job, priority=PRIORITY_NORMAL):
+        """
+        Enqueue a job. Returns its position in the waiting queue (0 if a
+        worker slot is free), or raises QueueFullError when saturated.
+        """
+        counts = self.counts()
+        if counts["pending"] >= self.max_queue_size:
+            raise QueueFullError(f"Job queue is full ({counts['pending']} jobs waiting)")
+        self.put(job, priority)
+        return max(0, counts["running"] + counts["pending"] - self.capacity + 1)
+
+    def claim(self, worker_id):
+        """Take the next available pending job for `worker_id`. Returns (job_id, job) or None when empty."""
+        now = time.time()
+        with self._db.connection() as conn:
+            # IMMEDIATE takes the write lock up front so two workers can't claim the same row
+            conn.execute("BEGIN IMMEDIATE")
+            row = conn.execute(
+                "SELECT id, payload FROM jobs WHERE status = 'pending' AND available_at <= ? ORDER BY priority, id LIMIT 1",
+                (now,)
+            ).fetchone()
+            if row is None:
+                conn.rollback()
+                return None
+            conn.execute(
+                "UPDATE jobs SET status = 'running', worker_id = ?, attempts = attempts + 1, claimed_at = ? WHERE id = ?",
+                (worker_id, now, row[0])
+            )
+            conn.commit()
+            return row[0], json.loads(row[1])
+
+    def complete(self, job_id):
+        with self._db.connection() as conn:
+            conn.execute("DELETE FROM jobs WHERE id = ?", (job_id,))
+            conn.commit()
+
+    def fail(self, job_id, error):
+        """Keep a job that raised for inspection instead of retrying it forever."""
+        with self._db.connection() as conn:
+            conn.execute("UPDATE jobs SET status = 'failed', error = ? WHERE id = ?", (str(error)[:1000], job_id))
+            conn.commit()
+
+    def requeue_running(self, worker_id=None):
+        """
+        Put jobs left 'running' back to pending, for one worker or (at startup) all of them.
+        Returns the number of jobs requeued.
+        """
+        with self._db.connection() as conn:
+            if worker_id is None:
+                cursor = conn.execute("UPDATE jobs SET status = 'pending', worker_id = NULL WHERE status = 'running'")
+            else:
+                cursor = conn.execute(
+                    "UPDATE jobs SET status = 'pending', worker_id = NULL WHERE status = 'running' AND worker_id = ?",
+                    (worker_id,)
+                )
+            conn.commit()
+            return cursor.rowcount
+
+    def counts(self):
+        with self._db.connection() as conn:
+            rows = conn.execute("SELECT status, COUNT(*) FROM jobs GROUP BY status").fetchall()
+        counts = {"pending": 0, "running": 0, "failed": 0}
+        counts.update(dict(rows))
+        return counts
+
+    def heartbeat(self, worker_id, state, active=0, processed=0, failed=0):
+        """Record a worker's liveness and progress."""
+        now = time.time()
+        with self._db.connection() as conn:
+            conn.execute('''
+                INSERT INTO workers (worker_id, pid, state, active, processed, failed, started_at, updated_at)
+                VALUES (?, ?, ?, ?, ?, ?, ?, ?)
+                ON CONFLICT(worker_id) DO UPDATE SET
+                    pid = excluded.pid, state = excluded.state, active = excluded.active,
+                    processed = excluded.processed, failed = excluded.failed,
+                    started_at = CASE WHEN workers.pid = excluded.pid THEN workers.started_at ELSE excluded.started_at END,
+                    updated_at = excluded.updated_at
+            ''', (worker_id, os.getpid(), state, active, processed, failed, now, now))
+            conn.commit()
+
+    def worker_status(self):
+        """Latest heartbeat of every worker, as dicts with 'heartbeat_age' in seconds."""
+        with self._db.connection() as conn:
+            rows = conn.execute(
+                "SELECT worker_id, pid, state, active, processed, failed, started_at, updated_at FROM workers ORDER BY worker_id"
+            ).fetchall()
+        now = time.time()
+        return [
+            {
+                "worker_id": r[0], "pid": r[1], "state": r[2], "active": r[3],
+                "processed": r[4], "failed": r[5], "started_at": r[6],
+                "heartbeat_age": now - r[7] if r[7] else None,
+            }
+            for r in rows
+        ]
@@ -0,0 +1,255 @@
+"""
+Lightweight in-process metrics with a Prometheus text-format /metrics endpoint.
+
+Counters, gauges and histograms are kept in memory and rendered on request; the
+HTTP server runs on a daemon thread so scraping never touches the event loop.
+"""
+import logging
+import threading
+import time
+from contextlib import contextmanager
+
+logger = logging.getLogger(__name__)
+
+# Seconds; covers fast DB writes through slow VL calls
+DEFAULT_BUCKETS = (0.005, 0.01, 0.025, 0.05, 0.1, 0.25, 0.5, 1, 2.5, 5, 10, 30, 60)
+
+
+def _format_labels(names, values, extra=None):
+    pairs = list(zip(names, values))
+    if extra:
+        pairs.append(extra)
+    if not pairs:
+        return ""
+    escaped = [(k, str(v).replace("\\", "\\\\").replace('"', '\\"').replace("\n", "\\n")) for k, v in pairs]
+    return "{" + ",".join(f'{k}="{v}"' for k, v in escaped) + "}"
+
+
+def _format_value(value):
+    if value == float("inf"):
+        return "+Inf"
+    return repr(float(value)) if isinstance(value, float) else str(value)
+
+
+class _Metric:
+    kind = None
+
+    def __init__(self, name, documentation, labelnames=()):
+        self.name = name
+        self.documentation = documentation
+        self.labelnames = tuple(labelnames)
+        self._values = {}
+        self._lock = threading.Lock()
+
+    def _key(self, labels):
+        if set(labels) != set(self.labelnames):
+            raise ValueError(f"{self.name} expects labels {self.labelnames}, got {tuple(labels)}")
+        return tuple(labels[name] for name in self.labelnames)
+
+    def render(self):
+        lines = [f"# HELP {self.name} {self.documentation}", f"# TYPE {self.name} {self.kind}"]
+        with self._lock:
+            items = sorted(self._values.items())
+            lines.extend(self._render_samples(items))
+        return lines
+
+
+class Counter(_Metric):
+    kind = "counter"
+
+    def inc(self, amount=1, **labels):
+        key = self._key(labels)
+        with self._lock:
+            self._values[key] = self._values.get(key, 0) + amount
+
+    def value(self, **labels):
+        with self._lock:
+            return self._values.get(self._key(labels), 0)
+
+    def _render_samples(self, items):
+        return [f"{self.name}{_format_labels(self.labelnames, key)} {_format_value(v)}" for key, v in items]
+
+
+class Gauge(_Metric):
+    kind = "gauge"
+
+    def set(self, value, **labels):
+        key = self._key(labels)
+        with self._lock:
+            self._values[key] = value
+
+    def _render_samples(self, items):
+        return [f"{self.name}{_format_labels(self.labelnames, key)} {_format_value(v)}" for key, v in items]
+
+
+class Histogram(_Metric):
+    kind = "histogram"
+
+    def __init__(self, name, documentation, labelnames=(), buckets=DEFAULT_BUCKETS):
+        super().__init__(name, documentation, labelnames)
+        self.buckets = tuple(sorted(buckets)) + (float("inf"),)
+
+    def observe(self, value, **labels):
+        key = self._key(labels)
+        with self._lock:
+            state = self._values.get(key)
+            if state is None:
+                state = self._values[key] = {"counts": [0] * len(self.buckets), "sum": 0.0, "count": 0}
+            for i, bound in enumerate(self.buckets):
+                if value <= bound:
+                    state["counts"][i] += 1
+                    break
+            state["sum"] += value
+            state["count"] += 1
+
+    def snapshot(self, **labels):
+        """(count, sum) observed for these labels."""
+        with self._lock:
+            state = self._values.get(self._key(labels))
+            return (state["count"], state["sum"]) if state else (0, 0.0)
+
+    def _render_samples(self, items):
+        lines = []
+        for key, state in items:
+            cumulative = 0
+            for bound, n in zip(self.buckets, state["counts"]):
+                cumulative += n
+                labels = _format_labels(self.labelnames, key, ("le", _format_value(bound)))
+                lines.append(f"{self.name}_bucket{labels} {cumulative}")
+            labels = _format_labels(self.labelnames, key)
+            lines.append(f"{self.name}_sum{labels} {_format_value(state['sum'])}")
+            lines.append(f"{self.name}_count{labels} {state['count']}")
+        return lines
+
+
+class Registry:
+    def __init__(self):
+        self._metrics = []
+
+    def register(self, metric):
+        self._metrics.append(metric)
+        return metric
+
+    def render(self):
+        lines = []
+        for metric in self._metrics:
+            lines.extend(metric.render())
+        return "\n".join(lines) + "\n"
+
+
+REGISTRY = Registry()
+
+STAGE_SECONDS = REGISTRY.register(Histogram(
+    "bp_stage_duration_seconds", "Time spent in each stage of handling a message.", ("stage",)))
+STAGE_ERRORS = REGISTRY.register(Counter(
+    "bp_stage_errors_total", "Stages that raised or reported a failure.", ("stage",)))
+MESSAGES = REGISTRY.register(Counter(
+    "bp_messages_total", "Messages received, by message type.", ("msg_type",)))
+DUPLICATE_MESSAGES = REGISTRY.register(Counter(
+    "bp_duplicate_messages_total", "Redelivered messages dropped by message ID."))
+DASHSCOPE_TOKENS = REGISTRY.register(Counter(
+    "bp_dashscope_tokens_total", "DashScope token usage reported by the API.", ("model", "kind")))
+DASHSCOPE_ERRORS = REGISTRY.register(Counter(
+    "bp_dashscope_errors_total", "Failed VL analyses, by error class.", ("error_class",)))
+LOCAL_OCR = REGISTRY.register(Counter(
+    "bp_local_ocr_total", "Local seven-segment OCR attempts, by outcome (hit or fallback to VL).", ("outcome",)))
+VL_BATCH_SIZE = REGISTRY.register(Histogram(
+    "bp_vl_batch_size", "Images sent per VL model request when batching is enabled.", (),
+    buckets=(1, 2, 3, 4, 6, 8, 12, 16)))
+VL_MODEL_LATENCY = REGISTRY.register(Histogram(
+    "bp_vl_model_duration_seconds", "VL call latency per model, including retries.", ("model",)))
+VL_MODEL_SUCCESS_RATE = REGISTRY.register(Gauge(
+    "bp_vl_model_success_rate", "Share of recent calls per model that returned a plausible reading.", ("model",)))
+VL_ESCALATIONS = REGISTRY.register(Counter(
+    "bp_vl_escalations_total", "Readings passed on to the next model after an unusable reply.", ("model",)))
+
+# Published by the supervisor in multi-process mode
+JOB_QUEUE_DEPTH = REGISTRY.register(Gauge(
+    "bp_job_queue_jobs", "Jobs in the shared queue, by status.", ("status",)))
+WORKER_UP = REGISTRY.register(Gauge(
+    "bp_worker_up", "1 if the worker process is alive with a recent heartbeat.", ("worker",)))
+WORKER_HEARTBEAT_AGE = REGISTRY.register(Gauge(
+    "bp_worker_heartbeat_age_seconds", "Seconds since the worker's last heartbeat.", ("worker",)))
+WORKER_JOBS = REGISTRY.register(Gauge(
+    "bp_worker_jobs", "Jobs handled by the current worker process, by outcome.", ("worker", "outcome")))
+WORKER_RESTARTS = REGISTRY.register(Counter(
+    "bp_worker_restarts_total", "Worker processes restarted after dying or hanging.", ("worker",)))
+
+
+class _Stage:
+    def __init__(self):
+        self.failed = False
+
+    def fail(self):
+        """Count the stage as failed without raising (e.g. the call returned None)."""
+        self.failed = True
+
+
+@contextmanager
+def stage(name):
+    """
+    Time a block as one stage. Exceptions and `.fail()` both count as a stage error.
+
+        with stage("db_write"):
+            db.add_record(...)
+    """
+    tracker = _Stage()
+    started = time.perf_counter()
+    try:
+        yield tracker
+    except Exception:
+        tracker.failed = True
+        raise
+    finally:
+        STAGE_SECONDS.observe(time.perf_counter() - started, stage=name)
+        if tracker.failed:
+            STAGE_ERRORS.inc(stage=name)
+
+
+def record_dashscope_usage(model, usage):
+    """Add a DashScope response's usage (input/output/image tokens) to the counters."""
+    if not usage:
+        return
+    for kind in ("input_tokens", "output_tokens", "image_tokens"):
+        value = usage.get(kind)
+        if value:
+            DASHSCOPE_TOKENS.inc(value, model=model, kind=kind)
+
+
+def _request_handler_class():
+    # http.server is only imported when the endpoint is actually started
+    from http.server import BaseHTTPRequestHandler
+
+    class MetricsRequestHandler(BaseHTTPRequestHandler):
+        def log_message(self, format, *args):
+            pass
+
+        def do_GET(self):
+            if self.path.split("?")[0] != "/metrics":
+                self.send_error(404)
+                return
+            body = REGISTRY.render().encode("utf-8")
+            self.send_response(200)
+            self.send_header("Content-Type", "text/plain; version=0.0.4; charset=utf-8")
+            self.send_header("Content-Length", str(len(body)))
+            self.end_headers()
+            self.wfile.write(body)
+
+    return MetricsRequestHandler
+
+
+def start_metrics_server(host="127.0.0.1", port=9108):
+    """
+    Serve /metrics on a daemon thread. Returns the server, or None if the port can't be bound.
+    """
+    from http.server import ThreadingHTTPServer
+
+    try:
+        server = ThreadingHTTPServer((host, port), _request_handler_class())
+    except OSError as e:
+        logger.error(f"Failed to start metrics server on {host}:{port}: {e}")
+        return None
+    server.daemon_threads = True
+    threading.Thread(target=server.serve_forever, name="bp-metrics", daemon=True).start()
+    logger.info(f"Metrics available at http://{host}:{server.server_address[1]}/metrics")
+    return server
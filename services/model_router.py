@@ -0,0 +1,86 @@
+import logging
+import threading
+from collections import deque
+from services.metrics import VL_MODEL_LATENCY, VL_MODEL_SUCCESS_RATE
+
+logger = logging.getLogger(__name__)
+
+
+class ModelRouter:
+    """
+    Chooses which VL models to try for an image, cheapest first.
+
+    `models` is ordered from cheapest/fastest to most capable; the caller
+    tries them in the planned order and escalates to the next one when a
+    reply is missing fields or isn't a plausible reading. The router keeps
+    the outcome and latency of each model's last `window` calls and leaves
+    a model out of the plan while trying it first no longer pays off:
+
+    - its success rate has dropped below `min_success_rate`, or
+    - its expected cost in time (its own latency plus the next model's on
+      failure) exceeds `latency_slack` times the next model's latency alone.
+
+    Every `probe_interval`-th plan still includes skipped models so their
+    statistics can recover. The last model is always kept.
+    """
+
+    def __init__(self, models, window=50, min_calls=10, min_success_rate=0.7, latency_slack=1.2, probe_interval=20):
+        if not models:
+            raise ValueError("ModelRouter needs at least one model")
+        self.models = list(models)
+        self.min_calls = min_calls
+        self.min_success_rate = min_success_rate
+        self.latency_slack = latency_slack
+        self.probe_interval = probe_interval
+        self._outcomes = {model: deque(maxlen=window) for model in self.models}  # (latency, ok)
+        self._plans = 0
+        self._lock = threading.Lock()
+
+    def plan(self, start=0):
+        """Models to try, in order, starting from `models[start]`."""
+        with self._lock:
+            self._plans += 1
+            probe = self.probe_interval > 0 and self._plans % self.probe_interval == 0
+            candidates = self.models[start:]
+            if probe:
+                return candidates
+            planned = [model for model, fallback in zip(candidates, candidates[1:]) if self._worth_trying(model, fallback)]
+            return planned + candidates[-1:]
+
+    def record(self, model, latency, ok):
+        """Record one attempt: its latency in seconds and whether the reply was usable."""
+        with self._lock:
+            outcomes = self._outcomes.get(model)
+            if outcomes is None:
+                return
+            outcomes.append((latency, ok))
+            success_rate = sum(1 for _, success in outcomes if success) / len(outcomes)
+        VL_MODEL_LATENCY.observe(latency, model=model)
+        VL_MODEL_SUCCESS_RATE.set(round(success_rate, 3), model=model)
+
+    def stats(self):
+        """{model: {"calls", "success_rate", "mean_latency"}} over the rolling window."""
+        with self._lock:
+            return {model: self._stats(model) for model in self.models}
+
+    def _stats(self, model):
+        outcomes = self._outcomes[model]
+        if not outcomes:
+            return {"calls": 0, "success_rate": None, "mean_latency": None}
+        return {
+            "calls": len(outcomes),
+            "success_rate": sum(1 for _, ok in outcomes if ok) / len(outcomes),
+            "mean_latency": sum(latency for latency, _ in outcomes) / len(outcomes),
+        }
+
+    def _worth_trying(self, model, fallback):
+        stats = self._stats(model)
+        if stats["calls"] < self.min_calls:
+            return True
+        if stats["success_rate"] < self.min_success_rate:
+            return False
+        fallback_latency = self._stats(fallback)["mean_latency"]
+        if fallback_latency is None:
+            return True
+        expected = stats["mean_latency"] + (1 - stats["success_rate"]) * fallback_latency
+        return expected <= self.latency_slack * fallback_latency
@@ -0,0 +1,159 @@
+import logging
+import random
+import threading
+import time
+from collections import deque
+from config import Config
+
+logger = logging.getLogger(__name__)
+
+
+class CircuitOpenError(Exception):
+    """Raised instead of calling a service whose circuit breaker is open."""
+
+
+class CircuitBreaker:
+    """
+    Error-rate circuit breaker.
+
+    Tracks the outcome of the last `window` calls. Once at least `min_calls`
+    have been seen and the failure rate reaches `failure_rate`, the circuit
+    opens and calls fail fast for `reset_timeout` seconds. After that a
+    single probe call is let through (half-open): success closes the
+    circuit, failure opens it again.
+    """
+
+    CLOSED = "closed"
+    OPEN = "open"
+    HALF_OPEN = "half_open"
+
+    def __init__(self, name, failure_rate=0.5, window=20, min_calls=5, reset_timeout=30):
+        self.name = name
+        self.failure_rate = failure_rate
+        self.min_calls = min_calls
+        self.reset_timeout = reset_timeout
+        self._outcomes = deque(maxlen=window)
+        self._state = self.CLOSED
+        self._opened_at = 0
+        self._probe_in_flight = False
+        self._lock = threading.Lock()
+
+    @property
+    def state(self):
+        with self._lock:
+            if self._state == self.OPEN and time.monotonic() - self._opened_at >= self.reset_timeout:
+                return self.HALF_OPEN
+            return self._state
+
+    def before_call(self):
+        """Raise CircuitOpenError if the call must not go through."""
+        with self._lock:
+            if self._state == self.CLOSED:
+                return
+            if self._state == self.OPEN:
+                if time.monotonic() - self._opened_at < self.reset_timeout:
+                    raise CircuitOpenError(f"Circuit '{self.name}' is open")
+                self._state = self.HALF_OPEN
+            # Half-open: only one probe at a time
+            if self._probe_in_flight:
+                raise CircuitOpenError(f"Circuit '{self.name}' is half-open, probe in progress")
+            self._probe_in_flight = True
+
+    def record_success(self):
+        with self._lock:
+            if self._state != self.CLOSED:
+                logger.info(f"Circuit '{self.name}' closed")
+                self._state = self.CLOSED
+                self._outcomes.clear()
+                self._probe_in_flight = False
+            self._outcomes.append(True)
+
+    def record_failure(self):
+        with self._lock:
+            if self._state != self.CLOSED:
+                self._trip()
+                return
+            self._outcomes.append(False)
+            failures = self._outcomes.count(False)
+            if len(self._outcomes) >= self.min_calls and failures / len(self._outcomes) >= self.failure_rate:
+                self._trip()
+
+    def _trip(self):
+        if self._state == self.CLOSED:
+            logger.warning(f"Circuit '{self.name}' opened")
+        self._state = self.OPEN
+        self._opened_at = time.monotonic()
+        self._probe_in_flight = False
+
+
+_breakers = {}
+_breakers_lock = threading.Lock()
+
+
+def get_breaker(name):
+    """Shared circuit breaker for an endpoint, created with the configured thresholds."""
+    with _breakers_lock:
+        breaker = _breakers.get(name)
+        if breaker is None:
+            breaker = CircuitBreaker(
+                name,
+                failure_rate=Config.CIRCUIT_FAILURE_RATE,
+                window=Config.CIRCUIT_WINDOW,
+                min_calls=Config.CIRCUIT_MIN_CALLS,
+                reset_timeout=Config.CIRCUIT_RESET_TIMEOUT,
+            )
+            _breakers[name] = breaker
+        return breaker
+
+
+def call_with_retry(func, breaker=None, should_retry=None, max_attempts=None, base_delay=None,
+                    max_delay=None, deadline=None):
+    """
+    Call `func` with jittered exponential backoff.
+
+    A call fails if it raises, or if `should_retry(result)` is true (for
+    clients that report errors in their return value). Failures are
+    retried until `max_attempts` is reached or the next wait would pass
+    `deadline` seconds since the first attempt; the last exception is
+    re-raised, or the last failed result returned. With a `breaker`, every
+    outcome is recorded and CircuitOpenError is raised when it is open.
+    """
+    max_attempts = max_attempts or Config.RETRY_MAX_ATTEMPTS
+    base_delay = Config.RETRY_BASE_DELAY if base_delay is None else base_delay
+    max_delay = Config.RETRY_MAX_DELAY if max_delay is None else max_delay
+    started = time.monotonic()
+
+    attempt = 0
+    while True:
+        attempt += 1
+        if breaker is not None:
+            breaker.before_call()
+
+        error = None
+        try:
+            result = func()
+        except Exception as e:
+            error = e
+            failed = True
+        else:
+            failed = should_retry is not None and should_retry(result)
+
+        if breaker is not None:
+            if failed:
+                breaker.record_failure()
+            else:
+                breaker.record_success()
+        if not failed:
+            return result
+
+        # Full jitter keeps many workers from retrying in lockstep
+        delay = random.uniform(0, min(max_delay, base_delay * 2 ** (attempt - 1)))
+        out_of_time = deadline is not None and time.monotonic() - started + delay >= deadline
+        if attempt >= max_attempts or out_of_time:
+            if error is not None:
+                raise error
+            return result
+
+        name = breaker.name if breaker is not None else getattr(func, "__name__", "call")
+        logger.warning(f"{name} failed (attempt {attempt}/{max_attempts}), retrying in {delay:.2f}s")
+        time.sleep(delay)
@@ -0,0 +1,172 @@
+import hashlib
+import io
+import json
+import logging
+import sqlite3
+import threading
+import time
+from collections import OrderedDict
+
+logger = logging.getLogger(__name__)
+
+
+def content_hash(image_bytes):
+    """SHA-256 of the raw image bytes."""
+    return hashlib.sha256(image_bytes).hexdigest()
+
+
+def perceptual_hash(image_bytes, hash_size=16):
+    """
+    Difference hash (dHash) of an image as an int, or None if it can't be decoded.
+    Re-encoded or resized copies of the same photo produce the same or a very close hash.
+    """
+    try:
+        from PIL import Image
+        with Image.open(io.BytesIO(image_bytes)) as img:
+            img = img.convert("L").resize((hash_size + 1, hash_size))
+            pixels = list(img.getdata())
+    except Exception as e:
+        logger.warning(f"Could not compute perceptual hash: {e}")
+        return None
+
+    value = 0
+    for row in range(hash_size):
+        offset = row * (hash_size + 1)
+        for col in range(hash_size):
+            value = (value << 1) | (pixels[offset + col] > pixels[offset + col + 1])
+    return value
+
+
+class ResultCache:
+    """
+    Cache of image analysis results keyed by image content.
+
+    Tier 1 is a size-bounded in-memory LRU. Tier 2 is an optional SQLite
+    table that survives restarts; both tiers expire entries after `ttl`
+    seconds. Near-duplicate lookup by perceptual hash is opt-in
+    (`phash_distance` >= 0) because two photos of the same monitor that
+    differ only in the digits can hash very closely.
+    """
+
+    def __init__(self, max_entries=1000, ttl=86400, db_path=None, phash_distance=-1):
+        self.max_entries = max_entries
+        self.ttl = ttl
+        self.phash_distance = phash_distance
+        self._entries = OrderedDict()  # sha256 -> (phash, result, stored_at)
+        self._lock = threading.Lock()
+        self._stats = {"hits": 0, "near_hits": 0, "persistent_hits": 0, "misses": 0}
+
+        self._db = None
+        if db_path:
+            self._db = sqlite3.connect(db_path, check_same_thread=False)
+            self._db.execute("""
+                CREATE TABLE IF NOT EXISTS analysis_cache (
+                    sha256 TEXT PRIMARY KEY,
+                    phash TEXT,
+                    result TEXT NOT NULL,
+                    stored_at REAL NOT NULL
+                )
+            """)
+            self._db.execute("CREATE INDEX IF NOT EXISTS idx_analysis_cache_phash ON analysis_cache (phash)")
+            self._db.commit()
+            self.evict_expired()
+
+    @property
+    def _use_phash(self):
+        return self.phash_distance >= 0
+
+    def get(self, image_bytes):
+        """Return the cached result for these image bytes, or None."""
+        key = content_hash(image_bytes)
+        phash = perceptual_hash(image_bytes) if self._use_phash else None
+        now = time.time()
+
+        with self._lock:
+            entry = self._entries.get(key)
+            if entry is not None and now - entry[2] <= self.ttl:
+                self._entries.move_to_end(key)
+                self._stats["hits"] += 1
+                return dict(entry[1])
+
+            if phash is not None:
+                for other_key, (other_phash, result, stored_at) in self._entries.items():
+                    if other_phash is None or now - stored_at > self.ttl:
+                        continue
+                    if bin(phash ^ other_phash).count("1") <= self.phash_distance:
+                        self._entries.move_to_end(other_key)
+                        self._stats["near_hits"] += 1
+                        return dict(result)
+
+            result = self._get_persistent(key, phash, now)
+            if result is not None:
+                self._store_memory(key, phash, result, now)
+                self._stats["persistent_hits"] += 1
+                return dict(result)
+
+            self._stats["misses"] += 1
+            return None
+
+    def put(self, image_bytes, result):
+        """Store a successful analysis result for these image bytes."""
+        key = content_hash(image_bytes)
+        phash = perceptual_hash(image_bytes) if self._use_phash else None
+        now = time.time()
+
+        with self._lock:
+            self._store_memory(key, phash, result, now)
+            if self._db is not None:
+                try:
+                    self._db.execute(
+                        "INSERT OR REPLACE INTO analysis_cache (sha256, phash, result, stored_at) VALUES (?, ?, ?, ?)",
+                        (key, None if phash is None else format(phash, "x"), json.dumps(result), now),
+                    )
+                    self._db.commit()
+                except Exception as e:
+                    logger.error(f"Error writing analysis cache: {e}")
+
+    def evict_expired(self):
+        """Drop expired entries from both tiers."""
+        cutoff = time.time() - self.ttl
+        with self._lock:
+            for key in [k for k, v in self._entries.items() if v[2] < cutoff]:
+                del self._entries[key]
+            if self._db is not None:
+                try:
+                    self._db.execute("DELETE FROM analysis_cache WHERE stored_at < ?", (cutoff,))
+                    self._db.commit()
+                except Exception as e:
+                    logger.error(f"Error evicting analysis cache: {e}")
+
+    def stats(self):
+        """Hit/miss counters and current size."""
+        with self._lock:
+            stats = dict(self._stats)
+            stats["size"] = len(self._entries)
+        lookups = sum(stats[k] for k in ("hits", "near_hits", "persistent_hits", "misses"))
+        stats["hit_rate"] = (lookups - stats["misses"]) / lookups if lookups else 0.0
+        return stats
+
+    def _store_memory(self, key, phash, result, now):
+        self._entries[key] = (phash, dict(result), now)
+        self._entries.move_to_end(key)
+        while len(self._entries) > self.max_entries:
+            self._entries.popitem(last=False)
+
+    def _get_persistent(self, key, phash, now):
+        if self._db is None:
+            return None
+        try:
+            row = self._db.execute(
+                "SELECT result FROM analysis_cache WHERE sha256 = ? AND stored_at >= ?",
+                (key, now - self.ttl),
+            ).fetchone()
+            # The persistent tier only matches identical perceptual hashes (indexed lookup)
+            if row is None and phash is not None:
+                row = self._db.execute(
+                    "SELECT result FROM analysis_cache WHERE phash = ? AND stored_at >= ?",
+                    (format(phash, "x"), now - self.ttl),
+                ).fetchone()
+            return json.loads(row[0]) if row else None
+        except Exception as e:
+            logger.error(f"Error reading analysis cache: {e}")
+            return None
@@ -0,0 +1,97 @@
+import asyncio
+import itertools
+import logging
+
+logger = logging.getLogger(__name__)
+
+
+class QueueFullError(Exception):
+    """Raised when the analysis queue has reached its maximum depth."""
+
+
+class AnalysisScheduler:
+    """
+    Bounded worker pool between the stream handler and the image analyzer.
+
+    Jobs are kept in an in-process priority queue (lower value runs first,
+    equal priorities run in submission order) and processed by a fixed
+    number of asyncio workers, which keeps DashScope concurrency and memory
+    bounded during peak hours.
+    """
+
+    PRIORITY_HIGH = 0
+    PRIORITY_NORMAL = 10
+
+    def __init__(self, job_handler, workers=4, max_queue_size=200):
+        """
+        Args:
+            job_handler: async callable invoked with each job
+            workers: number of jobs processed concurrently
+            max_queue_size: max number of jobs waiting for a worker
+        """
+        self.job_handler = job_handler
+        self.workers = workers
+        self.max_queue_size = max_queue_size
+        self._queue = None
+        self._counter = itertools.count()
+        self._tasks = []
+        self._active = 0
+
+    def _ensure_started(self):
+        # Workers are created lazily so the scheduler can be built outside the event loop
+        if self._queue is None:
+            self._queue = asyncio.PriorityQueue(maxsize=self.max_queue_size)
+            for i in range(self.workers):
+                self._tasks.append(asyncio.create_task(self._worker(i)))
+
+    @property
+    def pending(self):
+        """Number of jobs waiting for a worker."""
+        return self._queue.qsize() if self._queue else 0
+
+    @property
+    def active(self):
+        """Number of jobs currently being processed."""
+        return self._active
+
+    def submit(self, job, priority=PRIORITY_NORMAL):
+        """
+        Enqueue a job.
+
+        Returns the job's position in the waiting queue, or 0 if a worker is
+        free to pick it up right away. Raises QueueFullError when saturated.
+        """
+        self._ensure_started()
+        if self._queue.full():
+            raise QueueFullError(f"Analysis queue is full ({self.max_queue_size} jobs waiting)")
+
+        # Jobs already queued may still be picked up by idle workers; only count the overflow
+        position = max(0, self._active + self._queue.qsize() - self.workers + 1)
+
+        self._queue.put_nowait((priority, next(self._counter), job))
+        return position
+
+    async def join(self):
+        """Wait until every queued job has been processed."""
+        if self._queue is not None:
+            await self._queue.join()
+
+    async def stop(self):
+        """Cancel all workers. Jobs still waiting in the queue are dropped."""
+        for task in self._tasks:
+            task.cancel()
+        await asyncio.gather(*self._tasks, return_exceptions=True)
+        self._tasks = []
+        self._queue = None
+
+    async def _worker(self, index):
+        while True:
+            _, _, job = await self._queue.get()
+            self._active += 1
+            try:
+                await self.job_handler(job)
+            except Exception as e:
+                logger.error(f"Analysis worker {index} failed on job: {e}")
+            finally:
+                self._active -= 1
+                self._queue.task_done()
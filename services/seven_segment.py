@@ -0,0 +1,181 @@
+"""
+Local seven-segment display reader for blood pressure monitor photos.
+
+A CPU-only fast path in front of the VL model: the photo is binarized,
+split into text rows and digits with projection profiles, and every
+digit is decoded by sampling its seven segment areas. It only answers
+when the display reads as exactly three plausible numbers (systolic,
+diastolic, pulse, top to bottom); otherwise the caller falls back to
+the VL model.
+"""
+import io
+import logging
+import numpy as np
+from services.bp_classifier import is_plausible
+
+logger = logging.getLogger(__name__)
+
+# Work on a fixed height so pixel thresholds don't depend on camera resolution
+WORK_HEIGHT = 480
+
+# Segment sample areas as (x0, x1, y0, y1) fractions of the digit box, in a..g order
+SEGMENT_AREAS = {
+    "a": (0.25, 0.75, 0.00, 0.15),
+    "b": (0.75, 1.00, 0.15, 0.43),
+    "c": (0.75, 1.00, 0.57, 0.85),
+    "d": (0.25, 0.75, 0.85, 1.00),
+    "e": (0.00, 0.25, 0.57, 0.85),
+    "f": (0.00, 0.25, 0.15, 0.43),
+    "g": (0.25, 0.75, 0.43, 0.57),
+}
+# An area counts as lit when at least this share of it is foreground
+SEGMENT_ON = 0.35
+
+# Lit segments (a..g) -> digit; includes the common 6/7/9 variants
+DIGIT_PATTERNS = {
+    "1111110": 0, "0110000": 1, "1101101": 2, "1111001": 3, "0110011": 4,
+    "1011011": 5, "1011111": 6, "0011111": 6, "1110000": 7, "1110010": 7,
+    "1111111": 8, "1111011": 9, "1110011": 9,
+}
+
+
+def _load_gray(image_bytes):
+    from PIL import Image, ImageOps
+
+    with Image.open(io.BytesIO(image_bytes)) as img:
+        img = ImageOps.exif_transpose(img).convert("L")
+        width = max(1, round(img.width * WORK_HEIGHT / img.height))
+        img = img.resize((width, WORK_HEIGHT))
+        return np.asarray(img, dtype=np.float32)
+
+
+def _otsu_threshold(gray):
+    hist = np.bincount(gray.astype(np.uint8).ravel(), minlength=256).astype(np.float64)
+    total = hist.sum()
+    levels = np.arange(256)
+    weight_bg = np.cumsum(hist)
+    weight_fg = total - weight_bg
+    cum_mean = np.cumsum(hist * levels)
+    mean_bg = cum_mean / np.maximum(weight_bg, 1)
+    mean_fg = (cum_mean[-1] - cum_mean) / np.maximum(weight_fg, 1)
+    between = weight_bg * weight_fg * (mean_bg - mean_fg) ** 2
+    return int(np.argmax(between))
+
+
+def _binarize(gray):
+    """Foreground mask; digits are whichever side of the threshold is the minority."""
+    foreground = gray <= _otsu_threshold(gray)
+    if foreground.mean() > 0.5:
+        foreground = ~foreground
+    # Close the small gaps between segments of one digit
+    closed = foreground.copy()
+    closed[1:, :] |= foreground[:-1, :]
+    closed[:-1, :] |= foreground[1:, :]
+    closed[:, 1:] |= foreground[:, :-1]
+    closed[:, :-1] |= foreground[:, 1:]
+    return closed
+
+
+def _runs(profile, min_value, max_gap=0):
+    """(start, end) runs where profile > min_value, merging runs separated by <= max_gap."""
+    active = np.concatenate(([False], profile > min_value, [False]))
+    edges = np.flatnonzero(active[1:] != active[:-1])
+    runs = list(zip(edges[::2], edges[1::2]))
+    merged = []
+    for start, end in runs:
+        if merged and start - merged[-1][1] <= max_gap:
+            merged[-1] = (merged[-1][0], end)
+        else:
+            merged.append((start, end))
+    return merged
+
+
+def _decode_one(box):
+    """A mark much narrower than the other digits can only be a '1' (two right-hand segments)."""
+    fill = float(box.mean())
+    return (1, min(1.0, fill / 0.7)) if fill > 0.5 else (None, 0.0)
+
+
+def _decode_digit(box):
+    """Return (digit, confidence) for a digit cell, or (None, 0.0)."""
+    h, w = box.shape
+    pattern, confidence = "", 1.0
+    for x0, x1, y0, y1 in SEGMENT_AREAS.values():
+        area = box[int(y0 * h):max(int(y1 * h), int(y0 * h) + 1), int(x0 * w):max(int(x1 * w), int(x0 * w) + 1)]
+        ratio = float(area.mean())
+        pattern += "1" if ratio >= SEGMENT_ON else "0"
+        # How clearly the area is on or off; ambiguous areas lower the confidence
+        confidence = min(confidence, min(1.0, abs(ratio - SEGMENT_ON) / SEGMENT_ON))
+    digit = DIGIT_PATTERNS.get(pattern)
+    return (digit, confidence) if digit is not None else (None, 0.0)
+
+
+def _read_row(mask):
+    """Decode one text row into (number, confidence), or None if it isn't a 2-3 digit number."""
+    row_height = mask.shape[0]
+    pieces = []
+    for start, end in _runs(mask.sum(axis=0), 0, max_gap=1):
+        rows = np.flatnonzero(mask[:, start:end].any(axis=1))
+        # Skip marks much shorter than the digits (icons, decimal points, units)
+        if rows.size and rows[-1] - rows[0] + 1 >= row_height * 0.6:
+            pieces.append((start, end))
+    if not pieces:
+        return None
+
+    # Digits lacking left-hand segments (1, 3, 7) are narrower than their cell;
+    # the widest mark in the row gives the cell width
+    cell_width = max(end - start for start, end in pieces)
+    only_ones = cell_width < row_height * 0.4
+
+    digits, confidence = [], 1.0
+    for start, end in pieces:
+        if only_ones or end - start < cell_width * 0.5:
+            digit, digit_confidence = _decode_one(mask[:, start:end])
+        else:
+            # Decode against the full row height and a right-aligned cell, so digits
+            # without a top, bottom or left segment aren't stretched to fill their own box
+            digit, digit_confidence = _decode_digit(mask[:, max(0, end - cell_width):end])
+        if digit is None:
+            return None
+        digits.append(digit)
+        confidence = min(confidence, digit_confidence)
+
+    if not 2 <= len(digits) <= 3:
+        return None
+    return int("".join(str(d) for d in digits)), confidence
+
+
+def read_display(image_bytes):
+    """
+    Read systolic/diastolic/pulse from a monitor photo.
+
+    Returns {"systolic", "diastolic", "pulse", "confidence"} with confidence in [0, 1],
+    or None when the photo doesn't read as exactly three plausible numbers.
+    """
+    try:
+        mask = _binarize(_load_gray(image_bytes))
+    except Exception as e:
+        logger.warning(f"Local OCR could not load image: {e}")
+        return None
+
+    height, width = mask.shape
+    # Bridge the small gap between upper and lower vertical segments (e.g. in 0 or 1)
+    bands = _runs(mask.sum(axis=1), width * 0.01, max_gap=int(height * 0.015))
+    # Digits on BP monitors are large; thin bands are labels, borders or noise
+    bands = [(top, bottom) for top, bottom in bands if bottom - top >= height * 0.08]
+    if len(bands) != 3:
+        return None
+
+    values, confidence = [], 1.0
+    for top, bottom in bands:
+        row = _read_row(mask[top:bottom])
+        if row is None:
+            return None
+        values.append(row[0])
+        confidence = min(confidence, row[1])
+
+    reading = dict(zip(("systolic", "diastolic", "pulse"), values))
+    if not is_plausible(reading):
+        return None
+    reading["confidence"] = round(float(confidence), 3)
+    return reading
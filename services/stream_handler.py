@@ -0,0 +1,8 @@
+from dingtalk_stream import AckMessage, CallbackHandler as BaseCallbackHandler
+from services.handlers import MessageHandler
+
+
+class CallbackHandler(MessageHandler, BaseCallbackHandler):
+    """MessageHandler registered with the DingTalk stream client."""
+
+    STATUS_OK = AckMessage.STATUS_OK
@@ -0,0 +1,127 @@
+import asyncio
+import logging
+import multiprocessing
+import signal
+import time
+from config import Config
+from services.job_queue import JobQueue
+from services.metrics import JOB_QUEUE_DEPTH, WORKER_HEARTBEAT_AGE, WORKER_JOBS, WORKER_RESTARTS, WORKER_UP
+from services.worker import run_worker
+
+logger = logging.getLogger(__name__)
+
+
+class Supervisor:
+    """
+    Runs the stream connection in this process and picture analysis in N worker processes.
+
+    The stream handler submits jobs to a shared SQLite JobQueue that the
+    workers consume. The supervisor restarts workers that exit or stop
+    sending heartbeats (their running jobs are requeued first), publishes
+    worker health as metrics, and on SIGTERM/SIGINT stops the stream,
+    lets workers drain for up to WORKER_DRAIN_TIMEOUT seconds and leaves
+    anything unfinished in the queue for the next start.
+    """
+
+    def __init__(self, processes):
+        self.processes = processes
+        self.queue = JobQueue(
+            Config.JOB_QUEUE_PATH,
+            capacity=processes * Config.ANALYSIS_WORKERS,
+            max_queue_size=Config.ANALYSIS_QUEUE_SIZE,
+        )
+        # spawn gives workers a clean interpreter instead of a fork of the running event loop
+        self._ctx = multiprocessing.get_context("spawn")
+        self._workers = {}
+        self._started_at = {}
+
+    def _start_worker(self, index):
+        process = self._ctx.Process(target=run_worker, args=(index,), name=f"bp-worker-{index}", daemon=False)
+        process.start()
+        self._workers[index] = process
+        self._started_at[index] = time.time()
+        logger.info(f"Started worker-{index} (pid {process.pid})")
+
+    async def run(self, stream_coro):
+        """Start the workers and the stream client coroutine, and supervise until signalled."""
+        # Nothing is running yet, so any 'running' rows are left over from a crash
+        requeued = self.queue.requeue_running()
+        if requeued:
+            logger.info(f"Requeued {requeued} jobs left running by the previous run")
+
+        for index in range(self.processes):
+            self._start_worker(index)
+
+        stop = asyncio.Event()
+        loop = asyncio.get_running_loop()
+        for sig in (signal.SIGTERM, signal.SIGINT):
+            loop.add_signal_handler(sig, stop.set)
+
+        stream_task = asyncio.create_task(stream_coro)
+        stream_task.add_done_callback(lambda _: stop.set())
+        try:
+            while not stop.is_set():
+                await loop.run_in_executor(None, self._check_workers)
+                try:
+                    await asyncio.wait_for(stop.wait(), Config.WORKER_HEARTBEAT_INTERVAL)
+                except asyncio.TimeoutError:
+                    pass
+        finally:
+            logger.info("Shutting down: stopping the stream client and draining workers")
+            stream_task.cancel()
+            await asyncio.gather(stream_task, return_exceptions=True)
+            await loop.run_in_executor(None, self._drain)
+            self.queue.close()
+
+    def _check_workers(self):
+        """Restart dead or hung workers and publish queue/worker health."""
+        status = {s["worker_id"]: s for s in self.queue.worker_status()}
+        for index, process in list(self._workers.items()):
+            worker_id = f"worker-{index}"
+            beat = status.get(worker_id)
+            # Only trust heartbeats written by this process, not a previous incarnation
+            fresh = beat is not None and beat["pid"] == process.pid
+            age = beat["heartbeat_age"] if fresh else time.time() - self._started_at[index]
+            hung = age > Config.WORKER_HEARTBEAT_TIMEOUT
+
+            if not process.is_alive() or hung:
+                if hung and process.is_alive():
+                    logger.error(f"{worker_id} missed heartbeats for {age:.0f}s, restarting")
+                    process.kill()
+                else:
+                    logger.error(f"{worker_id} exited with code {process.exitcode}, restarting")
+                process.join()
+                requeued = self.queue.requeue_running(worker_id)
+                if requeued:
+                    logger.info(f"Requeued {requeued} jobs from {worker_id}")
+                WORKER_RESTARTS.inc(worker=worker_id)
+                self._start_worker(index)
+                WORKER_UP.set(0, worker=worker_id)
+                continue
+
+            WORKER_UP.set(1, worker=worker_id)
+            WORKER_HEARTBEAT_AGE.set(round(age, 1), worker=worker_id)
+            if fresh:
+                WORKER_JOBS.set(beat["processed"], worker=worker_id, outcome="processed")
+                WORKER_JOBS.set(beat["failed"], worker=worker_id, outcome="failed")
+
+        for state, n in self.queue.counts().items():
+            JOB_QUEUE_DEPTH.set(n, status=state)
+
+    def _drain(self):
+        """SIGTERM every worker, wait for them to finish their jobs, then kill stragglers."""
+        for process in self._workers.values():
+            if process.is_alive():
+                process.terminate()
+
+        deadline = time.monotonic() + Config.WORKER_DRAIN_TIMEOUT
+        for index, process in self._workers.items():
+            process.join(max(0, deadline - time.monotonic()))
+            if process.is_alive():
+                logger.warning(f"worker-{index} did not drain in time, killing it")
+                process.kill()
+                process.join()
+                self.queue.requeue_running(f"worker-{index}")
+
+        counts = self.queue.counts()
+        logger.info(f"All workers stopped; {counts['pending']} jobs left pending for the next start")
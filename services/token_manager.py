@@ -0,0 +1,207 @@
+import json
+import logging
+import os
+import threading
+import time
+from contextlib import contextmanager
+
+from services.metrics import stage
+from services.resilience import call_with_retry, get_breaker
+
+logger = logging.getLogger(__name__)
+
+try:
+    import fcntl
+except ImportError:  # Windows: fall back to in-process single-flight only
+    fcntl = None
+
+
+class TokenManager:
+    """
+    Process-wide DingTalk access token manager.
+
+    - One instance per app key, shared by every DingTalkAPI in the process.
+    - Concurrent callers that find the token expired trigger a single
+      gettoken request (single-flight); the rest wait for its result.
+    - A background thread refreshes the token `refresh_margin` seconds
+      before it expires, so callers normally never wait.
+    - With `cache_file` set, the token is shared through a local file so
+      restarts and other worker processes reuse it instead of calling
+      gettoken again.
+    """
+
+    TOKEN_URL = "https://oapi.dingtalk.com/gettoken"
+    # Stop handing out a token this many seconds before it actually expires
+    EXPIRY_BUFFER = 60
+    RETRY_DELAY = 30
+
+    _instances = {}
+    _instances_lock = threading.Lock()
+
+    @classmethod
+    def for_app(cls, app_key, app_secret, cache_file=None, refresh_margin=300, session=None, timeout=10,
+                token_url=None):
+        """Return the shared manager for this app, creating it on first use."""
+        with cls._instances_lock:
+            manager = cls._instances.get(app_key)
+            if manager is None:
+                manager = cls(app_key, app_secret, cache_file, refresh_margin, session, timeout, token_url)
+                cls._instances[app_key] = manager
+            return manager
+
+    def __init__(self, app_key, app_secret, cache_file=None, refresh_margin=300, session=None, timeout=10,
+                 token_url=None):
+        self.app_key = app_key
+        self.app_secret = app_secret
+        self.cache_file = cache_file
+        self.refresh_margin = refresh_margin
+        # Reuse the caller's keep-alive session when given one
+        if session is None:
+            import requests
+            session = requests.Session()
+        self.session = session
+        self.timeout = timeout
+        self.token_url = token_url or self.TOKEN_URL
+
+        self._token = None
+        self._expires_at = 0
+        self._lock = threading.Lock()
+        self._refresher = None
+        self._stop = threading.Event()
+
+    def get_token(self):
+        """Return a valid access token, or None if it can't be fetched."""
+        self._ensure_refresher()
+        token = self._valid_token()
+        if token:
+            return token
+
+        with self._lock:
+            # Another thread may have refreshed while we waited for the lock
+            token = self._valid_token()
+            if token:
+                return token
+            return self._refresh()
+
+    def stop(self):
+        """Stop the background refresher."""
+        self._stop.set()
+
+    def _valid_token(self):
+        if self._token and time.time() < self._expires_at - self.EXPIRY_BUFFER:
+            return self._token
+        return None
+
+    def _fresh(self):
+        """True if the token doesn't need a proactive refresh yet."""
+        return bool(self._token) and time.time() < self._expires_at - self.refresh_margin
+
+    def _refresh(self, force=False):
+        """Fetch a new token. Must be called with self._lock held."""
+        with self._file_lock():
+            # A restart or another process may already have a fresh token on disk
+            if self._load_from_file() and (not force or self._fresh()):
+                return self._token
+
+            token, expires_at = self._fetch()
+            if not token:
+                return self._valid_token()
+
+            self._token = token
+            self._expires_at = expires_at
+            self._save_to_file()
+            return token
+
+    def _fetch(self):
+        params = {
+            "appkey": self.app_key,
+            "appsecret": self.app_secret
+        }
+        with stage("token_fetch") as fetch_stage:
+            try:
+                resp = call_with_retry(
+                    lambda: self.session.get(self.token_url, params=params, timeout=self.timeout),
+                    breaker=get_breaker("dingtalk.gettoken"),
+                    should_retry=lambda r: r.status_code == 429 or r.status_code >= 500,
+                )
+                data = resp.json()
+                if data.get("errcode") == 0:
+                    return data["access_token"], time.time() + data["expires_in"]
+                logger.error(f"Failed to get token: {data}")
+            except Exception as e:
+                logger.error(f"Error fetching token: {e}")
+            fetch_stage.fail()
+            return None, 0
+
+    def _ensure_refresher(self):
+        if self._refresher is None:
+            with self._lock:
+                if self._refresher is None:
+                    self._refresher = threading.Thread(target=self._refresh_loop, name="dingtalk-token-refresh", daemon=True)
+                    self._refresher.start()
+
+    def _refresh_loop(self):
+        while not self._stop.is_set():
+            if self._token:
+                wait = self._expires_at - self.refresh_margin - time.time()
+            else:
+                wait = 0
+            if wait > 0:
+                if self._stop.wait(wait):
+                    return
+                continue
+
+            with self._lock:
+                # A caller (or another process, via the cache file) may have refreshed already
+                if not self._fresh() and not (self._load_from_file() and self._fresh()):
+                    self._refresh(force=True)
+                refreshed = self._fresh()
+
+            if not refreshed:
+                if self._stop.wait(self.RETRY_DELAY):
+                    return
+
+    def _load_from_file(self):
+        """Load a still-valid token from the cache file. Returns True on success."""
+        if not self.cache_file or not os.path.exists(self.cache_file):
+            return False
+        try:
+            with open(self.cache_file, "r", encoding="utf-8") as f:
+                data = json.load(f)
+            if data.get("app_key") != self.app_key:
+                return False
+            if time.time() >= data["expires_at"] - self.EXPIRY_BUFFER:
+                return False
+            if data["expires_at"] <= self._expires_at:
+                return bool(self._valid_token())
+            self._token = data["access_token"]
+            self._expires_at = data["expires_at"]
+            return True
+        except Exception as e:
+            logger.warning(f"Ignoring unreadable token cache file: {e}")
+            return False
+
+    def _save_to_file(self):
+        if not self.cache_file:
+            return
+        try:
+            tmp_path = f"{self.cache_file}.tmp.{os.getpid()}"
+            with open(tmp_path, "w", encoding="utf-8") as f:
+                json.dump({"app_key": self.app_key, "access_token": self._token, "expires_at": self._expires_at}, f)
+            # Atomic replace so readers never see a half-written file
+            os.replace(tmp_path, self.cache_file)
+        except Exception as e:
+            logger.warning(f"Could not write token cache file: {e}")
+
+    @contextmanager
+    def _file_lock(self):
+        """Cross-process lock around refreshes when a cache file is configured."""
+        if not self.cache_file or fcntl is None:
+            yield
+            return
+        with open(f"{self.cache_file}.lock", "a") as lock_file:
+            fcntl.flock(lock_file, fcntl.LOCK_EX)
+            try:
+                yield
+            finally:
+                fcntl.flock(lock_file, fcntl.LOCK_UN)
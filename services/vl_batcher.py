@@ -0,0 +1,97 @@
+import logging
+import threading
+import time
+from concurrent.futures import Future
+from services.metrics import VL_BATCH_SIZE
+
+logger = logging.getLogger(__name__)
+
+
+class Retry:
+    """
+    Batch result placeholder: analyze this image on its own with
+    `call_one(image_input, **kwargs)`, on its submitter's thread.
+    """
+
+    def __init__(self, **kwargs):
+        self.kwargs = kwargs
+
+
+class VLBatcher:
+    """
+    Micro-batches concurrent VL model requests.
+
+    Images submitted from different threads within `max_delay_ms` of each
+    other (up to `max_images`) are sent as one multi-image request. The
+    first submitter of a batch leads it: it waits for the batch to fill or
+    the delay to pass, makes the call on its own thread and hands every
+    other submitter its own result, so no extra threads are needed and the
+    number of calls in flight stays bounded by the callers. If a batch
+    reply can't be split back per image (or `call_batch` returns a `Retry`
+    for an image), each affected submitter retries its own image, so the
+    retries run concurrently instead of one after another in the leader.
+    """
+
+    def __init__(self, call_one, call_batch, max_images=4, max_delay_ms=200):
+        """
+        Args:
+            call_one: callable analyzing a single image input, returning its result
+            call_batch: callable taking a list of image inputs and returning their
+                results (or `Retry` placeholders) in the same order; raises if the
+                reply can't be split
+            max_images: send the batch as soon as this many images are waiting
+            max_delay_ms: send the batch once its first image has waited this long
+        """
+        self._call_one = call_one
+        self._call_batch = call_batch
+        self.max_images = max_images
+        self.max_delay = max_delay_ms / 1000.0
+        self._open = None  # batch still accepting images: [(image_input, future)]
+        self._cond = threading.Condition()
+
+    def submit(self, image_input):
+        """Analyze an image as part of a batch. Blocks until its result is available."""
+        future = Future()
+        with self._cond:
+            batch = self._open
+            leader = batch is None
+            if leader:
+                batch = self._open = []
+            batch.append((image_input, future))
+            if len(batch) >= self.max_images:
+                self._open = None
+                self._cond.notify_all()
+
+            if leader:
+                deadline = time.monotonic() + self.max_delay
+                while len(batch) < self.max_images:
+                    remaining = deadline - time.monotonic()
+                    if remaining <= 0:
+                        break
+                    self._cond.wait(remaining)
+                if self._open is batch:
+                    self._open = None
+
+        if leader:
+            self._run(batch)
+        result = future.result()
+        if isinstance(result, Retry):
+            return self._call_one(image_input, **result.kwargs)
+        return result
+
+    def _run(self, batch):
+        VL_BATCH_SIZE.observe(len(batch))
+        if len(batch) == 1:
+            # Nothing to batch: the leader's own call is the whole job
+            batch[0][1].set_result(Retry())
+            return
+
+        inputs = [image_input for image_input, _ in batch]
+        try:
+            results = self._call_batch(inputs)
+        except Exception as e:
+            logger.error(f"Batch of {len(batch)} images failed, retrying individually: {e}")
+            results = [Retry() for _ in batch]
+
+        for (_, future), result in zip(batch, results):
+            future.set_result(result)
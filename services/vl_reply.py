@@ -0,0 +1,138 @@
+"""
+Tolerant parsing of VL model replies.
+
+Models don't always answer with bare JSON: replies come wrapped in
+markdown fences or prose, use Python-style single quotes (the prompt's
+own {'error': ...} example), or return numbers as strings ("128 mmHg").
+The scanner finds the first balanced JSON value in the text, and can be
+fed a streamed reply chunk by chunk so reading stops as soon as the
+value is complete.
+"""
+import ast
+import json
+import re
+
+READING_KEYS = ("systolic", "diastolic", "pulse")
+
+_CLOSERS = {"{": "}", "[": "]"}
+_NUMBER = re.compile(r"-?\d+(?:\.\d+)?")
+
+
+def _loads(text):
+    """json.loads, falling back to Python literal syntax (single quotes, True/None)."""
+    try:
+        return json.loads(text)
+    except ValueError:
+        pass
+    try:
+        return ast.literal_eval(text)
+    except (ValueError, SyntaxError, MemoryError, RecursionError):
+        return None
+
+
+class JSONScanner:
+    """
+    Incrementally finds the first balanced JSON object (or array) in a text.
+
+        scanner = JSONScanner("{")
+        for chunk in stream:
+            value = scanner.feed(chunk)
+            if value is not None:
+                break
+        else:
+            value = scanner.finish()
+
+    Brackets inside quoted strings (single or double quotes) are ignored. A
+    balanced candidate that doesn't parse is skipped and scanning resumes
+    after its opening bracket; so does one still open when the text ends
+    (e.g. a stray "{" or an apostrophe in prose), once `finish()` is called.
+    """
+
+    def __init__(self, opener="{"):
+        if opener not in _CLOSERS:
+            raise ValueError(f"Unsupported opener: {opener!r}")
+        self.opener = opener
+        self.text = ""
+        self._pos = 0        # next character to scan
+        self._start = None   # index of the candidate's opening bracket
+        self._depth = 0
+        self._quote = None   # quote character while inside a string
+        self._escaped = False
+
+    def feed(self, chunk):
+        """Add text; return the parsed value once one is complete, else None."""
+        self.text += chunk
+        text = self.text
+        while self._pos < len(text):
+            ch = text[self._pos]
+            self._pos += 1
+            if self._start is None:
+                if ch == self.opener:
+                    self._start, self._depth = self._pos - 1, 1
+                continue
+            if self._quote is not None:
+                if self._escaped:
+                    self._escaped = False
+                elif ch == "\\":
+                    self._escaped = True
+                elif ch == self._quote:
+                    self._quote = None
+                continue
+            if ch in ("'", '"'):
+                self._quote = ch
+            elif ch in _CLOSERS:
+                self._depth += 1
+            elif ch in ("}", "]"):
+                self._depth -= 1
+                if self._depth == 0:
+                    value = _loads(text[self._start:self._pos])
+                    if isinstance(value, (dict, list)):
+                        return value
+                    # Not valid after all (e.g. prose in braces): look for the next candidate
+                    self._pos, self._start = self._start + 1, None
+        return None
+
+    def finish(self):
+        """Call at the end of the text: retry after candidates that never closed."""
+        while self._start is not None:
+            self._pos, self._start = self._start + 1, None
+            self._depth, self._quote, self._escaped = 0, None, False
+            value = self.feed("")
+            if value is not None:
+                return value
+        return None
+
+
+def extract_json(text, opener="{"):
+    """First balanced JSON object (or array, with opener='[') in `text`, or None."""
+    scanner = JSONScanner(opener)
+    value = scanner.feed(text or "")
+    return value if value is not None else scanner.finish()
+
+
+def _to_int(value):
+    if isinstance(value, bool):
+        return value
+    if isinstance(value, float) and value.is_integer():
+        return int(value)
+    if isinstance(value, str):
+        match = _NUMBER.search(value)
+        if match:
+            number = float(match.group())
+            return int(number) if number.is_integer() else value
+    return value
+
+
+def coerce_reading(data):
+    """
+    Normalize a parsed reading: lower-case keys and turn numeric strings or
+    whole floats ("128", "128 mmHg", 128.0) into ints. Other values are left
+    as they are for the plausibility check to reject.
+    """
+    if not isinstance(data, dict):
+        return data
+    reading = {str(key).lower(): value for key, value in data.items()}
+    for key in READING_KEYS:
+        if key in reading:
+            reading[key] = _to_int(reading[key])
+    return reading
@@ -0,0 +1,132 @@
+import asyncio
+import logging
+import signal
+from config import Config
+from services.handlers import MessageHandler
+from services.job_queue import JobQueue
+from services.metrics import start_metrics_server
+from services.resilience import CircuitBreaker
+
+logger = logging.getLogger(__name__)
+
+
+class Worker:
+    """
+    Worker process in supervisor mode.
+
+    Claims picture jobs from the shared JobQueue and runs them with the
+    regular MessageHandler (ANALYSIS_WORKERS at a time), publishing a
+    heartbeat every WORKER_HEARTBEAT_INTERVAL seconds. While the VL circuit
+    is open no jobs are claimed, and while it is half-open only one at a
+    time, so a backlog isn't released onto a recovering service all at
+    once (each worker process sends at most one probe). A job parked when
+    the circuit opens is put back in the queue with a delay before its own
+    row is completed, so it is never only in memory. On SIGTERM/SIGINT it
+    stops claiming, finishes the jobs in hand and exits.
+    """
+
+    def __init__(self, worker_id, concurrency):
+        self.worker_id = worker_id
+        self.concurrency = concurrency
+        self.queue = JobQueue(Config.JOB_QUEUE_PATH, max_queue_size=Config.ANALYSIS_QUEUE_SIZE)
+        # Parked jobs go back through the shared queue
+        self.handler = MessageHandler(job_queue=self.queue)
+        self.active = 0
+        self.processed = 0
+        self.failed = 0
+        self._stopping = None
+        self._probing = False
+
+    def _heartbeat(self, state):
+        self.queue.heartbeat(self.worker_id, state, self.active, self.processed, self.failed)
+
+    async def run(self):
+        self._stopping = asyncio.Event()
+        loop = asyncio.get_running_loop()
+        for sig in (signal.SIGTERM, signal.SIGINT):
+            loop.add_signal_handler(sig, self._stopping.set)
+
+        await self.handler._run_blocking(self._heartbeat, "running")
+        heartbeat_task = asyncio.create_task(self._heartbeat_loop())
+        logger.info(f"{self.worker_id} started with {self.concurrency} slots")
+
+        await asyncio.gather(*(self._consume() for _ in range(self.concurrency)))
+
+        logger.info(f"{self.worker_id} draining")
+        heartbeat_task.cancel()
+        await self._drain()
+        await self.handler._run_blocking(self._heartbeat, "stopped")
+        self.handler.executor.shutdown(wait=True)
+        self.handler.db.close()
+        self.handler.dt_api.close()
+        self.queue.close()
+        logger.info(f"{self.worker_id} stopped ({self.processed} processed, {self.failed} failed)")
+
+    async def _heartbeat_loop(self):
+        while True:
+            try:
+                await self.handler._run_blocking(self._heartbeat, "running")
+            except Exception as e:
+                logger.error(f"{self.worker_id} heartbeat failed: {e}")
+            await asyncio.sleep(Config.WORKER_HEARTBEAT_INTERVAL)
+
+    async def _idle(self):
+        """Wait one poll interval, but wake immediately on shutdown."""
+        try:
+            await asyncio.wait_for(self._stopping.wait(), Config.JOB_QUEUE_POLL_INTERVAL)
+        except asyncio.TimeoutError:
+            pass
+
+    async def _consume(self):
+        while not self._stopping.is_set():
+            # Every picture job needs the VL service: while its circuit is open, leave jobs
+            # in the queue rather than claiming them only to park them again. Half-open,
+            # one slot claims a single probe job; the rest wait until the circuit closes.
+            state = self.handler.vl_breaker.state
+            probe = state == CircuitBreaker.HALF_OPEN
+            if state == CircuitBreaker.OPEN or (probe and self._probing):
+                await self._idle()
+                continue
+            self._probing = self._probing or probe
+
+            try:
+                claimed = await self.handler._run_blocking(self.queue.claim, self.worker_id)
+            except Exception as e:
+                logger.error(f"{self.worker_id} failed to claim a job: {e}")
+                claimed = None
+            if claimed is None:
+                if probe:
+                    self._probing = False
+                await self._idle()
+                continue
+
+            job_id, job = claimed
+            self.active += 1
+            try:
+                await self.handler._run_picture_job(job)
+                await self.handler._run_blocking(self.queue.complete, job_id)
+                self.processed += 1
+            except Exception as e:
+                logger.error(f"{self.worker_id} failed on job {job_id}: {e}")
+                await self.handler._run_blocking(self.queue.fail, job_id, e)
+                # Terminal, so the journal can prune the job's checkpoints
+                await self.handler._journal(job, "failed")
+                self.failed += 1
+            finally:
+                self.active -= 1
+                if probe:
+                    self._probing = False
+
+    async def _drain(self):
+        """Finish background replies."""
+        if self.handler._background_tasks:
+            await asyncio.gather(*self.handler._background_tasks, return_exceptions=True)
+
+
+def run_worker(index):
+    """Entry point of a worker process started by the supervisor."""
+    logging.basicConfig(level=logging.INFO, format=f'%(asctime)s - worker-{index} - %(name)s - %(levelname)s - %(message)s')
+    if Config.METRICS_ENABLED:
+        # Each worker serves its own stage metrics on the port after the supervisor's
+        start_metrics_server(Config.METRICS_HOST, Config.METRICS_PORT + 1 + index)
+    asyncio.run(Worker(f"worker-{index}", Config.ANALYSIS_WORKERS).run())
@@ -0,0 +1,104 @@
+import atexit
+import logging
+import threading
+import time
+from concurrent.futures import Future
+
+logger = logging.getLogger(__name__)
+
+
+class WriteBuffer:
+    """
+    Write-behind buffer with group commit.
+
+    Rows submitted from any thread are collected and handed to `flush_fn`
+    as one batch (one transaction) once `max_rows` rows are waiting or the
+    oldest row has waited `max_delay_ms` milliseconds. Each submit returns a
+    Future resolved with the row's ID after its batch has committed, so
+    callers still see durable writes. Pending rows are flushed on close()
+    and at interpreter exit.
+    """
+
+    def __init__(self, flush_fn, max_rows=50, max_delay_ms=50):
+        """
+        Args:
+            flush_fn: callable taking a list of rows, writing them in one
+                transaction and returning their IDs in the same order
+            max_rows: flush as soon as this many rows are waiting
+            max_delay_ms: flush once the oldest row has waited this long
+        """
+        self._flush_fn = flush_fn
+        self.max_rows = max_rows
+        self.max_delay = max_delay_ms / 1000.0
+        self._pending = []  # (row, future, submitted_at)
+        self._cond = threading.Condition()
+        self._closed = False
+        self._thread = threading.Thread(target=self._run, name="bp-write-buffer", daemon=True)
+        self._thread.start()
+        atexit.register(self.close)
+
+    def submit(self, row):
+        """Queue a row for writing. Returns a Future resolving to its ID."""
+        future = Future()
+        with self._cond:
+            if self._closed:
+                raise RuntimeError("Write buffer is closed")
+            self._pending.append((row, future, time.monotonic()))
+            if len(self._pending) >= self.max_rows:
+                self._cond.notify()
+            elif len(self._pending) == 1:
+                # Wake the flusher so it starts the delay timer for this batch
+                self._cond.notify()
+        return future
+
+    def close(self):
+        """Flush everything still pending and stop the flusher thread."""
+        with self._cond:
+            if self._closed:
+                return
+            self._closed = True
+            self._cond.notify()
+        self._thread.join()
+
+    def _next_batch(self):
+        with self._cond:
+            while True:
+                if self._pending:
+                    if self._closed or len(self._pending) >= self.max_rows:
+                        break
+                    wait = self._pending[0][2] + self.max_delay - time.monotonic()
+                    if wait <= 0:
+                        break
+                    self._cond.wait(wait)
+                elif self._closed:
+                    return None
+                else:
+                    self._cond.wait()
+
+            batch = self._pending[:self.max_rows]
+            self._pending = self._pending[self.max_rows:]
+            return batch
+
+    def _run(self):
+        while True:
+            batch = self._next_batch()
+            if batch is None:
+                return
+            self._write(batch)
+
+    def _write(self, batch):
+        rows = [row for row, _, _ in batch]
+        try:
+            ids = self._flush_fn(rows)
+        except Exception as e:
+            if len(batch) == 1:
+                batch[0][1].set_exception(e)
+                return
+            # Don't let one bad row fail the whole group: retry each row on its own
+            logger.error(f"Group commit of {len(batch)} rows failed, retrying individually: {e}")
+            for item in batch:
+                self._write([item])
+            return
+
+        for (_, future, _), row_id in zip(batch, ids):
+            future.set_result(row_id)
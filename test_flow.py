@@ -8,15 +8,8 @@ from unittest.mock import MagicMock, patch
 from dotenv import load_dotenv
 load_dotenv()
 
-# Mock only DingTalk components, let DashScope/Requests be real
-sys.modules["dingtalk_stream"] = MagicMock()
-# sys.modules["sys.modules"] = MagicMock() # Don't mock sys
-
-# Setup DingTalk Stream Mock values
-sys.modules["dingtalk_stream"].AckMessage.STATUS_OK = 0
-sys.modules["dingtalk_stream"].AckMessage.STATUS_FAIL = 1
-
-from services.handlers import CallbackHandler
+# MessageHandler doesn't need the DingTalk stream SDK; DashScope/Requests stay real
+from services.handlers import MessageHandler
 from config import Config
 
 logging.basicConfig(level=logging.INFO)
@@ -40,7 +33,7 @@ async def test_flow():
         mock_api.send_text_message.return_value = True
         
         # Initialize Handler
-        handler = CallbackHandler()
+        handler = MessageHandler()
         
         # 1. Test Image Message
         print(f"\n[Test] Testing Image Analysis for URL: {real_image_url}")
@@ -55,6 +48,8 @@ async def test_flow():
         
         # This will call the REAL ImageAnalyzer, which calls REAL DashScope
         await handler.process(image_event)
+        # Analysis runs on the scheduler's workers; wait for it to finish
+        await handler.scheduler.join()
         
         # Verify DB insertion
         records = handler.db.get_user_history("user123")
@@ -0,0 +1,101 @@
+import os
+import sqlite3
+import time
+
+import pytest
+
+from services.job_queue import JobQueue
+from services.scheduler import QueueFullError
+
+
+@pytest.fixture
+def queue(tmp_path):
+    queue = JobQueue(str(tmp_path / "jobs.db"), capacity=1, max_queue_size=3)
+    yield queue
+    queue.close()
+
+
+def test_claims_by_priority_then_fifo(queue):
+    queue.put({"n": 1}, JobQueue.PRIORITY_NORMAL)
+    queue.put({"n": 2}, JobQueue.PRIORITY_NORMAL)
+    queue.put({"n": 3}, JobQueue.PRIORITY_HIGH)
+
+    claimed = [queue.claim("w1")[1]["n"] for _ in range(3)]
+    assert claimed == [3, 1, 2]
+    assert queue.claim("w1") is None
+    assert queue.counts() == {"pending": 0, "running": 3, "failed": 0}
+
+
+def test_a_job_is_claimed_once(queue):
+    queue.put({"n": 1})
+    assert queue.claim("w1") is not None
+    assert queue.claim("w2") is None
+
+
+def test_submit_reports_position_and_rejects_when_full(queue):
+    assert queue.submit({"n": 1}) == 0
+    assert queue.submit({"n": 2}) == 1
+    assert queue.submit({"n": 3}) == 2
+    with pytest.raises(QueueFullError):
+        queue.submit({"n": 4})
+
+
+def test_complete_and_fail(queue):
+    first = queue.put({"n": 1})
+    second = queue.put({"n": 2})
+    queue.claim("w1")
+    queue.claim("w1")
+    queue.complete(first)
+    queue.fail(second, ValueError("boom"))
+    assert queue.counts() == {"pending": 0, "running": 0, "failed": 1}
+
+
+def test_delayed_job_is_not_claimable_early(queue):
+    queue.put({"n": 1}, delay=0.2)
+    assert queue.claim("w1") is None
+    time.sleep(0.25)
+    assert queue.claim("w1")[1] == {"n": 1}
+
+
+def test_requeue_running_for_one_worker_or_all(queue):
+    for n in range(3):
+        queue.put({"n": n})
+    queue.claim("w1")
+    queue.claim("w2")
+    queue.claim("w2")
+
+    assert queue.requeue_running("w2") == 2
+    assert queue.counts() == {"pending": 2, "running": 1, "failed": 0}
+    assert queue.requeue_running() == 1
+    assert queue.counts() == {"pending": 3, "running": 0, "failed": 0}
+
+
+def test_shared_between_instances(tmp_path):
+    path = str(tmp_path / "jobs.db")
+    supervisor, worker = JobQueue(path), JobQueue(path)
+    supervisor.submit({"n": 1})
+    assert worker.claim("w1")[1] == {"n": 1}
+    worker.heartbeat("w1", "running", active=1, processed=2, failed=0)
+    status = supervisor.worker_status()
+    assert [(s["worker_id"], s["state"], s["pid"], s["processed"]) for s in status] == [("w1", "running", os.getpid(), 2)]
+    supervisor.close()
+    worker.close()
+
+
+def test_migrates_queue_files_without_available_at(tmp_path):
+    path = str(tmp_path / "old.db")
+    conn = sqlite3.connect(path)
+    conn.execute("""
+        CREATE TABLE jobs (
+            id INTEGER PRIMARY KEY AUTOINCREMENT, priority INTEGER NOT NULL, payload TEXT NOT NULL,
+            status TEXT NOT NULL DEFAULT 'pending', worker_id TEXT, attempts INTEGER NOT NULL DEFAULT 0,
+            error TEXT, created_at REAL NOT NULL, claimed_at REAL
+        )
+    """)
+    conn.execute("INSERT INTO jobs (priority, payload, created_at) VALUES (1, '{\"n\": 1}', 0)")
+    conn.commit()
+    conn.close()
+
+    queue = JobQueue(path)
+    assert queue.claim("w1")[1] == {"n": 1}
+    queue.close()
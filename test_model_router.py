@@ -0,0 +1,64 @@
+import pytest
+
+from services.model_router import ModelRouter
+
+
+def record_many(router, model, count, latency, ok):
+    for _ in range(count):
+        router.record(model, latency, ok)
+
+
+def test_needs_at_least_one_model():
+    with pytest.raises(ValueError):
+        ModelRouter([])
+
+
+def test_plans_every_model_until_there_is_data():
+    router = ModelRouter(["cheap", "mid", "best"], min_calls=5, probe_interval=0)
+    assert router.plan() == ["cheap", "mid", "best"]
+    assert router.plan(start=1) == ["mid", "best"]
+
+
+def test_skips_a_model_with_a_low_success_rate():
+    router = ModelRouter(["cheap", "best"], min_calls=5, min_success_rate=0.7, probe_interval=0)
+    record_many(router, "cheap", 5, 0.5, False)
+    record_many(router, "best", 5, 2.0, True)
+    assert router.plan() == ["best"]
+
+
+def test_skips_a_model_that_is_not_worth_its_latency():
+    router = ModelRouter(["cheap", "best"], min_calls=5, min_success_rate=0.5, latency_slack=1.2, probe_interval=0)
+    # 1.9s + 20% * 2.0s = 2.3s expected, against 1.2 * 2.0s = 2.4s: still worth it
+    record_many(router, "cheap", 4, 1.9, True)
+    router.record("cheap", 1.9, False)
+    record_many(router, "best", 5, 2.0, True)
+    assert router.plan() == ["cheap", "best"]
+
+    # Slower now: 2.3s + 20% * 2.0s = 2.7s expected, more than 2.4s
+    record_many(router, "cheap", 4, 2.7, True)
+    router.record("cheap", 2.7, False)
+    assert router.plan() == ["best"]
+
+
+def test_probe_plan_includes_skipped_models():
+    router = ModelRouter(["cheap", "best"], min_calls=1, probe_interval=3)
+    router.record("cheap", 0.5, False)
+    router.record("best", 2.0, True)
+    assert [router.plan() for _ in range(3)] == [["best"], ["best"], ["cheap", "best"]]
+
+
+def test_last_model_is_always_planned():
+    router = ModelRouter(["cheap", "best"], min_calls=1, probe_interval=0)
+    router.record("best", 2.0, False)
+    assert router.plan()[-1] == "best"
+
+
+def test_stats_over_the_rolling_window():
+    router = ModelRouter(["cheap", "best"], window=2)
+    router.record("cheap", 1.0, False)
+    router.record("cheap", 2.0, True)
+    router.record("cheap", 4.0, True)
+    router.record("unknown", 1.0, True)
+    stats = router.stats()
+    assert stats["cheap"] == {"calls": 2, "success_rate": 1.0, "mean_latency": 3.0}
+    assert stats["best"] == {"calls": 0, "success_rate": None, "mean_latency": None}
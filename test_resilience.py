@@ -0,0 +1,119 @@
+import time
+
+import pytest
+
+from services.resilience import CircuitBreaker, CircuitOpenError, call_with_retry
+
+
+def open_breaker(**kwargs):
+    breaker = CircuitBreaker("test", failure_rate=0.5, window=4, min_calls=2, **kwargs)
+    breaker.record_failure()
+    breaker.record_failure()
+    return breaker
+
+
+def test_breaker_opens_at_the_failure_rate():
+    breaker = CircuitBreaker("test", failure_rate=0.5, window=4, min_calls=4, reset_timeout=60)
+    breaker.record_success()
+    breaker.record_failure()
+    breaker.record_success()
+    assert breaker.state == CircuitBreaker.CLOSED
+    breaker.record_failure()
+    assert breaker.state == CircuitBreaker.OPEN
+    with pytest.raises(CircuitOpenError):
+        breaker.before_call()
+
+
+def test_half_open_lets_a_single_probe_through():
+    breaker = open_breaker(reset_timeout=0.05)
+    time.sleep(0.06)
+    assert breaker.state == CircuitBreaker.HALF_OPEN
+
+    breaker.before_call()
+    with pytest.raises(CircuitOpenError):
+        breaker.before_call()
+    assert breaker.state == CircuitBreaker.HALF_OPEN
+
+
+def test_successful_probe_closes_the_circuit():
+    breaker = open_breaker(reset_timeout=0.05)
+    time.sleep(0.06)
+    breaker.before_call()
+    breaker.record_success()
+    assert breaker.state == CircuitBreaker.CLOSED
+    breaker.before_call()
+    breaker.before_call()
+
+
+def test_failed_probe_opens_the_circuit_again():
+    breaker = open_breaker(reset_timeout=0.05)
+    time.sleep(0.06)
+    breaker.before_call()
+    breaker.record_failure()
+    assert breaker.state == CircuitBreaker.OPEN
+    with pytest.raises(CircuitOpenError):
+        breaker.before_call()
+
+
+def test_retry_until_success():
+    calls = []
+
+    def flaky():
+        calls.append(1)
+        if len(calls) < 3:
+            raise ConnectionError("reset")
+        return "ok"
+
+    assert call_with_retry(flaky, max_attempts=5, base_delay=0, max_delay=0) == "ok"
+    assert len(calls) == 3
+
+
+def test_retry_gives_up_with_the_last_error():
+    calls = []
+
+    def failing():
+        calls.append(1)
+        raise ConnectionError(f"attempt {len(calls)}")
+
+    with pytest.raises(ConnectionError, match="attempt 2"):
+        call_with_retry(failing, max_attempts=2, base_delay=0, max_delay=0)
+
+
+def test_retry_returns_the_last_failed_result():
+    results = iter([500, 503, 502])
+    assert call_with_retry(lambda: next(results), should_retry=lambda status: status >= 500,
+                           max_attempts=3, base_delay=0, max_delay=0) == 502
+
+
+def test_single_attempt():
+    calls = []
+    assert call_with_retry(lambda: calls.append(1) or 500, should_retry=lambda status: status >= 500,
+                           max_attempts=1, base_delay=0, max_delay=0) == 500
+    assert calls == [1]
+
+
+def test_retry_stops_at_the_deadline():
+    calls = []
+
+    def failing():
+        calls.append(1)
+        raise ConnectionError("down")
+
+    with pytest.raises(ConnectionError):
+        call_with_retry(failing, max_attempts=100, base_delay=0.05, max_delay=0.05, deadline=0)
+    assert calls == [1]
+
+
+def test_retry_records_outcomes_and_respects_an_open_breaker():
+    breaker = CircuitBreaker("test", failure_rate=0.5, window=4, min_calls=2, reset_timeout=60)
+    calls = []
+
+    def failing():
+        calls.append(1)
+        raise ConnectionError("down")
+
+    with pytest.raises(CircuitOpenError):
+        call_with_retry(failing, breaker=breaker, max_attempts=5, base_delay=0, max_delay=0)
+    # Two failures open the circuit; the third attempt fails fast without calling
+    assert len(calls) == 2
+    assert breaker.state == CircuitBreaker.OPEN
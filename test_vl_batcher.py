@@ -0,0 +1,90 @@
+import threading
+import time
+
+from services.vl_batcher import Retry, VLBatcher
+
+
+def submit_concurrently(batcher, inputs):
+    """Submit each input from its own thread; returns {input: result or exception}."""
+    results = {}
+
+    def run(image_input):
+        try:
+            results[image_input] = batcher.submit(image_input)
+        except Exception as e:
+            results[image_input] = e
+
+    threads = [threading.Thread(target=run, args=(image_input,)) for image_input in inputs]
+    for thread in threads:
+        thread.start()
+    for thread in threads:
+        thread.join(timeout=5)
+    return results
+
+
+def test_single_image_is_analyzed_alone():
+    calls = []
+    batcher = VLBatcher(lambda x: calls.append(("one", x)) or f"one:{x}",
+                        lambda xs: calls.append(("batch", xs)) or [f"batch:{x}" for x in xs],
+                        max_images=4, max_delay_ms=10)
+    assert batcher.submit("a") == "one:a"
+    assert calls == [("one", "a")]
+
+
+def test_concurrent_images_share_one_batch_call():
+    batch_calls = []
+
+    def call_batch(inputs):
+        batch_calls.append(sorted(inputs))
+        return [f"batch:{x}" for x in inputs]
+
+    batcher = VLBatcher(lambda x: f"one:{x}", call_batch, max_images=3, max_delay_ms=2000)
+    results = submit_concurrently(batcher, ["a", "b", "c"])
+
+    assert results == {"a": "batch:a", "b": "batch:b", "c": "batch:c"}
+    assert batch_calls == [["a", "b", "c"]]
+
+
+def test_failed_batch_is_retried_per_image_concurrently():
+    def call_batch(inputs):
+        raise ValueError("reply can't be split")
+
+    def call_one(image_input):
+        time.sleep(0.3)
+        return f"one:{image_input}"
+
+    batcher = VLBatcher(call_one, call_batch, max_images=3, max_delay_ms=2000)
+    started = time.monotonic()
+    results = submit_concurrently(batcher, ["a", "b", "c"])
+
+    assert results == {"a": "one:a", "b": "one:b", "c": "one:c"}
+    # Each submitter retries its own image, so the retries overlap
+    assert time.monotonic() - started < 0.8
+
+
+def test_retry_placeholder_is_run_by_its_submitter_with_kwargs():
+    one_calls = []
+
+    def call_one(image_input, start=0):
+        one_calls.append((image_input, start))
+        return f"one:{image_input}:{start}"
+
+    batcher = VLBatcher(call_one, lambda xs: [Retry(start=1) if x == "b" else f"batch:{x}" for x in xs],
+                        max_images=2, max_delay_ms=2000)
+    results = submit_concurrently(batcher, ["a", "b"])
+
+    assert results == {"a": "batch:a", "b": "one:b:1"}
+    assert one_calls == [("b", 1)]
+
+
+def test_retry_errors_reach_only_their_own_submitter():
+    def call_one(image_input):
+        if image_input == "b":
+            raise RuntimeError("boom")
+        return f"one:{image_input}"
+
+    batcher = VLBatcher(call_one, lambda xs: [Retry() for _ in xs], max_images=2, max_delay_ms=2000)
+    results = submit_concurrently(batcher, ["a", "b"])
+
+    assert results["a"] == "one:a"
+    assert isinstance(results["b"], RuntimeError)
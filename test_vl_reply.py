@@ -0,0 +1,53 @@
+import pytest
+
+from services.vl_reply import JSONScanner, coerce_reading, extract_json
+
+
+@pytest.mark.parametrize("text, expected", [
+    ('{"systolic": 120, "diastolic": 80, "pulse": 70}', {"systolic": 120, "diastolic": 80, "pulse": 70}),
+    ('```json\n{"systolic": 120}\n```', {"systolic": 120}),
+    ("{'error': 'Not a blood pressure monitor'}", {"error": "Not a blood pressure monitor"}),
+    ('The reading is {"note": "a } inside a string", "systolic": 1}.', {"note": "a } inside a string", "systolic": 1}),
+    # A balanced candidate that isn't JSON is skipped
+    ('{see below} {"systolic": 1}', {"systolic": 1}),
+    # Candidates that never close are backtracked past
+    ('Note: {see below. {"systolic": 120, "diastolic": 80, "pulse": 70}', {"systolic": 120, "diastolic": 80, "pulse": 70}),
+    ("Reading { it's blurry } {\"systolic\":1}", {"systolic": 1}),
+])
+def test_extract_json(text, expected):
+    assert extract_json(text) == expected
+
+
+@pytest.mark.parametrize("text", ["", None, "no json here", "{ never closed", "{not json}"])
+def test_extract_json_without_a_value(text):
+    assert extract_json(text) is None
+
+
+def test_extract_json_array():
+    assert extract_json('Results: [{"systolic": 1}, {"systolic": 2}]', opener="[") == [{"systolic": 1}, {"systolic": 2}]
+
+
+def test_scanner_returns_as_soon_as_the_value_is_complete():
+    scanner = JSONScanner("{")
+    chunks = ['Sure: {"systolic": 12', '0, "diastolic": 80}', " trailing text"]
+    assert scanner.feed(chunks[0]) is None
+    assert scanner.feed(chunks[1]) == {"systolic": 120, "diastolic": 80}
+
+
+def test_scanner_finish_backtracks_at_end_of_stream():
+    scanner = JSONScanner("{")
+    for chunk in ["Note: {see ", 'below. {"systolic": ', "120}"]:
+        assert scanner.feed(chunk) is None
+    assert scanner.finish() == {"systolic": 120}
+    assert JSONScanner("{").finish() is None
+
+
+def test_unsupported_opener():
+    with pytest.raises(ValueError):
+        JSONScanner("(")
+
+
+def test_coerce_reading():
+    reading = coerce_reading({"Systolic": "128 mmHg", "DIASTOLIC": 82.0, "pulse": "n/a", "extra": "1"})
+    assert reading == {"systolic": 128, "diastolic": 82, "pulse": "n/a", "extra": "1"}
+    assert coerce_reading(["not", "a", "dict"]) == ["not", "a", "dict"]
@@ -0,0 +1,63 @@
+import threading
+
+import pytest
+
+from services.write_buffer import WriteBuffer
+
+
+class FakeStore:
+    """flush_fn stand-in: records each batch, fails any batch containing a "bad" row."""
+
+    def __init__(self):
+        self.batches = []
+        self.next_id = 1
+        self.lock = threading.Lock()
+
+    def flush(self, rows):
+        with self.lock:
+            self.batches.append(list(rows))
+            if "bad" in rows:
+                raise ValueError("bad row")
+            ids = list(range(self.next_id, self.next_id + len(rows)))
+            self.next_id += len(rows)
+            return ids
+
+
+def test_full_batch_is_written_in_one_call():
+    store = FakeStore()
+    buffer = WriteBuffer(store.flush, max_rows=3, max_delay_ms=5000)
+    futures = [buffer.submit(row) for row in ("a", "b", "c")]
+    assert [f.result(timeout=2) for f in futures] == [1, 2, 3]
+    assert store.batches == [["a", "b", "c"]]
+    buffer.close()
+
+
+def test_partial_batch_is_flushed_after_the_delay():
+    store = FakeStore()
+    buffer = WriteBuffer(store.flush, max_rows=50, max_delay_ms=20)
+    assert buffer.submit("a").result(timeout=2) == 1
+    assert store.batches == [["a"]]
+    buffer.close()
+
+
+def test_failed_group_commit_retries_rows_individually():
+    store = FakeStore()
+    buffer = WriteBuffer(store.flush, max_rows=3, max_delay_ms=5000)
+    futures = [buffer.submit(row) for row in ("a", "bad", "c")]
+
+    assert futures[0].result(timeout=2) is not None
+    assert futures[2].result(timeout=2) is not None
+    with pytest.raises(ValueError):
+        futures[1].result(timeout=2)
+    assert store.batches == [["a", "bad", "c"], ["a"], ["bad"], ["c"]]
+    buffer.close()
+
+
+def test_close_flushes_pending_rows_and_rejects_new_ones():
+    store = FakeStore()
+    buffer = WriteBuffer(store.flush, max_rows=50, max_delay_ms=60000)
+    future = buffer.submit("a")
+    buffer.close()
+    assert future.result(timeout=0) == 1
+    with pytest.raises(RuntimeError):
+        buffer.submit("b")